@@ -1,11 +1,44 @@
-from flask import Flask, request, render_template, jsonify
+import time
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, Response, request, render_template, jsonify, g
 import base64
+import datetime
+import hmac
 import zipfile
 import io
 import os
 import logging
 from lxml import etree
 import json
+import threading
+import atexit
+import signal
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+import blobs
+import cold
+import dedup
+import events
+import faults
+import export
+import indexes
+import ingest
+import lotes
+import metrics
+import persistence
+import profiling
+import query
+import records
+import sesxml
+import shards
+import store
+from ingest import IngestError
+from sesxml import find_local_node, get_local_text, parse_ses_xml
 
 # GCS Imports
 try:
@@ -23,366 +56,1378 @@ logger = logging.getLogger(__name__)
 # Configuration
 DATA_FILE = "requests.json"
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "ses-mock-server-data-52284878557")
+# "log" (append-only segmented JSONL), "json" (legacy single requests.json rewrite)
+# or "sqlite" (WAL-mode database shared by several gunicorn workers)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "log")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "requests.sqlite3")
+# Start serving from compact summaries and read full records on demand / in the background
+LAZY_LOAD = os.environ.get("LAZY_LOAD", "1") == "1"
+LOG_DIR = os.environ.get("LOG_DIR", "requests_log")
+LOG_SEGMENT_MAX_BYTES = int(os.environ.get("LOG_SEGMENT_MAX_BYTES", 4 * 1024 * 1024))
+LOG_COMPACTION_INTERVAL = int(os.environ.get("LOG_COMPACTION_INTERVAL", 300))
+# The json and log backends keep every codigoArrendador apart under SHARD_DIR (a file,
+# or a log directory, per arrendador); the first start splits requests.json or LOG_DIR
+SHARD_DIR = os.environ.get("SHARD_DIR", "shards")
+# Raw inner XML is kept once per distinct document, compressed, keyed by SHA-256
+XML_BLOB_DIR = os.environ.get("XML_BLOB_DIR", "xml_blobs")
+XML_CACHE_BYTES = int(os.environ.get("XML_CACHE_BYTES", 16 * 1024 * 1024))
+# Local directory used instead of GCS (tests and offline runs)
+GCS_FAKE_DIR = os.environ.get("GCS_FAKE_DIR")
+# Write-behind uploads: at most one upload per object every PERSIST_INTERVAL seconds,
+# sooner once PERSIST_MAX_DIRTY objects are pending. PERSIST_WRITE_BEHIND=0 uploads inline.
+PERSIST_WRITE_BEHIND = os.environ.get("PERSIST_WRITE_BEHIND", "1") == "1"
+PERSIST_INTERVAL = float(os.environ.get("PERSIST_INTERVAL", 5))
+PERSIST_MAX_DIRTY = int(os.environ.get("PERSIST_MAX_DIRTY", 100))
+PERSIST_SHUTDOWN_TIMEOUT = float(os.environ.get("PERSIST_SHUTDOWN_TIMEOUT", 8))
+
+# Streaming ingest and its limits (bytes; ratio is uncompressed:compressed). Streaming
+# bounds the memory of the envelope, base64 and ZIP stages; the inner XML is still held
+# whole, as text and as a parsed tree (see ingest.py).
+STREAMING_INGEST = os.environ.get("STREAMING_INGEST", "1") == "1"
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 50 * 1024 * 1024))
+MAX_UNCOMPRESSED_BYTES = int(os.environ.get("MAX_UNCOMPRESSED_BYTES", 200 * 1024 * 1024))
+MAX_COMPRESSION_RATIO = int(os.environ.get("MAX_COMPRESSION_RATIO", 100))
+ingest_limits = ingest.IngestLimits(MAX_BODY_BYTES, MAX_UNCOMPRESSED_BYTES, MAX_COMPRESSION_RATIO)
+
+# Acknowledge comunicaciones once the envelope is valid and process them on a bounded
+# queue (503 + Retry-After when INGEST_QUEUE_SIZE lotes are waiting). ASYNC_INGEST=0 processes inline.
+ASYNC_INGEST = os.environ.get("ASYNC_INGEST", "1") == "1"
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 1000))
+
+# Retried comunicaciones (same cabecera and ZIP) get the original response for
+# DEDUP_TTL_SECONDS, up to DEDUP_MAX_ENTRIES remembered submissions (0 disables)
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", 10000))
+DEDUP_TTL_SECONDS = float(os.environ.get("DEDUP_TTL_SECONDS", 600))
+
+# Fault injection on the comunicacion endpoint (see faults.py), set at runtime through
+# /admin/faults or at startup with FAULT_PROFILES ({"global": {...}, "arrendadores": {...}}).
+# A held (delayed or dripped) response leaves at once with headers telling the
+# asynchronous front (front.py) how to hold it, so it keeps no gunicorn thread;
+# without the front (app.run, a bare gunicorn) it is not held.
+FAULT_PROFILES = os.environ.get("FAULT_PROFILES")
+
+# On-demand profiler (see profiling.py): off until configured through /admin/profiler
+# or at startup with PROFILER_CONFIG. Every /admin/ endpoint requires ADMIN_TOKEN as a
+# bearer token, and without ADMIN_TOKEN they are all disabled (404).
+PROFILER_CONFIG = os.environ.get("PROFILER_CONFIG")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Batch ingestion: request size, lotes per request and parser processes (1 parses inline)
+MAX_BATCH_BODY_BYTES = int(os.environ.get("MAX_BATCH_BODY_BYTES", 500 * 1024 * 1024))
+MAX_BATCH_LOTES = int(os.environ.get("MAX_BATCH_LOTES", 10000))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+BATCH_MIN_PARALLEL = 8  # below this a pool round trip costs more than it saves
+batch_limits = ingest.IngestLimits(MAX_BATCH_BODY_BYTES, MAX_UNCOMPRESSED_BYTES, MAX_COMPRESSION_RATIO)
+
+# Dashboard live updates: the change feed front.py polls (/events/poll) to serve /events,
+# with the changes kept for it to catch up and the most it takes per poll
+EVENTS_HISTORY = int(os.environ.get("EVENTS_HISTORY", 1000))
+EVENTS_POLL_MAX = 500
+
+# Retention: the in-memory view keeps at most RETENTION_MAX_REQUESTS requests, none older
+# than RETENTION_MAX_AGE_HOURS and about RETENTION_MAX_BYTES of records (0 = no limit).
+# Older requests move to the cold archive in COLD_DIR, RETENTION_BATCH at a time.
+RETENTION_MAX_REQUESTS = int(os.environ.get("RETENTION_MAX_REQUESTS", 0))
+RETENTION_MAX_AGE_HOURS = float(os.environ.get("RETENTION_MAX_AGE_HOURS", 0))
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", 0))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 30))
+RETENTION_BATCH = int(os.environ.get("RETENTION_BATCH", 500))
+COLD_DIR = os.environ.get("COLD_DIR", "cold_archive")
+COLD_SEGMENT_RECORDS = int(os.environ.get("COLD_SEGMENT_RECORDS", 5000))
+
+# /export/<format>: content type, file extension and line generator
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson; charset=utf-8", "ndjson", export.ndjson_lines),
+    "csv": ("text/csv; charset=utf-8", "csv", export.csv_lines),
+}
+
+# Metrics (exposed on /metrics, per process)
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "ses_request_duration_seconds", "Time to answer an HTTP request.", ["endpoint", "status"])
+INGEST_STAGE_SECONDS = metrics.REGISTRY.histogram(
+    "ses_ingest_stage_seconds", "Time per ingest stage: envelope (SOAP + base64), unzip, parse, persist.", ["stage"])
+PAYLOAD_BYTES = metrics.REGISTRY.histogram(
+    "ses_payload_bytes", "Size of submitted request bodies.", ["endpoint"], buckets=metrics.BYTES_BUCKETS)
+LOTES_TOTAL = metrics.REGISTRY.counter(
+    "ses_lotes_total", "Lotes by outcome: accepted, rejected, processed or error.", ["result"])
+PERSONAS_PARSED = metrics.REGISTRY.counter(
+    "ses_personas_parsed_total", "Personas extracted from parsed lotes.", ["format"])
+PARSE_ERRORS = metrics.REGISTRY.counter(
+    "ses_parse_errors_total", "Inner XML documents that failed to parse.", ["format"])
+FAULTS_TOTAL = metrics.REGISTRY.counter(
+    "ses_faults_total", "Injected faults: throttled, error, delayed or dripped.", ["kind"])
+DEDUP_TOTAL = metrics.REGISTRY.counter(
+    "ses_dedup_total", "Comunicaciones looked up in the dedup cache: hit (a retry, answered from the cache) or miss.", ["result"])
+STORE_SECONDS = metrics.REGISTRY.histogram(
+    "ses_store_operation_seconds", "Duration of storage backend operations.", ["operation"])
+STARTUP_PHASE_SECONDS = metrics.REGISTRY.gauge(
+    "ses_startup_phase_seconds", "Duration of the last load phases (load, index, hydration, ...).", ["phase"])
 
-# In-memory storage for received requests
-received_requests = []
+# In-memory storage for received requests: one shard (list, indexes and lock) per arrendador
+view = shards.ShardedView(track_bytes=bool(RETENTION_MAX_BYTES))
+event_feed = events.EventFeed(EVENTS_HISTORY)
+dedup_cache = dedup.DedupCache(DEDUP_MAX_ENTRIES, DEDUP_TTL_SECONDS)
+fault_profiles = faults.FaultProfiles()
+if FAULT_PROFILES:
+    fault_profiles.load(json.loads(FAULT_PROFILES))
+profiler = profiling.Profiler()
+if PROFILER_CONFIG:
+    profiler.configure(json.loads(PROFILER_CONFIG))
+
+gcs_bucket = None
+gcs_bucket_error = False
+gcs_lock = threading.Lock()
 
 def get_gcs_bucket():
-    """Returns the GCS bucket object if available."""
-    if not GCS_AVAILABLE:
-        return None
+    """Returns the GCS bucket object if available. The client is created once and reused."""
+    global gcs_bucket, gcs_bucket_error
+    if gcs_bucket is not None or gcs_bucket_error:
+        return gcs_bucket
+    with gcs_lock:
+        if gcs_bucket is not None or gcs_bucket_error:
+            return gcs_bucket
+        if GCS_FAKE_DIR:
+            gcs_bucket = persistence.LocalDirBucket(GCS_FAKE_DIR)
+        elif GCS_AVAILABLE:
+            try:
+                client = storage.Client()
+                gcs_bucket = client.bucket(GCS_BUCKET_NAME)
+            except Exception as e:
+                logger.error(f"Error getting GCS bucket: {e}")
+                gcs_bucket_error = True
+        return gcs_bucket
+
+uploader = persistence.WriteBehindUploader(
+    get_gcs_bucket,
+    interval=PERSIST_INTERVAL,
+    max_dirty=PERSIST_MAX_DIRTY,
+    sync=not PERSIST_WRITE_BEHIND,
+)
+
+def json_shard(name):
+    path = os.path.join(SHARD_DIR, "json", f"{name}.json")
+    return store.JsonFileBackend(path, lambda: [records.to_plain(req) for req in view.shard_live(name)],
+                                 get_gcs_bucket, uploader, gcs_name=f"shards/json/{name}.json")
+
+def log_shard(name):
+    return store.AppendLogBackend(
+        os.path.join(SHARD_DIR, "log", name),
+        bucket_getter=get_gcs_bucket,
+        uploader=uploader,
+        max_segment_bytes=LOG_SEGMENT_MAX_BYTES,
+        compaction_interval=0,  # the sharded backend runs one compactor for every shard
+        gcs_prefix=f"shards/log/{name}/",
+    )
+
+def create_backend(name):
+    """Builds the persistence backend selected by STORAGE_BACKEND.
+
+    json and log are sharded by arrendador (each shard written on its own);
+    SQLite stays one database, which already writes single rows and is
+    what several worker processes share.
+    """
+    legacy = store.JsonFileBackend(DATA_FILE, lambda: [records.to_plain(req) for req in view.live()],
+                                   get_gcs_bucket, uploader)
+    if name == "json":
+        return store.ShardedBackend(
+            json_shard,
+            lambda: store.shard_names(os.path.join(SHARD_DIR, "json"), get_gcs_bucket(), "shards/json/", ".json"),
+            shards.entry_shard,
+            legacy_backend=legacy,
+        )
+    if name == "log":
+        unsharded = store.AppendLogBackend(
+            LOG_DIR,
+            bucket_getter=get_gcs_bucket,
+            uploader=uploader,
+            legacy_backend=legacy,
+            max_segment_bytes=LOG_SEGMENT_MAX_BYTES,
+            compaction_interval=0,
+        )
+        return store.ShardedBackend(
+            log_shard,
+            lambda: store.shard_names(os.path.join(SHARD_DIR, "log"), get_gcs_bucket(), "shards/log/"),
+            shards.entry_shard,
+            legacy_backend=unsharded,
+            compaction_interval=LOG_COMPACTION_INTERVAL,
+        )
+    if name == "sqlite":
+        return store.SqliteBackend(
+            SQLITE_PATH,
+            bucket_getter=get_gcs_bucket,
+            uploader=uploader,
+            legacy_backend=legacy,
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {name}")
+
+backend = create_backend(STORAGE_BACKEND)
+xml_blobs = blobs.XmlBlobStore(XML_BLOB_DIR, get_gcs_bucket, uploader, cache_bytes=XML_CACHE_BYTES)
+cold_archive = cold.ColdArchive(COLD_DIR, get_gcs_bucket, uploader, segment_max_records=COLD_SEGMENT_RECORDS)
+
+hydration_generation = 0
+
+def log_phase(name, started):
+    seconds = time.perf_counter() - started
+    STARTUP_PHASE_SECONDS.set(seconds, phase=name.split(" ")[0])
+    logger.info(f"Startup phase {name}: {seconds * 1000:.1f} ms")
+
+def load_data():
+    """Loads requests from the configured backend.
+
+    With LAZY_LOAD the backend returns summaries (no raw XML, only the
+    persona fields the filters use), so the app can serve right away; full
+    records are read on demand by get_full() and hydrated in the background.
+    """
+    global hydration_generation
+    with view.exclusive():
+        started = time.perf_counter()
+        with STORE_SECONDS.time(operation="load"):
+            entries = backend.load(lazy=LAZY_LOAD)
+        log_phase("load", started)
+
+        started = time.perf_counter()
+        legacy = [entry for entry in entries if externalize_xml(entry)]
+        if legacy:
+            with STORE_SECONDS.time(operation="rewrite"):
+                backend.rewrite(legacy)
+            log_phase(f"xml migration ({len(legacy)} records)", started)
+
+        started = time.perf_counter()
+        retired = view.reset([records.compact(entry) for entry in entries])
+        log_phase("index", started)
+        event_feed.publish("reset")
+
+        hydration_generation += 1
+        generation = hydration_generation
+    release_shards(retired)
+    if any(req.get("_summary") for req in entries):
+        threading.Thread(target=hydrate, args=(generation,), name="hydrate", daemon=True).start()
+    else:
+        backend.mark_hydrated()
+
+def hydrate(generation, batch_size=500):
+    """Replaces the summaries in the view with full records, in batches."""
+    started = time.perf_counter()
+    batch = []
+    legacy = []
     try:
-        client = storage.Client()
-        return client.bucket(GCS_BUCKET_NAME)
+        for entry in backend.iter_full():
+            if generation != hydration_generation:
+                return  # superseded by a reload
+            if externalize_xml(entry):
+                legacy.append(entry)
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                replace_summaries(batch)
+                batch = []
+        replace_summaries(batch)
+        if legacy:
+            with view.exclusive():
+                backend.rewrite([entry for entry in legacy if view.get(entry["id"]) is not None])
     except Exception as e:
-        logger.error(f"Error getting GCS bucket: {e}")
-        return None
+        logger.error(f"Error hydrating requests: {e}")
+        return
+    backend.mark_hydrated()
+    log_phase("hydration", started)
 
-def load_data():
-    """Loads requests from GCS or local JSON file."""
-    global received_requests
-    
-    # Try GCS first
-    if GCS_AVAILABLE:
-        bucket = get_gcs_bucket()
-        if bucket:
-            try:
-                blob = bucket.blob(DATA_FILE)
-                if blob.exists():
-                    data = blob.download_as_text()
-                    received_requests = json.loads(data)
-                    logger.info(f"Loaded {len(received_requests)} requests from GCS bucket {GCS_BUCKET_NAME}")
-                    return
-            except Exception as e:
-                logger.error(f"Error loading from GCS: {e}")
+def replace_summaries(entries):
+    for entry in entries:
+        with view.owner_locked(entry["id"]) as shard:
+            if shard is not None and shard.index.get(entry["id"]).get("_summary"):
+                shard.replace(records.compact(entry))
+
+def get_full(req):
+    """Returns the full record for a view entry, fetching it if only the summary is loaded."""
+    if not req.get("_summary"):
+        return req
+    full = backend.fetch(req)
+    if full is None:
+        return req
+    externalize_xml(full)
+    full = records.compact(full)
+    with view.owner_locked(req["id"]) as shard:
+        if shard is not None and shard.index.get(req["id"]).get("_summary"):
+            shard.replace(full)
+    return full
+
+def externalize_xml(entry):
+    """Moves the inline XML of a record stored before the blob store into it.
+
+    Returns True if the entry changed (and should be rewritten by the backend).
+    """
+    changed = False
+    if "xml" in entry:
+        entry["xml_sha256"] = xml_blobs.put(entry.pop("xml") or "")
+        changed = True
+    structured = entry.get("structured")
+    if isinstance(structured, dict) and "raw_xml" in structured:
+        del structured["raw_xml"]
+        changed = True
+    return changed
+
+def load_xml(req):
+    """Returns the raw inner XML of a request from the blob store."""
+    if "xml_sha256" not in req:
+        req = get_full(req)
+    if "xml_sha256" in req:
+        return xml_blobs.get(req["xml_sha256"]) or ""
+    return req.get("xml") or ""
+
+def add_to_view(shard, entry):
+    """Adds a stored request to its shard of the view. Caller holds shard.lock."""
+    entry = records.compact(entry)
+    if shard.add(entry):
+        event_feed.publish("put", entry)
+
+def remove_from_view(shard, request_id):
+    """Removes a request from its shard of the view. Caller holds shard.lock."""
+    req = shard.remove(request_id)
+    if req is not None:
+        event_feed.publish("del", request_id)
+        forget_submissions([req.get("lote")])
+
+def forget_submissions(lotes):
+    """Drops deleted lotes from the dedup cache, so retrying their submission stores them again."""
+    if DEDUP_MAX_ENTRIES:
+        dedup_cache.forget_lotes([lote for lote in lotes if lote])
+
+def store_entries(entries):
+    """Persists new requests (oldest first, IDs assigned by the backend) and adds them to
+    the view, holding only the lock of one arrendador's shard at a time.
+
+    The "xml" of an entry is moved to the blob store first, outside the lock. A
+    /delete-all in between empties the store (under every shard lock), so then
+    the documents are stored again before the records that point at them.
+    """
+    generation = xml_blobs.generation
+    documents = {}
+    groups = {}
+    for entry in entries:
+        if "xml" in entry:
+            documents[id(entry)] = entry.pop("xml")
+            entry["xml_sha256"] = xml_blobs.put(documents[id(entry)])
+        groups.setdefault(shards.arrendador_of(entry), []).append(entry)
+    for arrendador, group in groups.items():
+        with view.locked(arrendador) as shard:
+            if documents and xml_blobs.generation != generation:
+                for entry in group:
+                    if id(entry) in documents:
+                        xml_blobs.put(documents[id(entry)])
+            if len(group) == 1:
+                with STORE_SECONDS.time(operation="insert"):
+                    backend.insert(group[0])
+            else:
+                with STORE_SECONDS.time(operation="insert_many"):
+                    backend.insert_many(group)
+            for entry in group:
+                add_to_view(shard, entry)
+
+def clear_view():
+    """Empties the in-memory view in constant time; the old shards are freed by a
+    background thread. Caller holds view.exclusive()."""
+    retired = view.reset()
+    event_feed.publish("reset")
+    release_shards(retired)
+
+def release_shards(retired):
+    if retired:
+        threading.Thread(target=release_view, args=(retired,), name="view-release", daemon=True).start()
+
+def release_view(retired, chunk=10000):
+    """Frees retired shards a chunk at a time, so other threads get the GIL in between."""
+    for shard in retired:
+        shard.index.clear()
+        shard.tombstones.clear()
+        requests = shard.requests
+        while requests:
+            del requests[-chunk:]
+            time.sleep(0)
+
+def sync_store():
+    """Folds in changes committed by other worker processes (only the SQLite backend has any)."""
+    changes = backend.changes()
+    if changes is None:
+        logger.info("Change feed out of reach, reloading all requests")
+        load_data()
+        return
+    for op, payload in changes:
+        if op == "put":
+            with view.locked(shards.arrendador_of(payload)) as shard:
+                add_to_view(shard, payload)
+        elif op == "del":
+            with view.owner_locked(payload) as shard:
+                if shard is not None:
+                    remove_from_view(shard, payload)
+        elif op == "clear":
+            with view.exclusive():
+                clear_view()
+
+def retention_excess():
+    """The oldest requests in the view beyond the retention limits, at most RETENTION_BATCH
+    of them (oldest first), across every shard."""
+    oldest = view.oldest(RETENTION_BATCH)
+    excess = 0
+    if RETENTION_MAX_REQUESTS:
+        excess = len(view) - RETENTION_MAX_REQUESTS
+    if RETENTION_MAX_AGE_HOURS:
+        cutoff = (datetime.datetime.now() - datetime.timedelta(hours=RETENTION_MAX_AGE_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+        expired = 0
+        while expired < len(oldest) and (oldest[expired].get("timestamp") or "") < cutoff:
+            expired += 1
+        excess = max(excess, expired)
+    if RETENTION_MAX_BYTES:
+        over = view.bytes - RETENTION_MAX_BYTES
+        oversized = 0
+        while over > 0 and oversized < len(oldest):
+            over -= records.footprint(oldest[oversized])
+            oversized += 1
+        excess = max(excess, oversized)
+    return oldest[:max(excess, 0)]
 
-    # Fallback to local file
-    if os.path.exists(DATA_FILE):
+def archive_entry(req):
+    """The full plain record of a view entry, as the cold archive stores it."""
+    full = backend.fetch(req) if req.get("_summary") else None
+    if full is not None:
+        externalize_xml(full)
+    else:
+        full = records.to_plain(req)
+    full.pop("_summary", None)
+    full.pop("_loc", None)
+    return full
+
+def enforce_retention():
+    """Moves requests beyond the retention limits to the cold archive, one batch at a time
+    so requests being served only wait for a shard lock between batches. Returns the count."""
+    moved = 0
+    while True:
+        with cold_archive.exclusive():
+            # Another worker may have archived some of them already
+            sync_store()
+            batch = retention_excess()
+            if not batch:
+                break
+            cold_archive.append([archive_entry(req) for req in batch])
+            ids = [req["id"] for req in batch]
+            kept = set()
+            for shard, shard_ids in view.group_by_owner(ids).items():
+                with shard.lock:
+                    if shard.retired:
+                        continue
+                    evicted = [req["id"] for req in shard.evict(shard_ids)]
+                    for request_id in evicted:
+                        event_feed.publish("del", request_id)
+                    with STORE_SECONDS.time(operation="delete_many"):
+                        backend.delete_many(evicted)
+                    kept.update(evicted)
+            # Deleted while being archived: keep them deleted
+            for request_id in ids:
+                if request_id not in kept:
+                    cold_archive.delete(request_id)
+        moved += len(batch)
+    if moved:
+        logger.info(f"Retention moved {moved} requests to the cold archive ({len(view)} in memory)")
+    return moved
+
+def retention_loop():
+    while True:
         try:
-            with open(DATA_FILE, "r") as f:
-                received_requests = json.load(f)
-            logger.info(f"Loaded {len(received_requests)} requests from local file {DATA_FILE}")
+            enforce_retention()
         except Exception as e:
-            logger.error(f"Error loading local data: {e}")
-            received_requests = []
+            logger.error(f"Error applying retention: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+def start_retention():
+    if RETENTION_MAX_REQUESTS or RETENTION_MAX_AGE_HOURS or RETENTION_MAX_BYTES:
+        threading.Thread(target=retention_loop, name="retention", daemon=True).start()
+
+parse_pool = None
+parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    """Returns the process pool used to parse batches, starting it on first use.
+
+    Workers are forked so they have sesxml loaded without importing app
+    (which would load the store all over again).
+    """
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(BATCH_WORKERS, mp_context=multiprocessing.get_context("fork"))
+        return parse_pool
 
-def save_data():
-    """Saves requests to GCS and local JSON file."""
-    # Save locally first
+def parse_many(xml_contents):
+    """parse_ses_xml() over many documents, fanned out over the process pool when it pays off."""
+    global parse_pool
+    if BATCH_WORKERS <= 1 or len(xml_contents) < BATCH_MIN_PARALLEL:
+        return [parse_ses_xml(xml_content) for xml_content in xml_contents]
+    chunksize = max(1, len(xml_contents) // (BATCH_WORKERS * 4))
     try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(received_requests, f, indent=4)
-        logger.info(f"Saved {len(received_requests)} requests to local file {DATA_FILE}")
-    except Exception as e:
-        logger.error(f"Error saving local data: {e}")
+        return list(get_parse_pool().map(parse_ses_xml, xml_contents, chunksize=chunksize))
+    except BrokenProcessPool:
+        logger.error("Parser pool died, parsing this batch inline")
+        with parse_pool_lock:
+            parse_pool = None
+        return [parse_ses_xml(xml_content) for xml_content in xml_contents]
 
-    # Save to GCS
-    if GCS_AVAILABLE:
-        bucket = get_gcs_bucket()
-        if bucket:
-            try:
-                blob = bucket.blob(DATA_FILE)
-                blob.upload_from_string(json.dumps(received_requests, indent=4), content_type='application/json')
-                logger.info(f"Saved {len(received_requests)} requests to GCS bucket {GCS_BUCKET_NAME}")
-            except Exception as e:
-                logger.error(f"Error saving to GCS: {e}")
+def shutdown_persistence():
+    """Flushes pending uploads and closes the backend before the process exits."""
+    # Lotes already acknowledged must reach the store before it is flushed
+    lote_queue.drain(timeout=PERSIST_SHUTDOWN_TIMEOUT)
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+    if not uploader.close(timeout=PERSIST_SHUTDOWN_TIMEOUT):
+        logger.error(f"Exiting with unpersisted changes: {uploader.status()}")
+    backend.close()
+
+def install_shutdown_hooks():
+    """Flush on normal exit and on SIGTERM (Cloud Run / gunicorn shutdown), then defer to the previous handler."""
+    atexit.register(shutdown_persistence)
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+    except ValueError:
+        return
+
+    def on_sigterm(signum, frame):
+        # In-flight requests may still write, so only flush here; atexit closes everything
+        lote_queue.drain(timeout=PERSIST_SHUTDOWN_TIMEOUT)
+        if not uploader.flush(timeout=PERSIST_SHUTDOWN_TIMEOUT):
+            logger.error(f"SIGTERM flush left changes unpersisted: {uploader.status()}")
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            raise SystemExit(128 + signum)
+
+    try:
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        # Not the main thread (e.g. imported from a test runner thread); atexit still applies
+        pass
 
 # Load data on startup
 load_data()
+install_shutdown_hooks()
+start_retention()
+log_phase("ready", STARTED_AT)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-def get_local_text(node, name, default=""):
-    """Finds a child node by local name and returns its text."""
-    if node is None:
-        return default
-    # Use xpath to find the node by local name
-    results = node.xpath(f".//*[local-name()='{name}']")
-    if results:
-        return results[0].text or default
-    return default
-
-def find_local_node(node, name):
-    """Finds a node by local name."""
-    if node is None:
+@app.before_request
+def refresh_from_other_workers():
+    sync_store()
+
+@app.before_request
+def check_admin_token():
+    if not request.path.startswith("/admin/"):
         return None
-    results = node.xpath(f".//*[local-name()='{name}']")
-    return results[0] if results else None
+    if not ADMIN_TOKEN:
+        # Not configured: the service may be public (Cloud Run), so the admin API does not exist
+        return jsonify({"success": False, "error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+        return jsonify({"success": False, "error": "Admin token required"}), 401
 
-def parse_ses_xml(xml_content):
-    """Parses the inner SES XML (PV or RH) or Oracle BI Publisher XML into a structured list of contracts."""
-    try:
-        parser = etree.XMLParser(recover=True, remove_blank_text=True)
-        root = etree.fromstring(xml_content.encode('utf-8'), parser=parser)
-        
-        contracts = []
-        
-        # Check if it's the Oracle BI Publisher format (DATA_DS)
-        if root.tag == 'DATA_DS' or root.xpath(".//*[local-name()='DATA_DS']"):
-            g1_nodes = root.xpath(".//*[local-name()='G_1']")
-            for g1 in g1_nodes:
-                data = {
-                    "tipo": "Reserva de Hospedaje (RH)", # Assuming these are always reservations based on file name
-                    "referencia": get_local_text(g1, "CONFIRMATION_NO", "N/A"),
-                    "fechas": {
-                        "Reserva": get_local_text(g1, "INSERT_DATE"),
-                        "Entrada": get_local_text(g1, "BEGIN_DATE"),
-                        "Salida": get_local_text(g1, "END_DATE"),
-                        "Pago": get_local_text(g1, "PAYMENT_METHOD")
-                    },
-                    "personas": []
-                }
-                
-                # Extract persons (G_2)
-                g2_nodes = g1.xpath(".//*[local-name()='G_2']")
-                for g2 in g2_nodes:
-                    nombre = get_local_text(g2, "FIRST")
-                    # Sometimes name is split or just FIRST? XML shows FIRST.
-                    
-                    p_data = {
-                        "nombre": nombre,
-                        "documento": "N/A", # Not present in the snippet
-                        "soporte": "N/A",
-                        "nacimiento": "N/A",
-                        "nacionalidad": get_local_text(g2, "NACIONALIDAD"),
-                        "sexo": get_local_text(g2, "SEXO"),
-                        "direccion": f"{get_local_text(g2, 'PAIS')}",
-                        "contacto": f"Tel: {get_local_text(g2, 'TELEFONO')} / Email: {get_local_text(g2, 'CORREO')}"
-                    }
-                    data["personas"].append(p_data)
-                
-                contracts.append(data)
-            return {
-                "tipo": "Reserva de Hospedaje (RH)",
-                "contracts": contracts,
-                "raw_xml": xml_content
-            }
+@app.before_request
+def start_profile():
+    if profiler.active and request.url_rule is not None and not request.path.startswith("/admin/profiler"):
+        g.profile = profiler.start(request.url_rule.rule, request.args.get("arrendador"), request.content_length or 0)
 
-        # Standard SES XML parsing
-        
-        # Iterate over each 'comunicacion' block
-        # Note: In some XMLs, 'comunicacion' is a direct child of 'solicitud' (which is root here)
-        # We look for any 'comunicacion' descendant to be safe, or direct children.
-        # Using .// to find them anywhere or just iterating children if root is 'solicitud'
-        
-        comunicacion_nodes = root.xpath(".//*[local-name()='comunicacion']")
-        
-        if not comunicacion_nodes:
-            # Fallback for old single-structure or if structure is different
-            comunicacion_nodes = [root] 
-
-        for com_node in comunicacion_nodes:
-            data = {
-                "tipo": "Desconocido",
-                "referencia": "N/A",
-                "fechas": {},
-                "personas": []
-            }
-            
-            contrato = find_local_node(com_node, "contrato")
-            reserva = find_local_node(com_node, "reserva")
-            
-            if contrato is not None:
-                data["tipo"] = "Parte de Viajero (PV)"
-                data["referencia"] = get_local_text(contrato, "referencia", "N/A")
-                
-                pago = find_local_node(contrato, "pago")
-                tipo_pago = get_local_text(pago, "tipoPago", "N/A") if pago is not None else "N/A"
-                
-                data["fechas"] = {
-                    "Entrada": get_local_text(contrato, "fechaEntrada"),
-                    "Salida": get_local_text(contrato, "fechaSalida"),
-                    "Pago": tipo_pago
-                }
-            elif reserva is not None:
-                data["tipo"] = "Reserva de Hospedaje (RH)"
-                data["referencia"] = get_local_text(reserva, "referencia", "N/A")
-                
-                pago = find_local_node(reserva, "pago")
-                tipo_pago = get_local_text(pago, "tipoPago", "N/A") if pago is not None else "N/A"
-                
-                data["fechas"] = {
-                    "Reserva": get_local_text(reserva, "fechaReserva"),
-                    "Entrada": get_local_text(reserva, "fechaEntrada"),
-                    "Salida": get_local_text(reserva, "fechaSalida"),
-                    "Pago": tipo_pago
-                }
-            else:
-                # If no contract/reserva found in this node, skip it (might be just a wrapper or empty)
-                continue
+@app.teardown_request
+def stop_profile(exc):
+    # Streamed bodies (exports, events, held responses) run after this and are not included
+    session = g.pop("profile", None)
+    if session is not None:
+        session.stop()
 
-            # Extract persons for THIS communication block
-            for persona in com_node.xpath(".//*[local-name()='persona']"):
-                nombre = get_local_text(persona, "nombre")
-                ap1 = get_local_text(persona, "apellido1")
-                ap2 = get_local_text(persona, "apellido2")
-                tipo_doc = get_local_text(persona, "tipoDocumento")
-                num_doc = get_local_text(persona, "numeroDocumento")
-                
-                # Address
-                direccion_node = find_local_node(persona, "direccion")
-                if direccion_node is not None:
-                    dir_texto = get_local_text(direccion_node, "direccion")
-                    cp = get_local_text(direccion_node, "codigoPostal")
-                    pais = get_local_text(direccion_node, "pais")
-                    full_address = f"{dir_texto}, {cp}, {pais}"
-                else:
-                    full_address = "N/A"
-                    
-                # Contact
-                tel = get_local_text(persona, "telefono")
-                email = get_local_text(persona, "correo")
-                contact_info = []
-                if tel: contact_info.append(f"Tel: {tel}")
-                if email: contact_info.append(f"Email: {email}")
-                full_contact = " / ".join(contact_info) if contact_info else "N/A"
-                
-                p_data = {
-                    "nombre": f"{nombre} {ap1} {ap2}".strip(),
-                    "documento": f"{tipo_doc}: {num_doc}",
-                    "soporte": get_local_text(persona, "soporteDocumento", "N/A"),
-                    "nacimiento": get_local_text(persona, "fechaNacimiento"),
-                    "nacionalidad": get_local_text(persona, "nacionalidad"),
-                    "sexo": get_local_text(persona, "sexo"),
-                    "direccion": full_address,
-                    "contacto": full_contact
-                }
-                data["personas"].append(p_data)
-            
-            contracts.append(data)
-            
-        # Determine overall type based on what we found
-        # If we found at least one "Parte de Viajero", we call it PV.
-        # If we found "Reserva", we call it RH.
-        # This logic might need to be more robust if mixed types are possible, 
-        # but usually a file is one or the other.
-        
-        overall_type = "Desconocido"
-        # Check raw string for type as requested for robustness
-        if "<tipoComunicacion>RH</tipoComunicacion>" in xml_content:
-            overall_type = "Reserva de Hospedaje (RH)"
-        elif "<tipoComunicacion>PV</tipoComunicacion>" in xml_content:
-            overall_type = "Parte de Viajero (PV)"
-        else:
-            # Fallback to inferring from parsed content
-            if contracts:
-                first_type = contracts[0].get("tipo", "")
-                if "Parte" in first_type:
-                    overall_type = "Parte de Viajero (PV)"
-                elif "Reserva" in first_type:
-                    overall_type = "Reserva de Hospedaje (RH)"
-
-        return {
-            "tipo": overall_type,
-            "contracts": contracts,
-            "raw_xml": xml_content
-        }
-    except Exception as e:
-        logger.error(f"Error parsing inner XML: {e}")
-        return {
-            "tipo": "Error",
-            "contracts": [],
-            "raw_xml": xml_content,
-            "error": str(e)
-        }
+@app.after_request
+def observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics."""
+    return metrics.REGISTRY.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 @app.route("/", methods=["GET"])
 def index():
-    return render_template("index.html", requests=received_requests, json_requests=json.dumps(received_requests))
+    # The dashboard pulls its data page by page from /api/requests
+    return render_template("index.html")
 
-@app.route("/hospedajes-web/ws/v1/comunicacion", methods=["POST"])
-def mock_ses():
+def view_candidates(flt, after_id=None, chunk=shards.CANDIDATE_CHUNK):
+    """The view requests that can match flt past the after_id cursor, lazily and in the
+    filter's order (just the indexed candidates when the filter allows it, and only the
+    arrendador's shard when it names one)."""
+    return view.candidates(flt, flt.arrendador, after_id, chunk)
+
+@app.route("/api/requests", methods=["GET"])
+def api_requests():
+    """Lists stored requests with the dashboard filters, one page at a time.
+
+    Query parameters: tab (all|rh|pv), q (name/document substring),
+    fechaReserva/fechaEntrada/fechaSalida, arrendador, sort (date_desc|date_asc),
+    cursor, limit and fields (comma separated; xml is left out by default).
+    """
+    flt = query.RequestFilter.from_args(request.args)
     try:
-        data = request.data
-        logger.info(f"Received request: {len(data)} bytes")
-        
-        # Parse SOAP
-        parser = etree.XMLParser(recover=True)
-        root = etree.fromstring(data, parser=parser)
-        
-        # Extract base64 payload
-        solicitud_node = find_local_node(root, "solicitud")
-        if solicitud_node is None:
-            return "Missing solicitud node", 400
-            
-        b64_data = solicitud_node.text
-        zip_data = base64.b64decode(b64_data)
-        
-        # Extract ZIP
-        zip_buffer = io.BytesIO(zip_data)
-        xml_content = ""
-        with zipfile.ZipFile(zip_buffer, "r") as zip_file:
-            for name in zip_file.namelist():
-                if name.endswith(".xml"):
-                    xml_content = zip_file.read(name).decode("utf-8")
-                    break
-        
-        # Extract header info from SOAP
-        cabecera = find_local_node(root, "cabecera")
-        header_info = {
-            "arrendador": get_local_text(cabecera, "codigoArrendador", "N/A"),
-            "aplicacion": get_local_text(cabecera, "aplicacion", "N/A"),
-            "tipoOperacion": get_local_text(cabecera, "tipoOperacion", "N/A"),
-            "tipoComunicacion": get_local_text(cabecera, "tipoComunicacion", "N/A")
-        }
-        
-        # Parse inner XML for structured view
-        structured_data = parse_ses_xml(xml_content)
-        
-        # Store request
-        import datetime
-        request_entry = {
-            "id": len(received_requests) + 1,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "header": header_info,
-            "xml": xml_content,
-            "structured": structured_data
-        }
-        received_requests.insert(0, request_entry)
-        
-        # Save data
-        save_data()
+        limit = query.parse_limit(request.args.get("limit"))
+        page = query.paginate(
+            # One more than the page, to know whether there is a next one
+            view_candidates(flt, query.parse_cursor(request.args.get("cursor")), chunk=limit + 1),
+            flt,
+            cursor=request.args.get("cursor"),
+            limit=limit,
+            fields=query.parse_fields(request.args.get("fields")),
+            resolve=get_full,
+            presorted=True,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if "xml" in query.parse_fields(request.args.get("fields")):
+        # Records only hold the hash; read the documents for this page alone
+        for item in page["items"]:
+            req = view.get(item["id"])
+            item["xml"] = load_xml(req) if req is not None else ""
+    # Older requests continue in /api/archive
+    page["archived"] = cold_archive.count
+    return jsonify(page)
+
+@app.route("/api/requests/<int:request_id>/xml", methods=["GET"])
+def api_request_xml(request_id):
+    """Returns the raw inner XML of one request (loaded by the dashboard on demand)."""
+    req = view.get(request_id) or cold_archive.get(request_id)
+    if req is None:
+        return jsonify({"success": False, "error": f"Request {request_id} not found"}), 404
+    return load_xml(req), 200, {"Content-Type": "application/xml; charset=utf-8"}
+
+@app.route("/api/archive", methods=["GET"])
+def api_archive():
+    """Lists the requests retention moved to the cold archive.
+
+    Takes the /api/requests parameters; the archive segments are scanned
+    on every call, so this is slower than the in-memory listing.
+    """
+    flt = query.RequestFilter.from_args(request.args)
+    try:
+        after_id = query.parse_cursor(request.args.get("cursor"))
+        fields = query.parse_fields(request.args.get("fields"))
+        page = query.paginate(
+            cold_archive.iter_entries(newest_first=flt.sort == "date_desc", after_id=after_id),
+            flt,
+            cursor=request.args.get("cursor"),
+            limit=query.parse_limit(request.args.get("limit")),
+            fields=fields,
+            presorted=True,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if "xml" in fields:
+        for item in page["items"]:
+            item["xml"] = load_xml(cold_archive.get(item["id"]) or {})
+    return jsonify(page)
+
+def export_matches(flt):
+    """Yields (full request, tipo, contracts) for every stored request matching flt, in the
+    filter's order: the in-memory view and then the cold archive (the other way round
+    for date_asc). Requests are resolved one at a time as the export consumes them."""
+    def hot():
+        for req, request_type, contracts in query.iter_matches(view_candidates(flt), flt, presorted=True):
+            if req.get("_summary"):
+                req = get_full(req)
+                request_type, contracts = flt.matching_contracts(req)
+                if not contracts:
+                    continue
+            yield req, request_type, contracts
+
+    def archived():
+        if cold_archive.count:
+            yield from query.iter_matches(cold_archive.iter_entries(newest_first=flt.sort == "date_desc"),
+                                          flt, presorted=True)
+
+    if flt.sort == "date_desc":
+        yield from hot()
+        yield from archived()
+    else:
+        yield from archived()
+        yield from hot()
+
+@app.route("/export/<fmt>", methods=["GET"])
+def export_requests(fmt):
+    """Streams every request matching the dashboard filters (tab, q, fecha*, arrendador, sort).
+
+    /export/ndjson writes one full stored record per line, /export/csv one row
+    per persona of the matching contracts; gzip=1 compresses the stream.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "error": f"Unknown export format: {fmt}"}), 404
+    flt = query.RequestFilter.from_args(request.args)
+    compress = request.args.get("gzip", "").lower() in ("1", "true", "yes")
+    content_type, extension, serialize = EXPORT_FORMATS[fmt]
+    body = export.chunks(serialize(export_matches(flt)))
+    filename = f"requests-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+    if compress:
+        body = export.gzip_chunks(body)
+        content_type = "application/gzip"
+        filename += ".gz"
+    logger.info(f"Exporting {fmt}{' (gzip)' if compress else ''} with tab={flt.tab} q={flt.q!r} dates={flt.dates} "
+                f"arrendador={flt.arrendador}")
+    return Response(body, content_type=content_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                             "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def poll_event(event):
+    """An event as /events/poll sends it: a put carries the request as /api/requests
+    lists it, with every contract, so front.py can filter it for each stream."""
+    data = None
+    if event.kind == "put":
+        req = get_full(event.payload)
+        request_type, contracts = query.request_type_and_contracts(req)
+        data = query.project(req, request_type, contracts, query.DEFAULT_FIELDS)
+    elif event.kind == "del":
+        data = event.payload
+    return {"kind": event.kind, "data": data}
+
+@app.route("/events/poll", methods=["GET"])
+def events_poll():
+    """The changes after the ?after= event ID, for the /events relay in front.py.
+
+    Answers at once with the ID to poll with next, up to EVENTS_POLL_MAX events
+    ("more" if there are others) and "reset" when the ID cannot be resumed (it is
+    from another worker, a restart or older than the history).
+    """
+    seq = event_feed.parse_id(request.args.get("after"))
+    pending = event_feed.since(seq) if seq is not None else None
+    if pending is None:
+        return jsonify({"after": event_feed.event_id(event_feed.latest), "reset": True, "events": [], "more": False})
+    batch = pending[:EVENTS_POLL_MAX]
+    return jsonify({
+        "after": event_feed.event_id(batch[-1].seq if batch else seq),
+        "reset": False,
+        "events": [poll_event(event) for event in batch],
+        "more": len(pending) > len(batch),
+    })
+
+@app.route("/api/shards", methods=["GET"])
+def api_shards():
+    """The arrendadores with requests in memory and how many each (the dashboard's arrendador filter)."""
+    return jsonify({"shards": [{"arrendador": arrendador, "requests": count} for arrendador, count in view.counts()]})
+
+@app.route("/api/persistence", methods=["GET"])
+def api_persistence():
+    """Write-behind status (pending objects, persistence lag in seconds) and XML blob cache counters."""
+    return jsonify(dict(uploader.status(), xml_blobs=xml_blobs.status()))
+
+@app.route("/api/stays", methods=["GET"])
+def api_stays():
+    """Looks up contracts through the secondary indexes.
+
+    Query parameters (all optional, combined with AND): documento,
+    arrendador, referencia, desde/hasta (date range on campo, which is
+    Reserva, Entrada or Salida; Entrada by default) and limit.
+    """
+    field = request.args.get("campo", "Entrada")
+    if field not in indexes.DATE_FIELDS:
+        return jsonify({"success": False, "error": f"Invalid campo: {field}"}), 400
+    limit = query.parse_limit(request.args.get("limit"))
+    documento = request.args.get("documento")
+    matches = view.stays(
+        documento=documento,
+        arrendador=request.args.get("arrendador"),
+        referencia=request.args.get("referencia"),
+        field=field,
+        start=request.args.get("desde"),
+        end=request.args.get("hasta"),
+    )
+    items = []
+    for req, ci in matches[:limit]:
+        req = get_full(req)
+        request_type, contracts = query.request_type_and_contracts(req)
+        contract = contracts[ci]
+        personas = contract.get("personas", [])
+        if documento:
+            number = indexes.document_number(documento)
+            personas = [p for p in personas if indexes.document_number(p.get("documento")) == number]
+        items.append({
+            "id": req["id"],
+            "timestamp": req.get("timestamp"),
+            "arrendador": (req.get("header") or {}).get("arrendador"),
+            "tipo": contract.get("tipo", request_type),
+            "referencia": contract.get("referencia"),
+            "fechas": records.to_plain(contract.get("fechas")),
+            "personas": records.to_plain(personas),
+        })
+    return jsonify({"items": items, "total": len(matches)})
+
+def read_submission():
+    """Reads the whole SOAP request into memory and returns (header_info, zip_file)."""
+    data = request.data
+    logger.info(f"Received request: {len(data)} bytes")
+    
+    # Parse SOAP
+    parser = etree.XMLParser(recover=True)
+    root = etree.fromstring(data, parser=parser)
+    
+    # Extract base64 payload
+    solicitud_node = find_local_node(root, "solicitud")
+    if solicitud_node is None:
+        raise IngestError("Missing solicitud node", 400)
         
-        # Return success response
-        response_xml = f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+    b64_data = solicitud_node.text
+    zip_data = base64.b64decode(b64_data)
+    
+    # Extract header info from SOAP
+    cabecera = find_local_node(root, "cabecera")
+    header_info = {
+        "arrendador": get_local_text(cabecera, "codigoArrendador", "N/A"),
+        "aplicacion": get_local_text(cabecera, "aplicacion", "N/A"),
+        "tipoOperacion": get_local_text(cabecera, "tipoOperacion", "N/A"),
+        "tipoComunicacion": get_local_text(cabecera, "tipoComunicacion", "N/A")
+    }
+    return header_info, io.BytesIO(zip_data)
+
+def read_submission_streaming():
+    """Streams the SOAP request: the envelope is parsed incrementally and solicitud is
+    base64-decoded in chunks into a spooled temp file. Returns the same tuple as read_submission()."""
+    logger.info(f"Received request: {request.content_length} bytes")
+    fields, zip_file = ingest.read_envelope(request.stream, ingest_limits)
+    
+    header_info = {
+        "arrendador": fields["codigoArrendador"],
+        "aplicacion": fields["aplicacion"],
+        "tipoOperacion": fields["tipoOperacion"],
+        "tipoComunicacion": fields["tipoComunicacion"]
+    }
+    return header_info, zip_file
+
+def xml_format(xml_content):
+    """Metric label for the inner XML flavour."""
+    if not xml_content.strip():
+        return "empty"
+    return "data_ds" if "<DATA_DS" in xml_content[:4096] else "ses"
+
+def observe_parsed(xml_content, structured_data):
+    """Counts the personas (or the parse error) of one parsed document; returns the persona count."""
+    fmt = xml_format(xml_content)
+    if structured_data.get("tipo") == "Error":
+        PARSE_ERRORS.inc(format=fmt)
+    personas = sum(len(c.get("personas", [])) for c in structured_data.get("contracts", []))
+    PERSONAS_PARSED.inc(personas, format=fmt)
+    return personas
+
+def timed_stage(stages, stage, started):
+    """Records a stage duration in the histogram and in stages (ms, for the request log line)."""
+    seconds = time.perf_counter() - started
+    INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+    stages[stage] = seconds * 1000
+
+def unpack_submission(zip_file, stages):
+    """Extracts the first .xml member of the solicitud ZIP and parses it; returns (xml_content, structured_data).
+
+    The streaming path feeds the member straight from the ZIP into the parser,
+    so its unzip stage includes building the XML tree.
+    """
+    with zip_file:
+        started = time.perf_counter()
+        if STREAMING_INGEST:
+            xml_content, root = ingest.read_xml_member(zip_file, ingest_limits)
+        else:
+            root = None
+            xml_content = ""
+            with zipfile.ZipFile(zip_file, "r") as archive:
+                for name in archive.namelist():
+                    if name.endswith(".xml"):
+                        xml_content = archive.read(name).decode("utf-8")
+                        break
+        timed_stage(stages, "unzip", started)
+    
+    started = time.perf_counter()
+    structured_data = parse_ses_xml(xml_content, root)
+    timed_stage(stages, "parse", started)
+    return xml_content, structured_data
+
+def store_submission(lote, timestamp, header_info, zip_file, stages):
+    """Unzips, parses and persists one accepted submission; returns the request ID.
+
+    stages holds the timings measured so far (envelope) and the payload
+    size; the completed set is logged as one key=value line per lote.
+    """
+    session = profiler.start(profiling.INGEST, header_info.get("arrendador"), stages.get("bytes", 0)) if profiler.active else None
+    try:
+        return process_submission(lote, timestamp, header_info, zip_file, stages)
+    finally:
+        if session is not None:
+            session.stop()
+
+def process_submission(lote, timestamp, header_info, zip_file, stages):
+    try:
+        xml_content, structured_data = unpack_submission(zip_file, stages)
+    except Exception:
+        LOTES_TOTAL.inc(result="error")
+        raise
+    personas = observe_parsed(xml_content, structured_data)
+    started = time.perf_counter()
+    request_entry = {
+        "id": None,  # assigned by the backend
+        "lote": lote,
+        "timestamp": timestamp,
+        "header": header_info,
+        "xml": xml_content,  # moved to the blob store by store_entries
+        "structured": structured_data
+    }
+    store_entries([request_entry])
+    timed_stage(stages, "persist", started)
+    LOTES_TOTAL.inc(result="processed")
+    timings = " ".join(f"{stage}_ms={stages[stage]:.2f}" for stage in ("envelope", "unzip", "parse", "persist") if stage in stages)
+    logger.info(
+        f"ingest lote={lote} id={request_entry['id']} bytes={stages.get('bytes', 0)} "
+        f"format={xml_format(xml_content)} tipo=\"{structured_data.get('tipo')}\" personas={personas} {timings}"
+    )
+    return request_entry["id"]
+
+lote_queue = lotes.LoteQueue(
+    store_submission,
+    workers=INGEST_WORKERS,
+    maxsize=INGEST_QUEUE_SIZE,
+)
+
+metrics.REGISTRY.gauge("ses_stored_requests", "Requests in the in-memory view.", callback=lambda: len(view))
+metrics.REGISTRY.gauge("ses_lote_queue_depth", "Lotes waiting for a worker.", callback=lambda: lote_queue.stats()["queued"])
+metrics.REGISTRY.gauge("ses_persistence_pending", "Objects waiting to be uploaded or deleted.",
+                       callback=lambda: uploader.status()["pending"])
+metrics.REGISTRY.gauge("ses_persistence_lag_seconds", "Age of the oldest change not yet in GCS.",
+                       callback=lambda: uploader.status()["lag_seconds"])
+metrics.REGISTRY.gauge("ses_xml_cache_bytes", "Decompressed XML held by the blob cache.",
+                       callback=lambda: xml_blobs.status()["cached_bytes"])
+metrics.REGISTRY.gauge("ses_dedup_entries", "Submissions remembered by the dedup cache.",
+                       callback=lambda: dedup_cache.stats()["entries"])
+
+def resultado_xml(codigo, descripcion, lote=None):
+    lote_xml = f"\n            <lote>{escape(lote)}</lote>" if lote else ""
+    return f"""         <resultado>
+            <codigo>{codigo}</codigo>
+            <descripcion>{escape(descripcion)}</descripcion>{lote_xml}
+         </resultado>"""
+
+def comunicacion_response(resultados):
+    """SOAP comunicacionResponse with one resultado per lote."""
+    body = "\n".join(resultados)
+    return f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
    <soapenv:Body>
       <com:comunicacionResponse xmlns:com="http://www.soap.servicios.hospedajes.mir.es/comunicacion">
-         <resultado>
-            <codigo>0</codigo>
-            <descripcion>Exito (Mock)</descripcion>
-            <lote>MOCK-{len(received_requests)}</lote>
-         </resultado>
+{body}
       </com:comunicacionResponse>
    </soapenv:Body>
 </soapenv:Envelope>"""
+
+def throttle_response(profile, wait):
+    """The rate limit answer of a profile."""
+    status, codigo, descripcion = profile.throttle
+    body = comunicacion_response([resultado_xml(codigo, descripcion)])
+    return body, status, {"Content-Type": "text/xml", "Retry-After": str(int(min(wait, 3600)) + 1)}
+
+def apply_faults(header_info):
+    """Runs the fault profile of the submission's arrendador before it is processed.
+
+    Returns (answer, hold): answer is a response to send instead of processing
+    (throttled or an injected error), and hold the (profile, delay) to hold the
+    response with, or None.
+    """
+    profile = fault_profiles.for_arrendador(header_info["arrendador"])
+    if profile is None:
+        return None, None
+    wait = fault_profiles.throttle_wait(profile)
+    if wait:
+        FAULTS_TOTAL.inc(kind="throttled")
+        return throttle_response(profile, wait), None
+    hold = None
+    delay = profile.sample_latency()
+    if delay or profile.drip is not None:
+        hold = (profile, delay)
+    error = profile.draw_error()
+    if error is not None:
+        FAULTS_TOTAL.inc(kind="error")
+        status, codigo, descripcion = error
+        return held_response(hold, comunicacion_response([resultado_xml(codigo, f"Error: {descripcion}")]), status), None
+    return None, hold
+
+def held_response(hold, body, status=200):
+    """The response for body, for front.py to delay and/or drip as the hold says."""
+    headers = {"Content-Type": "text/xml"}
+    if hold is not None:
+        profile, delay = hold
+        if delay:
+            FAULTS_TOTAL.inc(kind="delayed")
+        if profile.drip is not None:
+            FAULTS_TOTAL.inc(kind="dripped")
+        headers.update(profile.hold_headers(delay))
+    return body, status, headers
+
+@app.route("/hospedajes-web/ws/v1/comunicacion", methods=["POST"])
+def mock_ses():
+    """Accepts a comunicacion like the real service: the envelope is validated and
+    acknowledged with a lote ID, and the rest happens on the lote queue
+    (inline with ASYNC_INGEST=0). consultaLote reports how it went."""
+    try:
+        PAYLOAD_BYTES.observe(request.content_length or 0, endpoint="comunicacion")
+        stages = {"bytes": request.content_length or 0}
+        started = time.perf_counter()
+        if STREAMING_INGEST:
+            header_info, zip_file = read_submission_streaming()
+        else:
+            header_info, zip_file = read_submission()
+        if not zipfile.is_zipfile(zip_file):
+            zip_file.close()
+            raise IngestError("solicitud is not a ZIP archive", 400)
+        zip_file.seek(0)
+
+        answer, hold = apply_faults(header_info) if fault_profiles.active else (None, None)
+        if answer is not None:
+            zip_file.close()
+            return answer
+        lote = lotes.new_lote_id()
+        response_xml = comunicacion_response([resultado_xml(0, "Exito (Mock)", lote)])
+        key = None
+        if DEDUP_MAX_ENTRIES:
+            key = dedup.submission_key(header_info, zip_file)
+            issued = dedup_cache.claim(key, response_xml, lote)
+            if issued is not None:
+                # A retry: answer with the lote already issued instead of storing a duplicate
+                zip_file.close()
+                DEDUP_TOTAL.inc(result="hit")
+                logger.info(f"Duplicate submission {key[:16]}, returning the original response")
+                return held_response(hold, issued)
+            DEDUP_TOTAL.inc(result="miss")
+        timed_stage(stages, "envelope", started)
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            if ASYNC_INGEST:
+                try:
+                    lote_queue.submit(lote, lote, timestamp, header_info, zip_file, stages)
+                except queue.Full:
+                    zip_file.close()
+                    raise IngestError("Too many lotes pending, retry later", 503)
+            else:
+                lote_queue.record(lote, store_submission(lote, timestamp, header_info, zip_file, stages))
+        except Exception:
+            if key is not None:
+                dedup_cache.release(key)
+            raise
+        LOTES_TOTAL.inc(result="accepted")
         
-        return response_xml, 200, {"Content-Type": "text/xml"}
+        # Return success response (held as the fault profile says)
+        return held_response(hold, response_xml)
         
+    except IngestError as e:
+        logger.warning(f"Rejected request: {e}")
+        LOTES_TOTAL.inc(result="rejected")
+        if e.status == 503:
+            return str(e), e.status, {"Retry-After": "1"}
+        return str(e), e.status
     except Exception as e:
         logger.exception("Error processing mock request")
         return str(e), 500
 
+def lote_state(lote):
+    """Returns (estado, request_id, error) for a lote ID."""
+    status = lote_queue.status(lote)
+    if status is not None:
+        return status["estado"], status["id"], status["error"]
+    # Processed by another worker process, or before a restart
+    req = view.get_by_lote(lote)
+    if req is None:
+        req = cold_archive.find_lote(lote)
+    if req is not None:
+        return lotes.PROCESSED, req["id"], None
+    return lotes.UNKNOWN, None, None
+
+@app.route("/hospedajes-web/ws/v1/consulta", methods=["POST"])
+def consulta_lote():
+    """consultaLote: reports PENDIENTE, PROCESADO, ERROR or DESCONOCIDO for every lote element in the request."""
+    if request.content_length and request.content_length > MAX_BODY_BYTES:
+        return f"Request body exceeds {MAX_BODY_BYTES} bytes", 413
+    root = etree.fromstring(request.data or b"<empty/>", parser=etree.XMLParser(recover=True))
+    if root is None:
+        return "Invalid consultaLote request", 400
+    wanted = [(node.text or "").strip() for node in root.xpath(".//*[local-name()='lote']")]
+    items = []
+    for lote in wanted:
+        estado, request_id, error = lote_state(lote)
+        extra = ""
+        if request_id is not None:
+            extra += f"\n            <idComunicacion>{request_id}</idComunicacion>"
+        if error:
+            extra += f"\n            <error>{escape(error)}</error>"
+        items.append(f"""         <resultadoLote>
+            <lote>{escape(lote)}</lote>
+            <estado>{estado}</estado>{extra}
+         </resultadoLote>""")
+    body = "\n".join([resultado_xml(0, "Exito (Mock)")] + items)
+    response_xml = f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+   <soapenv:Body>
+      <com:consultaLoteResponse xmlns:com="http://www.soap.servicios.hospedajes.mir.es/comunicacion">
+{body}
+      </com:consultaLoteResponse>
+   </soapenv:Body>
+</soapenv:Envelope>"""
+    return response_xml, 200, {"Content-Type": "text/xml"}
+
+@app.route("/api/lotes/<lote>", methods=["GET"])
+def api_lote(lote):
+    """JSON view of consultaLote for a single lote."""
+    estado, request_id, error = lote_state(lote)
+    return jsonify({"lote": lote, "estado": estado, "id": request_id, "error": error})
+
+def read_envelope_lotes(stream, limits, max_lotes):
+    """Reads one SOAP envelope whose solicitud ZIP may hold many .xml members; returns [(header_info, xml_content)]."""
+    fields, zip_file = ingest.read_envelope(stream, limits)
+    with zip_file:
+        members = ingest.read_xml_members(zip_file, limits, max_lotes)
+    header_info = {
+        "arrendador": fields["codigoArrendador"],
+        "aplicacion": fields["aplicacion"],
+        "tipoOperacion": fields["tipoOperacion"],
+        "tipoComunicacion": fields["tipoComunicacion"]
+    }
+    return [(header_info, xml_content) for xml_content in members]
+
+def read_ndjson_lotes(stream):
+    """Reads an NDJSON stream of SOAP envelopes, one per line, either as a JSON string or
+    as {"envelope": "..."}. Returns a list with one [(header_info, xml_content)] list per
+    envelope, or the IngestError that envelope was rejected with."""
+    results = []
+    total = 0
+    lotes = 0
+    for line_no, line in enumerate(stream, 1):
+        total += len(line)
+        if total > MAX_BATCH_BODY_BYTES:
+            raise IngestError(f"Request body exceeds {MAX_BATCH_BODY_BYTES} bytes", 413)
+        line = line.strip()
+        if not line:
+            continue
+        if lotes >= MAX_BATCH_LOTES:
+            raise IngestError(f"Batch exceeds {MAX_BATCH_LOTES} lotes", 413)
+        try:
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise IngestError(f"Line {line_no}: invalid JSON ({e})")
+            envelope = item.get("envelope") if isinstance(item, dict) else item
+            if not isinstance(envelope, str):
+                raise IngestError(f"Line {line_no}: expected a SOAP envelope string")
+            envelope_lotes = read_envelope_lotes(io.BytesIO(envelope.encode("utf-8")), ingest_limits, MAX_BATCH_LOTES - lotes)
+        except IngestError as e:
+            results.append(e)
+            continue
+        lotes += len(envelope_lotes)
+        results.append(envelope_lotes)
+    return results
+
+@app.route("/hospedajes-web/ws/v1/comunicacion/batch", methods=["POST"])
+def mock_ses_batch():
+    """Ingests many lotes in one request, for load tests.
+
+    The body is either a SOAP envelope whose ZIP holds several .xml members
+    (one lote each) or, with an NDJSON content type, one SOAP envelope per
+    line. Lotes are parsed in parallel, stored in one bulk write and get one
+    resultado each, in order; a rejected NDJSON envelope gets an error
+    resultado without affecting the others.
+    """
+    try:
+        PAYLOAD_BYTES.observe(request.content_length or 0, endpoint="batch")
+        if request.content_length and request.content_length > MAX_BATCH_BODY_BYTES:
+            raise IngestError(f"Request body exceeds {MAX_BATCH_BODY_BYTES} bytes", 413)
+        if "json" in (request.content_type or ""):
+            envelopes = read_ndjson_lotes(request.stream)
+        else:
+            envelopes = [read_envelope_lotes(request.stream, batch_limits, MAX_BATCH_LOTES)]
+        documents = [lote for envelope in envelopes if not isinstance(envelope, IngestError) for lote in envelope]
+        logger.info(f"Received batch: {len(documents)} lotes in {len(envelopes)} envelopes")
+
+        started = time.perf_counter()
+        structured = parse_many([xml_content for _, xml_content in documents])
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage="parse")
+        personas = sum(observe_parsed(xml_content, structured_data)
+                       for (_, xml_content), structured_data in zip(documents, structured))
+        started = time.perf_counter()
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entries = [
+            {
+                "id": None,  # assigned by the backend
+                "lote": lotes.new_lote_id(),
+                "timestamp": timestamp,
+                "header": header_info,
+                "xml": xml_content,  # moved to the blob store by store_entries
+                "structured": structured_data
+            }
+            for (header_info, xml_content), structured_data in zip(documents, structured)
+        ]
+        store_entries(entries)
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage="persist")
+        LOTES_TOTAL.inc(len(entries), result="processed")
+        logger.info(f"ingest batch lotes={len(entries)} personas={personas} rejected_envelopes="
+                    f"{sum(isinstance(envelope, IngestError) for envelope in envelopes)}")
+
+        stored = iter(entries)
+        resultados = []
+        for envelope in envelopes:
+            if isinstance(envelope, IngestError):
+                resultados.append(resultado_xml(1, f"Error: {envelope}"))
+                continue
+            for _ in envelope:
+                resultados.append(resultado_xml(0, "Exito (Mock)", next(stored)["lote"]))
+        return comunicacion_response(resultados), 200, {"Content-Type": "text/xml"}
+
+    except IngestError as e:
+        logger.warning(f"Rejected batch: {e}")
+        return str(e), e.status
+    except Exception as e:
+        logger.exception("Error processing batch request")
+        return str(e), 500
+
+@app.route("/admin/profiler", methods=["GET", "PUT", "DELETE"])
+def admin_profiler():
+    """Reads (GET), sets and enables (PUT, JSON body) or disables (DELETE) the profiler
+    configuration; GET also lists the profiles in the ring buffer. See profiling.py."""
+    if request.method == "PUT":
+        try:
+            profiler.configure(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        logger.info(f"Profiler enabled: {request.get_json(silent=True)}")
+        return jsonify({"success": True})
+    if request.method == "DELETE":
+        profiler.disable()
+        if request.args.get("clear", "").lower() in ("1", "true", "yes"):
+            profiler.clear()
+        logger.info("Profiler disabled")
+        return jsonify({"success": True})
+    return jsonify(profiler.to_dict())
+
+@app.route("/admin/profiler/<fmt>", methods=["GET"])
+def admin_profiler_download(fmt):
+    """The recorded profiles: cProfile ones merged as a pstats file (pstats), sampled
+    ones as collapsed stacks (collapsed)."""
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    if fmt == "pstats":
+        data, content_type = profiler.pstats_bytes(), "application/octet-stream"
+    elif fmt == "collapsed":
+        data, content_type = profiler.collapsed(), "text/plain; charset=utf-8"
+    else:
+        return jsonify({"success": False, "error": f"Unknown profile format: {fmt}"}), 404
+    if data is None:
+        return jsonify({"success": False, "error": f"No {fmt} profiles recorded"}), 404
+    return data, 200, {"Content-Type": content_type,
+                       "Content-Disposition": f'attachment; filename="profile-{stamp}.{fmt}"'}
+
+@app.route("/admin/faults", methods=["GET"])
+def admin_faults():
+    """The fault profiles installed in this process (injected faults are counted in /metrics)."""
+    return jsonify(fault_profiles.to_dict())
+
+@app.route("/admin/faults", methods=["PUT", "DELETE"])
+@app.route("/admin/faults/<arrendador>", methods=["GET", "PUT", "DELETE"])
+def admin_fault_profile(arrendador=None):
+    """Reads (GET), replaces (PUT, JSON body) or removes (DELETE) the global fault profile,
+    or the one of a codigoArrendador. See faults.py for the profile format."""
+    if request.method == "PUT":
+        try:
+            fault_profiles.set(request.get_json(silent=True), arrendador)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        logger.info(f"Fault profile for {arrendador or 'all arrendadores'} set: {request.get_json(silent=True)}")
+        return jsonify({"success": True})
+    if request.method == "DELETE":
+        removed = fault_profiles.remove(arrendador)
+        logger.info(f"Fault profile for {arrendador or 'all arrendadores'} removed")
+        return jsonify({"success": True, "removed": removed})
+    profiles = fault_profiles.to_dict()
+    profile = profiles["arrendadores"].get(arrendador)
+    if profile is None:
+        return jsonify({"success": False, "error": f"No fault profile for {arrendador}"}), 404
+    return jsonify(profile)
+
 @app.route("/delete/<int:request_id>", methods=["DELETE"])
 def delete_request(request_id):
-    global received_requests
     try:
         # Filter out the request with the given ID
-        received_requests = [req for req in received_requests if req["id"] != request_id]
-        
-        # Save changes
-        save_data()
+        in_view = view.get(request_id) is not None
+        # Not under a shard lock: retention holds the archive lock while it waits for them
+        archived = cold_archive.get(request_id) if not in_view else None
+        if archived is not None and cold_archive.delete(request_id):
+            forget_submissions([archived.get("lote")])
+            return jsonify({"success": True, "message": f"Request {request_id} deleted"}), 200
+        with view.owner_locked(request_id) as shard:
+            if shard is not None:
+                remove_from_view(shard, request_id)
+            # Record a tombstone instead of rewriting the history
+            with STORE_SECONDS.time(operation="delete"):
+                backend.delete(request_id)
         
         return jsonify({"success": True, "message": f"Request {request_id} deleted"}), 200
     except Exception as e:
         logger.error(f"Error deleting request {request_id}: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/delete-bulk", methods=["POST"])
+def delete_bulk():
+    """Deletes every request matching a filter (query string and/or JSON body) in one pass.
+
+    Filters: ids (list or comma separated), id_desde/id_hasta, arrendador,
+    referencia, desde/hasta on campo (Reserva/Entrada/Salida, default Entrada)
+    and tipo (rh/pv); dry_run only counts the matches.
+    """
+    params = dict(request.args)
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        params.update(body)
+    try:
+        selection = query.SelectionFilter.from_params(params)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if selection.is_empty():
+        return jsonify({"success": False, "error": "No filter given (use /delete-all to delete everything)"}), 400
+    dry_run = str(params.get("dry_run", "")).lower() in ("1", "true", "yes")
+
+    try:
+        ids = set()
+        for shard in view.shards(selection.arrendador):
+            with shard.lock:
+                selected = shard.index.select(selection) if not shard.retired else set()
+                if selected and not dry_run:
+                    for request_id in selected:
+                        remove_from_view(shard, request_id)
+                    with STORE_SECONDS.time(operation="delete_many"):
+                        backend.delete_many(sorted(selected))
+            ids |= selected
+        # Not under a shard lock: retention holds the archive lock while it waits for them
+        archived = [entry for entry in cold_archive.iter_entries() if selection.matches(entry)] if cold_archive.count else []
+        archived_count = len(archived)
+        if archived and not dry_run:
+            # Another worker may have deleted some of them since the scan
+            archived_count = cold_archive.delete_many([entry["id"] for entry in archived])
+            forget_submissions([entry.get("lote") for entry in archived])
+        logger.info(f"Bulk delete{' (dry run)' if dry_run else ''}: {len(ids)} requests, {archived_count} archived")
+        return jsonify({"success": True, "deleted": len(ids), "archived": archived_count, "dry_run": dry_run}), 200
+    except Exception as e:
+        logger.error(f"Error in bulk delete: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route("/delete-all", methods=["DELETE"])
 def delete_all_requests():
-    global received_requests
     try:
-        received_requests = []
-        
-        # Save changes
-        save_data()
+        with view.exclusive():
+            clear_view()
+            with STORE_SECONDS.time(operation="clear"):
+                backend.clear()
+            xml_blobs.clear()
+        cold_archive.clear()
+        # Retries of deleted submissions are new submissions again
+        dedup_cache.clear()
         
         return jsonify({"success": True, "message": "All requests deleted"}), 200
     except Exception as e:
@@ -1,8 +1,23 @@
-from lxml import etree
+"""Fills SES traveler files up to their declared numPersonas with fake travelers.
+
+Each comunicacion whose contrato/reserva declares more numPersonas than it
+has persona elements gets realistic generated ones. The input is read one
+comunicacion at a time with iterparse and written back incrementally with
+etree.xmlfile, so files of any size run in constant memory:
+
+    python augment_xml.py viajeros.xml viajeros-full.xml
+    python augment_xml.py viajeros.xml fixture.xml --personas 50 --seed 7 --workers 4
+
+Every comunicacion draws from its own RNG seeded with (seed, position), so
+the same seed gives the same output whatever the number of workers.
+"""
+import argparse
 import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-SOURCE_FILE = "/home/victor/Descargas/ESP-Viajeros_viajeros (3).xml"
-OUTPUT_FILE = "/home/victor/Descargas/ESP-Viajeros_viajeros (4).xml"
+from lxml import etree
 
 # Realistic data lists
 NAMES = ["Antonio", "Manuel", "Jose", "Francisco", "David", "Juan", "Javier", "Daniel", "Maria", "Carmen", "Ana", "Isabel", "Laura", "Elena", "Cristina", "Marta"]
@@ -18,132 +33,247 @@ CITIES = [
     ("Av. de la Constitucion 12", "41001", "Sevilla")
 ]
 DOMAINS = ["gmail.com", "hotmail.com", "yahoo.es", "outlook.com"]
+CONTRACT_TAGS = ("contrato", "reserva")
+
+BATCH_SIZE = 200  # comunicaciones per task in multi-process mode
+
+def generate_fake_person(index, rng=random, namespace=None):
+    """A persona element with random data; namespace is the one of the comunicacion it joins."""
+    def tag(name):
+        return f"{{{namespace}}}{name}" if namespace else name
+
+    def sub(parent, name, text=None):
+        element = etree.SubElement(parent, tag(name))
+        element.text = text or None  # empty fields serialize as <tag/> however they are written
+        return element
+
+    person = etree.Element(tag("persona"))
+    sub(person, "rol", "VI")
+
+    nombre_text = rng.choice(NAMES)
+    sub(person, "nombre", nombre_text)
+    ap1_text = rng.choice(SURNAMES)
+    sub(person, "apellido1", ap1_text)
+    sub(person, "apellido2", rng.choice(SURNAMES))
+    sub(person, "tipoDocumento", "DNI")
 
-def generate_fake_person(index):
-    person = etree.Element("persona")
-    
-    rol = etree.SubElement(person, "rol")
-    rol.text = "VI"
-    
-    nombre_text = random.choice(NAMES)
-    nombre = etree.SubElement(person, "nombre")
-    nombre.text = nombre_text
-    
-    ap1_text = random.choice(SURNAMES)
-    ap1 = etree.SubElement(person, "apellido1")
-    ap1.text = ap1_text
-    
-    ap2_text = random.choice(SURNAMES)
-    ap2 = etree.SubElement(person, "apellido2")
-    ap2.text = ap2_text
-    
-    tipo_doc = etree.SubElement(person, "tipoDocumento")
-    tipo_doc.text = "DNI"
-    
     # Generate realistic-looking DNI
-    dni_num = random.randint(10000000, 99999999)
+    dni_num = rng.randint(10000000, 99999999)
     dni_letters = "TRWAGMYFPDXBNJZSQVHLCKE"
-    dni_letter = dni_letters[dni_num % 23]
-    num_doc = etree.SubElement(person, "numeroDocumento")
-    num_doc.text = f"{dni_num}{dni_letter}"
-    
-    soporte = etree.SubElement(person, "soporteDocumento")
-    soporte.text = ""
-    
+    sub(person, "numeroDocumento", f"{dni_num}{dni_letters[dni_num % 23]}")
+    sub(person, "soporteDocumento", "")
+
     # Random realistic birth date (18-80 years old)
-    year = random.randint(1945, 2005)
-    month = random.randint(1, 12)
-    day = random.randint(1, 28)
-    nac = etree.SubElement(person, "fechaNacimiento")
-    nac.text = f"{year}-{month:02d}-{day:02d}"
-    
-    sexo = etree.SubElement(person, "sexo")
-    sexo.text = random.choice(["H", "M"])
-    
-    addr, cp_val, city_val = random.choice(CITIES)
-    
-    direccion = etree.SubElement(person, "direccion")
-    d1 = etree.SubElement(direccion, "direccion")
-    d1.text = addr
-    d2 = etree.SubElement(direccion, "direccionComplementaria")
-    d2.text = ""
-    cp = etree.SubElement(direccion, "codigoPostal")
-    cp.text = cp_val
-    pais = etree.SubElement(direccion, "pais")
-    pais.text = "ESP"
-    
-    tel = etree.SubElement(person, "telefono")
+    year = rng.randint(1945, 2005)
+    month = rng.randint(1, 12)
+    day = rng.randint(1, 28)
+    sub(person, "fechaNacimiento", f"{year}-{month:02d}-{day:02d}")
+    sub(person, "sexo", rng.choice(["H", "M"]))
+
+    addr, cp_val, city_val = rng.choice(CITIES)
+    direccion = sub(person, "direccion")
+    sub(direccion, "direccion", addr)
+    sub(direccion, "direccionComplementaria", "")
+    sub(direccion, "codigoPostal", cp_val)
+    sub(direccion, "pais", "ESP")
+
     # Generate realistic mobile number
-    tel.text = f"6{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}{random.randint(0,9)}"
-    
-    tel2 = etree.SubElement(person, "telefono2")
-    tel2.text = ""
-    
-    email = etree.SubElement(person, "correo")
-    email.text = f"{nombre_text.lower()}.{ap1_text.lower()}{random.randint(1,99)}@{random.choice(DOMAINS)}"
-    
-    parentesco = etree.SubElement(person, "parentesco")
-    parentesco.text = ""
-    
+    sub(person, "telefono", "6" + "".join(str(rng.randint(0, 9)) for _ in range(8)))
+    sub(person, "telefono2", "")
+    sub(person, "correo", f"{nombre_text.lower()}.{ap1_text.lower()}{rng.randint(1,99)}@{rng.choice(DOMAINS)}")
+    sub(person, "parentesco", "")
     return person
 
-def main():
+def local_name(element):
+    return etree.QName(element).localname if isinstance(element.tag, str) else ""
+
+def augment_comunicacion(com, rng, personas=None):
+    """Appends generated personas to one comunicacion until it reaches numPersonas
+    (set to personas first when given). Returns how many were added."""
+    contrato = next((child for child in com if local_name(child) in CONTRACT_TAGS), None)
+    if contrato is None:
+        return 0
+    num_personas_node = next((child for child in contrato if local_name(child) == "numPersonas"), None)
+    if personas is not None:
+        if num_personas_node is None:
+            namespace = etree.QName(contrato).namespace
+            num_personas_node = etree.SubElement(contrato, f"{{{namespace}}}numPersonas" if namespace else "numPersonas")
+        num_personas_node.text = str(personas)
+    if num_personas_node is None or not num_personas_node.text:
+        return 0
     try:
-        parser = etree.XMLParser(remove_blank_text=True)
-        tree = etree.parse(SOURCE_FILE, parser)
-        root = tree.getroot()
-        
-        # Find all comunicacion blocks
-        # lxml handles namespaces differently. We can use local-name() in xpath
-        comunicacion_nodes = root.xpath(".//*[local-name()='comunicacion']")
-        
-        print(f"Found {len(comunicacion_nodes)} comunicacion nodes.")
-        
-        total_added = 0
-        
-        for com in comunicacion_nodes:
-            # Find contrato and numPersonas
-            contrato = None
-            for child in com:
-                if 'contrato' in child.tag:
-                    contrato = child
-                    break
-            
-            if contrato is None:
+        target_count = int(num_personas_node.text)
+    except ValueError:
+        return 0
+
+    current_count = sum(1 for child in com if local_name(child) == "persona")
+    needed = target_count - current_count
+    namespace = etree.QName(com).namespace
+    for i in range(needed):
+        com.append(generate_fake_person(current_count + i + 1, rng, namespace))
+    return max(needed, 0)
+
+def comunicacion_rng(seed, position):
+    return random.Random(f"{seed}-{position}")
+
+def augment_batch(batch, seed, personas):
+    """Worker side of multi-process mode: [(position, serialized comunicacion)] ->
+    (serialized augmented comunicaciones, personas added)."""
+    parser = etree.XMLParser(remove_blank_text=True)
+    output = []
+    added = 0
+    for position, data in batch:
+        com = etree.fromstring(data, parser)
+        added += augment_comunicacion(com, comunicacion_rng(seed, position), personas)
+        output.append(etree.tostring(com))
+    return output, added
+
+class StreamingRewriter:
+    """Copies an XML document from iterparse events to an xmlfile writer, handing every
+    comunicacion to a callback and freeing each subtree once it is written.
+
+    Ancestors of a comunicacion are opened in the output the first time one is
+    seen (writing the children they already have), other elements are written
+    whole when they end.
+    """
+
+    def __init__(self, writer, on_comunicacion):
+        self.writer = writer
+        self.on_comunicacion = on_comunicacion
+        self.stack = []     # [(element, context manager or None)] from the root down
+        self.inside = 0     # depth inside a comunicacion
+
+    def start(self, element):
+        if self.inside or local_name(element) == "comunicacion":
+            self.inside += 1
+            if self.inside == 1:
+                self._open_ancestors(element)
+            return
+        self.stack.append([element, None])
+
+    def end(self, element):
+        if self.inside:
+            self.inside -= 1
+            if self.inside == 0:
+                self.on_comunicacion(element)
+                self._release(element)
+            return
+        _, context = self.stack.pop()
+        if context is not None:
+            context.__exit__(None, None, None)
+            if self.stack:
+                self.writer.write("\n")
+        elif not self.stack or self.stack[-1][1] is not None:
+            # Complete element directly under an open ancestor (or the whole document)
+            self.writer.write(element, pretty_print=True)
+        else:
+            return  # written with its parent
+        self._release(element)
+
+    def write(self, element):
+        """Writes a processed comunicacion (or an element parsed from one)."""
+        self.writer.write(element, pretty_print=True)
+
+    def _open_ancestors(self, comunicacion):
+        path = [element for element, _ in self.stack[1:]] + [comunicacion]
+        for entry, child_on_path in zip(self.stack, path):
+            element, context = entry
+            if context is not None:
                 continue
-                
-            num_personas_node = None
-            for child in contrato:
-                if 'numPersonas' in child.tag:
-                    num_personas_node = child
+            context = self.writer.element(element.tag, dict(element.attrib), nsmap=element.nsmap)
+            context.__enter__()
+            entry[1] = context
+            self.writer.write("\n")
+            if element.text and element.text.strip():
+                self.writer.write(element.text)
+            # Children that ended before this element turned out to be an ancestor (the
+            # parser may already have added later ones, which still get their own events)
+            for child in list(element):
+                if child is child_on_path:
                     break
-            
-            if num_personas_node is None or not num_personas_node.text:
-                continue
-                
-            try:
-                target_count = int(num_personas_node.text)
-            except ValueError:
-                continue
-                
-            # Count existing persons
-            persons = [child for child in com if 'persona' in child.tag]
-            current_count = len(persons)
-            
-            needed = target_count - current_count
-            
-            if needed > 0:
-                print(f"Adding {needed} persons to contract (Target: {target_count}, Current: {current_count})")
-                for i in range(needed):
-                    new_person = generate_fake_person(total_added + i + 1)
-                    com.append(new_person)
-                total_added += needed
-
-        tree.write(OUTPUT_FILE, encoding="UTF-8", xml_declaration=True, pretty_print=True)
-        print(f"Successfully created {OUTPUT_FILE} with {total_added} new travelers.")
-        
-    except Exception as e:
-        print(f"Error: {e}")
+                self.writer.write(child, pretty_print=True)
+                self._release(child)
+
+    @staticmethod
+    def _release(element):
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            parent.remove(element)
+
+def iter_events(source):
+    return etree.iterparse(source, events=("start", "end"), remove_blank_text=True, remove_comments=True, remove_pis=True)
+
+def augment_file(source, output, seed, personas=None, workers=1):
+    """Streams source to output adding personas; returns (comunicaciones, personas added)."""
+    counts = {"comunicaciones": 0, "added": 0}
+
+    with etree.xmlfile(output, encoding="UTF-8") as writer:
+        writer.write_declaration()
+        if workers <= 1:
+            def process(com):
+                counts["added"] += augment_comunicacion(com, comunicacion_rng(seed, counts["comunicaciones"]), personas)
+                counts["comunicaciones"] += 1
+                rewriter.write(com)
+
+            rewriter = StreamingRewriter(writer, process)
+            for event, element in iter_events(source):
+                getattr(rewriter, event)(element)
+            return counts["comunicaciones"], counts["added"]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []    # futures in document order
+            batch = []
+
+            def drain(limit):
+                while len(pending) > limit:
+                    results, added = pending.pop(0).result()
+                    counts["added"] += added
+                    for data in results:
+                        rewriter.write(etree.fromstring(data))
+
+            def flush_batch():
+                if batch:
+                    pending.append(pool.submit(augment_batch, list(batch), seed, personas))
+                    batch.clear()
+                    # Bounded read-ahead: at most two batches per worker in flight
+                    drain(2 * workers)
+
+            def process(com):
+                batch.append((counts["comunicaciones"], etree.tostring(com)))
+                counts["comunicaciones"] += 1
+                if len(batch) >= BATCH_SIZE:
+                    flush_batch()
+
+            rewriter = StreamingRewriter(writer, process)
+            for event, element in iter_events(source):
+                if event == "end" and not rewriter.inside and local_name(element) != "comunicacion":
+                    # Everything queued so far precedes this element in the output
+                    flush_batch()
+                    drain(0)
+                getattr(rewriter, event)(element)
+            flush_batch()
+            drain(0)
+    return counts["comunicaciones"], counts["added"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill SES traveler files up to numPersonas with fake travelers.")
+    parser.add_argument("input", help="source XML file")
+    parser.add_argument("output", help="augmented XML file to write")
+    parser.add_argument("--seed", type=int, help="RNG seed for reproducible output (random if omitted)")
+    parser.add_argument("--personas", type=int, help="set numPersonas of every contract to this before filling")
+    parser.add_argument("--workers", type=int, default=1, help="generator processes (1 = inline)")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    started = time.perf_counter()
+    try:
+        comunicaciones, added = augment_file(args.input, args.output, seed, args.personas, args.workers)
+    except (OSError, etree.XMLSyntaxError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Wrote {args.output}: {comunicaciones} comunicaciones, {added} new travelers "
+          f"in {time.perf_counter() - started:.1f}s (seed {seed}).")
 
 if __name__ == "__main__":
     main()
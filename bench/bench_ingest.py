@@ -0,0 +1,300 @@
+"""Reproducible ingest benchmark.
+
+Drives mock_ses() through Flask's test client with synthetic PV, RH and
+Oracle DATA_DS lotes (bench/generators.py) and reports, per lote shape and
+store size: throughput, p50/p95/p99 latency, peak RSS and the median time
+of each ingest stage (base64 = envelope + base64 decode, unzip, parse,
+persist). The app runs in a temporary directory with ASYNC_INGEST=0, so a
+request's latency includes persisting it, and without the dedup cache, so
+repeated payloads are ingested again instead of answered from it; uploads
+to the fake GCS bucket are held back until the end so they do not add
+noise. Each scenario is timed --rounds times and the round with the lowest
+p50 is kept.
+
+    python bench/bench_ingest.py                   # quick profile, compared with bench/baseline.json
+    python bench/bench_ingest.py --profile full    # up to 10k personas, 1k comunicaciones, 100k stored
+    python bench/bench_ingest.py --save-baseline   # record this run as the new baseline
+
+Exits with status 1 when a scenario's p50 latency regressed by more than
+--tolerance against the baseline (numbers only compare on the same machine).
+"""
+import argparse
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import generators
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# (comunicaciones, personas per comunicacion) per lote
+PROFILES = {
+    "quick": {
+        "shapes": [(1, 1), (10, 10), (100, 10), (1, 1000)],
+        "store_sizes": [0, 10000],
+        "requests": 50,
+        "persona_budget": 10000,
+    },
+    "full": {
+        "shapes": [(1, 1), (10, 10), (100, 10), (1000, 10), (1, 1000), (1, 10000)],
+        "store_sizes": [0, 10000, 100000],
+        "requests": 200,
+        "persona_budget": 200000,
+    },
+}
+STAGES = ("base64", "unzip", "parse", "persist")
+MIN_REQUESTS = 5
+DISTINCT_PAYLOADS = 10
+PREFILL_BATCH = 5000
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def median(values):
+    return percentile(values, 0.5)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def start_app(workdir, storage):
+    """Imports app inside workdir so its data files, blobs and fake GCS bucket stay there."""
+    os.chdir(workdir)
+    os.environ.update({
+        "STORAGE_BACKEND": storage,
+        "ASYNC_INGEST": "0",
+        "DEDUP_MAX_ENTRIES": "0",
+        "GCS_FAKE_DIR": os.path.join(workdir, "gcs"),
+        "LOG_COMPACTION_INTERVAL": "3600",
+        "PERSIST_INTERVAL": "3600",
+        "PERSIST_MAX_DIRTY": "1000000000",
+    })
+    import app
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+def prefill(app, count, samples):
+    """Stores synthetic requests until the store holds count of them."""
+    missing = count - len(app.view)
+    while missing > 0:
+        batch = []
+        for _ in range(min(missing, PREFILL_BATCH)):
+            header, xml_sha256, structured = random.choice(samples)
+            batch.append({
+                "id": None,
+                "timestamp": "2025-01-01 00:00:00",
+                "header": header,
+                "xml_sha256": xml_sha256,
+                "structured": structured,
+            })
+        app.store_entries(batch)
+        missing -= len(batch)
+
+
+def prefill_samples(app, count=200):
+    samples = []
+    for i in range(count):
+        xml_content = generators.lote_xml(generators.KINDS[i % len(generators.KINDS)], 1, random.randint(1, 4))
+        header = {"arrendador": f"BENCH{i % 50:03d}", "aplicacion": "BENCH", "tipoOperacion": "A", "tipoComunicacion": "PV"}
+        samples.append((header, app.xml_blobs.put(xml_content), app.parse_ses_xml(xml_content)))
+    return samples
+
+
+def time_stages(app, payload):
+    """Runs one submission through the ingest stages by hand and times each one (ms)."""
+    timings = {}
+    started = time.perf_counter()
+    fields, zip_file = app.ingest.read_envelope(io.BytesIO(payload), app.ingest_limits)
+    timings["base64"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with zip_file, zipfile.ZipFile(zip_file) as archive:
+        name = next(n for n in archive.namelist() if n.endswith(".xml"))
+        xml_content = archive.read(name).decode("utf-8")
+    timings["unzip"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    structured = app.parse_ses_xml(xml_content)
+    timings["parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    entry = {
+        "id": None,
+        "timestamp": "2025-01-01 00:00:00",
+        "header": {"arrendador": fields["codigoArrendador"]},
+        "xml_sha256": app.xml_blobs.put(xml_content),
+        "structured": structured,
+    }
+    app.store_entries([entry])
+    timings["persist"] = time.perf_counter() - started
+    return {stage: seconds * 1000 for stage, seconds in timings.items()}
+
+
+def run_scenario(app, client, kind, comunicaciones, personas, requests, rounds):
+    payloads = [
+        generators.lote_envelope(kind, comunicaciones, personas).encode("utf-8")
+        for _ in range(min(requests, DISTINCT_PAYLOADS))
+    ]
+    client.post("/hospedajes-web/ws/v1/comunicacion", data=payloads[0])  # warm up
+
+    best = None
+    for _ in range(rounds):
+        gc.collect()
+        latencies = []
+        for i in range(requests):
+            started = time.perf_counter()
+            response = client.post("/hospedajes-web/ws/v1/comunicacion", data=payloads[i % len(payloads)])
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"{kind} lote rejected with {response.status_code}: {response.data[:200]!r}")
+        if best is None or percentile(latencies, 0.5) < percentile(best, 0.5):
+            best = latencies
+    latencies = best
+
+    stage_runs = [time_stages(app, payload) for payload in payloads]
+    total_seconds = sum(latencies) / 1000
+    return {
+        "requests": requests,
+        "payload_bytes": round(sum(len(p) for p in payloads) / len(payloads)),
+        "throughput_rps": round(requests / total_seconds, 2),
+        "personas_per_s": round(requests * comunicaciones * personas / total_seconds, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+        },
+        "stages_ms": {stage: round(median([run[stage] for run in stage_runs]), 3) for stage in STAGES},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the results next to the baseline; returns the keys whose p50 regressed."""
+    previous = (baseline or {}).get("results", {})
+    regressions = []
+    print(f"{'scenario':<28}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}  {'b64/unzip/parse/persist ms':<30}{'rss MB':>8}{'vs base':>10}")
+    for key, result in results.items():
+        latency = result["latency_ms"]
+        stages = "/".join(f"{result['stages_ms'][s]:.2f}" for s in STAGES)
+        delta = ""
+        if key in previous:
+            before = previous[key]["latency_ms"]["p50"]
+            change = (latency["p50"] - before) / before if before else 0.0
+            delta = f"{change:+.0%}"
+            if change > tolerance:
+                regressions.append(key)
+                delta += " !"
+        print(f"{key:<28}{result['throughput_rps']:>10}{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}  "
+              f"{stages:<30}{result['peak_rss_mb']:>8}{delta:>10}")
+    return regressions
+
+
+def parse_shapes(value):
+    shapes = []
+    for part in value.split(","):
+        comunicaciones, _, personas = part.partition("x")
+        shapes.append((int(comunicaciones), int(personas or 1)))
+    return shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest benchmark for the SES mock.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--kinds", default=",".join(generators.KINDS), help="comma separated: pv,rh,oracle")
+    parser.add_argument("--shapes", help="comma separated COMUNICACIONESxPERSONAS, e.g. 1x1,100x10")
+    parser.add_argument("--store-sizes", help="comma separated stored request counts, e.g. 0,10000")
+    parser.add_argument("--requests", type=int, help="requests per scenario (capped by the persona budget)")
+    parser.add_argument("--rounds", type=int, default=3, help="timed rounds per scenario; the best p50 is kept")
+    parser.add_argument("--storage", default="log", choices=["log", "json", "sqlite"])
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    shapes = parse_shapes(args.shapes) if args.shapes else profile["shapes"]
+    store_sizes = sorted(int(s) for s in args.store_sizes.split(",")) if args.store_sizes else profile["store_sizes"]
+    max_requests = args.requests or profile["requests"]
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="ses-bench-")
+    cwd = os.getcwd()
+    try:
+        app = start_app(workdir, args.storage)
+        client = app.app.test_client()
+        samples = prefill_samples(app)
+        results = {}
+        for store_size in store_sizes:
+            started = time.perf_counter()
+            prefill(app, store_size, samples)
+            print(f"# store size {store_size} (prefilled in {time.perf_counter() - started:.1f}s)", file=sys.stderr)
+            for kind in kinds:
+                for comunicaciones, personas in shapes:
+                    requests = max(MIN_REQUESTS, min(max_requests, profile["persona_budget"] // (comunicaciones * personas)))
+                    key = f"{kind}-c{comunicaciones}-p{personas}@{store_size}"
+                    results[key] = run_scenario(app, client, kind, comunicaciones, personas, requests, args.rounds)
+                    print(f"#   {key}: {results[key]['latency_ms']['p50']} ms p50", file=sys.stderr)
+        app.backend.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "profile": args.profile,
+            "storage": args.storage,
+            "seed": args.seed,
+            "rounds": args.rounds,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%d"),
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {path}")
+
+    if regressions:
+        print(f"p50 regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
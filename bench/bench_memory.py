@@ -0,0 +1,82 @@
+"""Memory held by the in-memory view, per stored persona.
+
+Builds synthetic requests like the ingest benchmark (PV, RH and Oracle
+DATA_DS lotes), round-trips them through JSON as a backend load would, and
+measures with tracemalloc what it takes to keep them as plain dicts and as
+the compact records the app holds in its view.
+
+    python bench/bench_memory.py                  # 20k requests
+    python bench/bench_memory.py --requests 100000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import generators
+import records
+from sesxml import parse_ses_xml
+
+DISTINCT_DOCUMENTS = 200
+
+
+def synthetic_lines(count):
+    """JSON lines of stored requests, each with its own copy of the data (as read from disk)."""
+    documents = []
+    for i in range(DISTINCT_DOCUMENTS):
+        kind = generators.KINDS[i % len(generators.KINDS)]
+        documents.append((kind, parse_ses_xml(generators.lote_xml(kind, random.randint(1, 3), random.randint(1, 4)))))
+    lines = []
+    for i in range(count):
+        kind, structured = random.choice(documents)
+        lines.append(json.dumps({
+            "id": i + 1,
+            "lote": f"MOCK-{random.getrandbits(128):032x}",
+            "timestamp": f"2025-01-01 00:{i // 3600 % 60:02d}:{i // 60 % 60:02d}",
+            "header": {"arrendador": f"BENCH{i % 50:03d}", "aplicacion": "BENCH", "tipoOperacion": "A",
+                       "tipoComunicacion": "PV" if kind == "pv" else "RH"},
+            "xml_sha256": f"{random.getrandbits(256):064x}",
+            "structured": structured,
+        }))
+    return lines
+
+
+def measure(build, lines):
+    gc.collect()
+    tracemalloc.start()
+    held = build(lines)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per persona of the in-memory view.")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    lines = synthetic_lines(args.requests)
+    dicts, dict_bytes = measure(lambda ls: [json.loads(line) for line in ls], lines)
+    personas = sum(len(c["personas"]) for req in dicts for c in req["structured"]["contracts"])
+    del dicts
+    compact, record_bytes = measure(lambda ls: [records.compact(json.loads(line)) for line in ls], lines)
+    assert records.to_plain(compact[0]) == json.loads(lines[0])
+
+    print(f"{args.requests} requests, {personas} personas")
+    print(f"{'':<10}{'MB':>10}{'bytes/request':>16}{'bytes/persona':>16}")
+    for name, size in (("dicts", dict_bytes), ("records", record_bytes)):
+        print(f"{name:<10}{size / 1024 / 1024:>10.1f}{size / args.requests:>16.0f}{size / personas:>16.0f}")
+    print(f"records use {1 - record_bytes / dict_bytes:.0%} less")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Synthetic lotes for benchmarks and load tests.
+
+Personas come from augment_xml.generate_fake_person() and envelopes from
+populate_mock_data.create_soap_payload(), so the data looks like what the
+existing tools produce. Seed the random module for reproducible output.
+"""
+import os
+import random
+import sys
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from augment_xml import generate_fake_person
+from populate_mock_data import create_soap_payload
+
+KINDS = ("pv", "rh", "oracle")
+
+
+def random_date(start_year=2024, end_year=2026):
+    return f"{random.randint(start_year, end_year)}{random.randint(1, 12):02d}{random.randint(1, 28):02d}"
+
+
+def ses_comunicacion(kind, index, personas):
+    """One SES comunicacion: a contrato (PV) or reserva (RH) plus its personas."""
+    comunicacion = etree.Element("comunicacion")
+    contract = etree.SubElement(comunicacion, "contrato" if kind == "pv" else "reserva")
+    etree.SubElement(contract, "referencia").text = f"{kind.upper()}-{index:06d}-{random.randint(0, 999999):06d}"
+    if kind == "rh":
+        etree.SubElement(contract, "fechaReserva").text = random_date()
+    entrada = random_date()
+    etree.SubElement(contract, "fechaEntrada").text = entrada
+    etree.SubElement(contract, "fechaSalida").text = entrada
+    etree.SubElement(contract, "numPersonas").text = str(personas)
+    pago = etree.SubElement(contract, "pago")
+    etree.SubElement(pago, "tipoPago").text = random.choice(["EFECT", "TARJT", "TRANS"])
+    for i in range(personas):
+        persona = generate_fake_person(i + 1)
+        etree.SubElement(persona, "nacionalidad").text = "ESP"
+        comunicacion.append(persona)
+    return comunicacion
+
+
+def oracle_g1(index, personas):
+    """One Oracle BI Publisher G_1 reservation with its G_2 guests."""
+    g1 = etree.Element("G_1")
+    etree.SubElement(g1, "CONFIRMATION_NO").text = f"{random.randint(10000000, 99999999)}"
+    entrada = random_date()
+    etree.SubElement(g1, "INSERT_DATE").text = f"{entrada[:4]}-{entrada[4:6]}-{entrada[6:]}T00:00:00"
+    etree.SubElement(g1, "BEGIN_DATE").text = f"{entrada[:4]}-{entrada[4:6]}-{entrada[6:]}T00:00:00"
+    etree.SubElement(g1, "END_DATE").text = f"{entrada[:4]}-{entrada[4:6]}-{entrada[6:]}T00:00:00"
+    etree.SubElement(g1, "PAYMENT_METHOD").text = random.choice(["CASH", "CARD"])
+    for i in range(personas):
+        persona = generate_fake_person(i + 1)
+        g2 = etree.SubElement(g1, "G_2")
+        etree.SubElement(g2, "FIRST").text = f"{persona.findtext('nombre')} {persona.findtext('apellido1')}"
+        etree.SubElement(g2, "NACIONALIDAD").text = "ESP"
+        etree.SubElement(g2, "SEXO").text = persona.findtext("sexo")
+        etree.SubElement(g2, "PAIS").text = persona.findtext("direccion/pais")
+        etree.SubElement(g2, "TELEFONO").text = persona.findtext("telefono")
+        etree.SubElement(g2, "CORREO").text = persona.findtext("correo")
+    return g1
+
+
+def lote_xml(kind, comunicaciones=1, personas=1):
+    """Inner XML for one lote: kind is pv, rh or oracle (DATA_DS)."""
+    if kind == "oracle":
+        root = etree.Element("DATA_DS")
+        for i in range(comunicaciones):
+            root.append(oracle_g1(i, personas))
+    else:
+        root = etree.Element("peticion")
+        solicitud = etree.SubElement(root, "solicitud")
+        etree.SubElement(solicitud, "tipoComunicacion").text = kind.upper()
+        for i in range(comunicaciones):
+            solicitud.append(ses_comunicacion(kind, i, personas))
+    return etree.tostring(root, encoding="UTF-8", xml_declaration=True).decode("utf-8")
+
+
+def lote_envelope(kind, comunicaciones=1, personas=1):
+    """Complete SOAP comunicacion request carrying one synthetic lote."""
+    return create_soap_payload(lote_xml(kind, comunicaciones, personas))
@@ -0,0 +1,385 @@
+"""Load generator for a running SES mock (replaces populate_mock_data.py for load tests).
+
+Sends captured or synthetic SOAP envelopes over persistent HTTP/1.1
+connections from asyncio, either closed-loop (N clients, each sending its
+next request as soon as the previous one finished) or open-loop (a fixed
+arrival rate, whatever the server does). Prints a latency histogram and
+the error rate every --interval seconds and a summary at the end.
+
+    python bench/loadgen.py --concurrency 16 --duration 60
+    python bench/loadgen.py --rate 200 --duration 60 --shape 10x4 --kinds pv,rh
+    python bench/loadgen.py --replay captured/ --rate 50 --url https://mock.example/hospedajes-web/ws/v1/comunicacion
+
+Open-loop latencies are measured from each request's scheduled start, so
+time spent waiting for a free connection counts (no coordinated omission).
+--replay accepts envelope files, directories of *.xml envelopes and NDJSON
+files in the batch endpoint format (one envelope string or {"envelope": ...}
+per line).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import ssl
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_URL = "http://localhost:8080/hospedajes-web/ws/v1/comunicacion"
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+HISTOGRAM_WIDTH = 40
+
+
+class HttpError(Exception):
+    pass
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    @classmethod
+    async def open(cls, host, port, ssl_context):
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        return cls(reader, writer)
+
+    async def request(self, method, host, path, body, content_type):
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n"
+        )
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before the response")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise HttpError(f"bad status line {status_line!r}")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await self.reader.read()
+            self.reusable = False
+
+        if headers.get("connection", "").lower() == "close" or parts[0] == "HTTP/1.0":
+            self.reusable = False
+        return status, data
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+class ConnectionPool:
+    """At most size connections to one origin, reused across requests."""
+
+    def __init__(self, url, size):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.host_header = parts.netloc
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.ssl_context = ssl.create_default_context() if parts.scheme == "https" else None
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def _connect(self):
+        self.opened += 1
+        return await Connection.open(self.host, self.port, self.ssl_context)
+
+    async def post(self, body, content_type="text/xml"):
+        async with self.slots:
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else await self._connect()
+            try:
+                try:
+                    result = await conn.request("POST", self.host_header, self.path, body, content_type)
+                except (ConnectionResetError, asyncio.IncompleteReadError, BrokenPipeError):
+                    if not reused:
+                        raise
+                    # The server dropped an idle keep-alive connection; retry once on a new one
+                    conn.close()
+                    conn = await self._connect()
+                    result = await conn.request("POST", self.host_header, self.path, body, content_type)
+            except BaseException:
+                conn.close()
+                raise
+            if conn.reusable:
+                self.idle.append(conn)
+            else:
+                conn.close()
+            return result
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+class Stats:
+    """Latencies and errors, per reporting interval and in total."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.interval = []
+        self.total = []
+        self.interval_errors = 0
+        self.errors = {}
+        self.sent = 0
+        self.dropped = 0
+        self.connections = 0
+
+    def record(self, latency_ms, error=None):
+        self.interval.append(latency_ms)
+        self.total.append(latency_ms)
+        if error is not None:
+            self.interval_errors += 1
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def take_interval(self):
+        latencies, errors = self.interval, self.interval_errors
+        self.interval, self.interval_errors = [], 0
+        return latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def histogram(latencies):
+    """Text histogram over fixed log-spaced buckets."""
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for latency in latencies:
+        for i, bound in enumerate(BUCKETS_MS):
+            if latency <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    peak = max(counts) or 1
+    lines = []
+    for i, count in enumerate(counts):
+        if not count:
+            continue
+        label = f"<= {BUCKETS_MS[i]} ms" if i < len(BUCKETS_MS) else f"> {BUCKETS_MS[-1]} ms"
+        lines.append(f"  {label:>12} {count:>8} {'#' * max(1, round(count * HISTOGRAM_WIDTH / peak))}")
+    return "\n".join(lines)
+
+
+def summary_line(latencies, errors, seconds):
+    done = len(latencies)
+    return (
+        f"{done / seconds if seconds else 0:8.1f} req/s  "
+        f"errors {errors / done if done else 0:6.1%}  "
+        f"p50 {percentile(latencies, 0.50):8.1f} ms  "
+        f"p95 {percentile(latencies, 0.95):8.1f} ms  "
+        f"p99 {percentile(latencies, 0.99):8.1f} ms"
+    )
+
+
+# -- payloads ------------------------------------------------------------
+
+def load_replay(paths):
+    """Reads captured envelopes from files, directories (*.xml) and NDJSON files."""
+    payloads = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.xml"))) if os.path.isdir(path) else [path]
+        for name in files:
+            with open(name, "rb") as f:
+                data = f.read()
+            if name.endswith((".ndjson", ".jsonl")):
+                for line in data.splitlines():
+                    if line.strip():
+                        item = json.loads(line)
+                        envelope = item.get("envelope") if isinstance(item, dict) else item
+                        payloads.append(envelope.encode("utf-8"))
+            else:
+                payloads.append(data)
+    return payloads
+
+
+def synthetic_payloads(kinds, comunicaciones, personas, count):
+    import generators
+    return [
+        generators.lote_envelope(kinds[i % len(kinds)], comunicaciones, personas).encode("utf-8")
+        for i in range(count)
+    ]
+
+
+# -- load loops ----------------------------------------------------------
+
+async def send(pool, payload, stats, scheduled):
+    stats.sent += 1
+    error = None
+    try:
+        status, _ = await pool.post(payload)
+        if status != 200:
+            error = f"HTTP {status}"
+    except Exception as e:
+        error = type(e).__name__
+    stats.record((time.monotonic() - scheduled) * 1000, error)
+
+
+async def closed_loop(pool, payloads, stats, concurrency, deadline, max_requests):
+    async def client():
+        while time.monotonic() < deadline and (max_requests is None or stats.sent < max_requests):
+            await send(pool, random.choice(payloads), stats, time.monotonic())
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+
+async def open_loop(pool, payloads, stats, rate, deadline, max_requests, max_outstanding):
+    outstanding = set()
+    start = time.monotonic()
+    i = 0
+    while max_requests is None or i < max_requests:
+        scheduled = start + i / rate
+        if scheduled >= deadline:
+            break
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        i += 1
+        if len(outstanding) >= max_outstanding:
+            # The generator itself would fall over; count it instead of queueing forever
+            stats.dropped += 1
+            stats.record((time.monotonic() - scheduled) * 1000, "dropped")
+            continue
+        task = asyncio.create_task(send(pool, random.choice(payloads), stats, scheduled))
+        outstanding.add(task)
+        task.add_done_callback(outstanding.discard)
+    if outstanding:
+        await asyncio.gather(*outstanding)
+
+
+async def report(stats, interval, show_histogram):
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        latencies, errors = stats.take_interval()
+        print(f"[{now - stats.started:6.1f}s] {summary_line(latencies, errors, now - last)}", file=sys.stderr)
+        if show_histogram and latencies:
+            print(histogram(latencies), file=sys.stderr)
+        last = now
+
+
+async def run(args, payloads):
+    size = args.connections or (args.concurrency if args.concurrency else max(1, int(args.rate)))
+    pool = ConnectionPool(args.url, size)
+    stats = Stats()
+    deadline = stats.started + args.duration
+    reporter = asyncio.create_task(report(stats, args.interval, not args.no_histogram))
+    try:
+        if args.rate:
+            await open_loop(pool, payloads, stats, args.rate, deadline, args.requests, args.max_outstanding)
+        else:
+            await closed_loop(pool, payloads, stats, args.concurrency, deadline, args.requests)
+    finally:
+        reporter.cancel()
+        pool.close()
+    stats.connections = pool.opened
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio load generator for the SES mock.")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, help="closed loop: number of concurrent clients (default 8)")
+    mode.add_argument("--rate", type=float, help="open loop: requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--connections", type=int, help="connection pool size (default: concurrency, or the rate)")
+    parser.add_argument("--max-outstanding", type=int, default=10000, help="open loop: in-flight cap before dropping")
+    parser.add_argument("--replay", nargs="+", metavar="PATH", help="captured envelopes instead of synthetic ones")
+    parser.add_argument("--kinds", default="pv,rh", help="synthetic lote kinds: pv,rh,oracle")
+    parser.add_argument("--shape", default="1x2", help="synthetic COMUNICACIONESxPERSONAS per lote")
+    parser.add_argument("--distinct", type=int, default=50, help="distinct synthetic payloads to cycle through")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between live reports")
+    parser.add_argument("--no-histogram", action="store_true", help="only one line per live report")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+    if not args.rate and not args.concurrency:
+        args.concurrency = 8
+
+    random.seed(args.seed)
+    if args.replay:
+        payloads = load_replay(args.replay)
+    else:
+        comunicaciones, _, personas = args.shape.partition("x")
+        payloads = synthetic_payloads(args.kinds.split(","), int(comunicaciones), int(personas or 1), args.distinct)
+    if not payloads:
+        parser.error("no payloads to send")
+
+    mode = f"open loop at {args.rate:g} req/s" if args.rate else f"closed loop with {args.concurrency} clients"
+    print(f"Sending {len(payloads)} distinct payloads to {args.url}, {mode}, for {args.duration:g}s", file=sys.stderr)
+    stats = asyncio.run(run(args, payloads))
+
+    elapsed = time.monotonic() - stats.started
+    errors = sum(stats.errors.values())
+    print(f"Total: {len(stats.total)} requests in {elapsed:.1f}s over {stats.connections} connections")
+    print(summary_line(stats.total, errors, elapsed))
+    print(histogram(stats.total))
+    for error, count in sorted(stats.errors.items(), key=lambda item: -item[1]):
+        print(f"  {error}: {count}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "url": args.url,
+                "mode": "open" if args.rate else "closed",
+                "rate": args.rate,
+                "concurrency": args.concurrency,
+                "requests": len(stats.total),
+                "seconds": round(elapsed, 3),
+                "throughput_rps": round(len(stats.total) / elapsed, 2) if elapsed else 0,
+                "latency_ms": {f"p{p}": round(percentile(stats.total, p / 100), 3) for p in (50, 90, 95, 99)},
+                "errors": stats.errors,
+                "dropped": stats.dropped,
+                "connections": stats.connections,
+            }, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
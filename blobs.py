@@ -0,0 +1,176 @@
+"""Content-addressed store for the raw inner XML of requests.
+
+Each distinct document is zlib-compressed once and kept under its SHA-256
+(<directory>/ab/abcd...xml.z locally, <gcs_prefix>ab/abcd...xml.z in GCS),
+so records only carry the hash and a client resending the same XML costs
+nothing extra. Documents are read back only when someone asks for them,
+through a small LRU cache of decompressed text.
+
+Blobs are shared between requests, so deleting one request leaves its blob
+behind; clear() removes everything.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class XmlBlobStore:
+    """Stores XML text by SHA-256, compressed on disk and mirrored to GCS through the uploader."""
+
+    def __init__(self, directory, bucket_getter=None, uploader=None, cache_bytes=16 * 1024 * 1024,
+                 level=6, gcs_prefix="xml_blobs/"):
+        self.directory = directory
+        self.bucket_getter = bucket_getter
+        self.uploader = uploader
+        self.cache_bytes = cache_bytes
+        self.level = level
+        self.gcs_prefix = gcs_prefix
+
+        self._cache = OrderedDict()     # digest -> decompressed text, least recently used first
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+        self.generation = 0             # bumped by every clear()
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.xml.z")
+
+    def _remote_name(self, digest):
+        return f"{self.gcs_prefix}{digest[:2]}/{digest}.xml.z"
+
+    # -- writes ----------------------------------------------------------
+
+    def put(self, text):
+        """Stores text unless an identical document is already there; returns its digest."""
+        digest = self.digest(text)
+        path = self._path(digest)
+        if os.path.exists(path):
+            self.deduplicated += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name: several threads (or workers) may store the same document at once
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(text.encode("utf-8"), self.level))
+        os.replace(tmp, path)
+        if self.uploader:
+            self.uploader.upload_file(self._remote_name(digest), path, "application/zlib")
+        return digest
+
+    def clear(self):
+        """Empties the store in constant time: the directory is renamed away, and
+        removed with the matching GCS deletes by a background thread."""
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+            self.generation += 1
+        trash = f"{self.directory}.trash-{os.getpid()}-{time.monotonic_ns()}"
+        try:
+            os.rename(self.directory, trash)
+        except FileNotFoundError:
+            trash = None
+        os.makedirs(self.directory, exist_ok=True)
+        if trash:
+            threading.Thread(target=self._purge, args=(trash,), name="xml-blob-purge", daemon=True).start()
+
+    def _purge(self, trash):
+        if self.uploader:
+            for dirpath, _, filenames in os.walk(trash):
+                for filename in filenames:
+                    if not filename.endswith(".xml.z"):
+                        continue
+                    digest = filename[:-len(".xml.z")]
+                    self.uploader.delete(self._remote_name(digest))
+                    # Stored again since the clear: its upload must win over the delete
+                    if os.path.exists(self._path(digest)):
+                        self.uploader.upload_file(self._remote_name(digest), self._path(digest), "application/zlib")
+        shutil.rmtree(trash, ignore_errors=True)
+
+    # -- reads -----------------------------------------------------------
+
+    def get(self, digest):
+        """Returns the XML text stored under digest, or None if it is nowhere to be found."""
+        with self._lock:
+            text = self._cache.get(digest)
+            if text is not None:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        data = self._read(digest)
+        if data is None:
+            return None
+        text = zlib.decompress(data).decode("utf-8")
+        self._remember(digest, text)
+        return text
+
+    def _read(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        return self._download(digest)
+
+    def _download(self, digest):
+        """Fetches a blob that only exists in GCS (fresh container) and keeps a local copy."""
+        bucket = self.bucket_getter() if self.bucket_getter else None
+        if bucket is None:
+            return None
+        try:
+            with metrics.GCS_SECONDS.time(operation="download"):
+                data = bucket.blob(self._remote_name(digest)).download_as_bytes()
+        except Exception as e:
+            metrics.GCS_ERRORS.inc(operation="download")
+            logger.error(f"Error downloading XML blob {digest} from GCS: {e}")
+            return None
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return data
+
+    def _remember(self, digest, text):
+        size = len(text)
+        if size > self.cache_bytes:
+            return
+        with self._lock:
+            if digest in self._cache:
+                return
+            self._cache[digest] = text
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def status(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "cached_bytes": self._cached_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+            }
@@ -0,0 +1,346 @@
+"""Cold tier for requests the retention policy moved out of the in-memory view.
+
+Evicted requests are appended, oldest first, to gzip-compressed JSONL
+segments (<directory>/segment-000001.jsonl.gz, ...), one gzip member per
+batch, and mirrored to GCS under gcs_prefix through the uploader. A small
+manifest records each segment's request count and ID/timestamp range, so
+a lookup by ID opens a single segment and listings can skip segments
+outside their cursor. Each segment also carries a Bloom filter of its
+lote IDs, so a consultaLote for a lote that is not archived (unknown or
+expired) opens no segment at all and a hit opens one or two. Everything
+else is a sequential scan, which is the price of keeping these requests
+out of memory.
+
+Deletes of archived requests are recorded in their segment's manifest
+entry and applied when reading; a segment whose requests are all deleted
+is dropped. Several worker processes may share the directory: mutations
+run under exclusive(), which also takes an flock on the directory and
+re-reads the manifest.
+"""
+import base64
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import zlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Lote Bloom filters: bits per request a segment can hold and probes per lote (about 2%
+# false positives when full; a false positive costs one segment read)
+LOTE_BLOOM_BITS = 8
+LOTE_BLOOM_HASHES = 5
+
+
+def bloom_positions(lote, bits):
+    digest = hashlib.sha256(lote.encode("utf-8")).digest()
+    return [int.from_bytes(digest[4 * i:4 * i + 4], "big") % bits for i in range(LOTE_BLOOM_HASHES)]
+
+
+def bloom_add(bloom, lotes):
+    """Sets the bits of lotes in a filter given as base64 text; returns the new text."""
+    data = bytearray(base64.b64decode(bloom))
+    for lote in lotes:
+        for position in bloom_positions(lote, len(data) * 8):
+            data[position >> 3] |= 1 << (position & 7)
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+
+def new_bloom(capacity):
+    return base64.b64encode(bytes(max(1, capacity * LOTE_BLOOM_BITS // 8))).decode("ascii")
+
+
+class ColdArchive:
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory, bucket_getter=None, uploader=None, segment_max_records=5000,
+                 gcs_prefix="cold/"):
+        self.directory = directory
+        self.bucket_getter = bucket_getter
+        self.uploader = uploader
+        self.segment_max_records = segment_max_records
+        self.gcs_prefix = gcs_prefix
+
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._manifest = self._read_manifest()
+        self._blooms = {}   # segment number -> (base64 text, decoded bytes)
+        if self._outdated():
+            with self.exclusive():
+                pass
+
+    def _segment_name(self, number):
+        return f"segment-{number:06d}.jsonl.gz"
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, self._segment_name(number))
+
+    # -- manifest --------------------------------------------------------
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, self.MANIFEST)
+        if not os.path.exists(path):
+            self._download(self.MANIFEST, path)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except ValueError as e:
+            logger.error(f"Unreadable cold archive manifest, starting empty: {e}")
+            manifest = {}
+        manifest.setdefault("segments", [])
+        for segment in manifest["segments"]:
+            segment.setdefault("deleted", [])
+        manifest.setdefault("next_number", max((s["number"] for s in manifest["segments"]), default=0) + 1)
+        return manifest
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, self.MANIFEST)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp, path)
+        if self.uploader:
+            self.uploader.upload_file(self.gcs_prefix + self.MANIFEST, path, "application/json")
+
+    def _download(self, name, path):
+        """Copies name from GCS to path if it only exists there (fresh container). Returns True on success."""
+        bucket = self.bucket_getter() if self.bucket_getter else None
+        if bucket is None:
+            return False
+        try:
+            blob = bucket.blob(self.gcs_prefix + name)
+            if not blob.exists():
+                return False
+            tmp = f"{path}.{os.getpid()}.download"
+            blob.download_to_filename(tmp)
+            os.replace(tmp, path)
+            return True
+        except Exception as e:
+            logger.error(f"Error downloading cold archive object {name}: {e}")
+            return False
+
+    @contextmanager
+    def exclusive(self):
+        """Serializes archive mutations across threads and processes; re-entrant within a thread."""
+        with self._lock:
+            if self._depth == 0:
+                self._lock_file = open(os.path.join(self.directory, ".lock"), "w")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                self._manifest = self._read_manifest()
+            self._depth += 1
+            try:
+                if self._outdated():
+                    self._migrate()
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _outdated(self):
+        manifest = self._manifest
+        return "deleted" in manifest or any("lotes" not in segment for segment in manifest["segments"])
+
+    def _migrate(self):
+        """Brings a manifest written by an older version up to date: builds the lote filters
+        of its segments and moves its tombstones (one list for the whole archive) to the
+        segments that actually hold them."""
+        for segment in self._manifest["segments"]:
+            if "lotes" not in segment:
+                entries = self._read_segment(segment, deleted=())
+                segment["lotes"] = bloom_add(new_bloom(max(segment["count"], 1)),
+                                             [entry["lote"] for entry in entries if entry.get("lote")])
+        if "deleted" in self._manifest:
+            self.delete_many(self._manifest.pop("deleted"))
+        self._write_manifest()
+
+    # -- writes ----------------------------------------------------------
+
+    def append(self, entries):
+        """Archives full request dicts, oldest first."""
+        if not entries:
+            return
+        with self.exclusive():
+            segments = self._manifest["segments"]
+            start = 0
+            while start < len(entries):
+                if not segments or segments[-1]["count"] >= self.segment_max_records:
+                    segments.append({"number": self._manifest["next_number"], "count": 0, "deleted": [],
+                                     "lotes": new_bloom(self.segment_max_records)})
+                    self._manifest["next_number"] += 1
+                segment = segments[-1]
+                chunk = entries[start:start + self.segment_max_records - segment["count"]]
+                start += len(chunk)
+                self._append_chunk(segment, chunk)
+            self._write_manifest()
+
+    def _append_chunk(self, segment, chunk):
+        path = self._segment_path(segment["number"])
+        if segment["count"] and not os.path.exists(path):
+            self._download(self._segment_name(segment["number"]), path)
+        data = "".join(json.dumps(entry) + "\n" for entry in chunk).encode("utf-8")
+        with open(path, "ab") as f:
+            # Each append is a gzip member of its own; readers see one stream
+            f.write(gzip.compress(data))
+        ids = [entry["id"] for entry in chunk]
+        timestamps = [entry.get("timestamp") or "" for entry in chunk]
+        if segment["count"]:
+            ids += [segment["min_id"], segment["max_id"]]
+            timestamps += [segment["first_timestamp"], segment["last_timestamp"]]
+        segment.update(
+            count=segment["count"] + len(chunk),
+            min_id=min(ids),
+            max_id=max(ids),
+            first_timestamp=min(timestamps),
+            last_timestamp=max(timestamps),
+            lotes=bloom_add(segment["lotes"], [entry["lote"] for entry in chunk if entry.get("lote")]),
+        )
+        if self.uploader:
+            self.uploader.upload_file(self.gcs_prefix + self._segment_name(segment["number"]), path, "application/gzip")
+
+    def delete(self, request_id):
+        """Deletes an archived request; returns False if the archive does not hold it."""
+        return bool(self.delete_many([request_id]))
+
+    def delete_many(self, request_ids):
+        """Deletes archived requests; returns how many of them the archive held."""
+        with self.exclusive():
+            by_segment = {}
+            for request_id in request_ids:
+                segment = self._segment_for(request_id)
+                if segment is not None:
+                    by_segment.setdefault(segment["number"], (segment, set()))[1].add(request_id)
+            found = 0
+            for segment, ids in by_segment.values():
+                # The ID range has gaps (requests deleted before retention reached them)
+                new = (ids & self._segment_ids(segment)) - set(segment["deleted"])
+                if not new:
+                    continue
+                found += len(new)
+                segment["deleted"].extend(sorted(new))
+                if len(segment["deleted"]) >= segment["count"]:
+                    self._drop_segment(segment)
+            if found:
+                self._write_manifest()
+            return found
+
+    def _drop_segment(self, segment):
+        """Removes a segment whose requests are all deleted, with its tombstones."""
+        self._manifest["segments"].remove(segment)
+        self._blooms.pop(segment["number"], None)
+        name = self._segment_name(segment["number"])
+        try:
+            os.remove(self._segment_path(segment["number"]))
+        except FileNotFoundError:
+            pass
+        if self.uploader:
+            self.uploader.delete(self.gcs_prefix + name)
+
+    def clear(self):
+        with self.exclusive():
+            if self.uploader:
+                for segment in self._manifest["segments"]:
+                    self.uploader.delete(self.gcs_prefix + self._segment_name(segment["number"]))
+            for name in os.listdir(self.directory):
+                if name != ".lock":
+                    path = os.path.join(self.directory, name)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            self._manifest = {"segments": [], "next_number": self._manifest["next_number"]}
+            self._blooms.clear()
+            self._write_manifest()
+
+    # -- reads -----------------------------------------------------------
+
+    @property
+    def count(self):
+        return sum(segment["count"] - len(segment["deleted"]) for segment in self._manifest["segments"])
+
+    def _segment_for(self, request_id):
+        for segment in self._manifest["segments"]:
+            if segment["count"] and segment["min_id"] <= request_id <= segment["max_id"]:
+                return segment
+        return None
+
+    def _read_segment(self, segment, deleted=None):
+        """Archived requests of one segment, oldest first, without the deleted ones."""
+        path = self._segment_path(segment["number"])
+        if not os.path.exists(path) and not self._download(self._segment_name(segment["number"]), path):
+            logger.error(f"Cold archive segment {segment['number']} is missing")
+            return []
+        if deleted is None:
+            deleted = set(segment.get("deleted", ()))
+        entries = []
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["id"] not in deleted:
+                        entries.append(entry)
+        except (EOFError, zlib.error, ValueError) as e:
+            # A torn last append (crash mid-write); everything before it is intact
+            logger.warning(f"Cold archive segment {segment['number']} ends early: {e}")
+        return entries
+
+    def _segment_ids(self, segment):
+        """IDs of every request written to a segment, deleted ones included."""
+        return {entry["id"] for entry in self._read_segment(segment, deleted=())}
+
+    def get(self, request_id):
+        segment = self._segment_for(request_id)
+        if segment is None:
+            return None
+        for entry in self._read_segment(segment):
+            if entry["id"] == request_id:
+                return entry
+        return None
+
+    def iter_entries(self, newest_first=True, after_id=None):
+        """Yields archived requests in ID order, resuming after after_id (exclusive)."""
+        segments = [s for s in self._manifest["segments"] if s["count"]]
+        if newest_first:
+            segments.reverse()
+        for segment in segments:
+            if after_id is not None:
+                if newest_first and segment["min_id"] >= after_id:
+                    continue
+                if not newest_first and segment["max_id"] <= after_id:
+                    continue
+            entries = self._read_segment(segment)
+            if newest_first:
+                entries.reverse()
+            yield from entries
+
+    def _may_hold_lote(self, segment, lote):
+        bloom = segment.get("lotes")
+        if bloom is None:
+            return True  # not migrated yet (read before another process's first write)
+        cached = self._blooms.get(segment["number"])
+        if cached is None or cached[0] is not bloom:
+            cached = self._blooms[segment["number"]] = (bloom, base64.b64decode(bloom))
+        data = cached[1]
+        return all(data[position >> 3] & (1 << (position & 7)) for position in bloom_positions(lote, len(data) * 8))
+
+    def find_lote(self, lote):
+        """The archived request carrying lote ID, or None. Only the segments whose lote
+        filter may hold it are read, newest first."""
+        for segment in reversed(self._manifest["segments"]):
+            if segment["count"] and self._may_hold_lote(segment, lote):
+                for entry in self._read_segment(segment):
+                    if entry.get("lote") == lote:
+                        return entry
+        return None
@@ -0,0 +1,105 @@
+"""Idempotent comunicacion submissions.
+
+PMS clients that time out retry the very same envelope. mock_ses() keys
+each submission by a SHA-256 of its cabecera fields and decoded solicitud
+ZIP, and a DedupCache remembers the response issued for every key for a
+while: a retry gets the original lote back without being unzipped, parsed
+or stored again. Deleting a request forgets the submission of its lote, so
+a retry after the delete is stored again. The cache is per process (each
+gunicorn worker has its own).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+CHUNK_SIZE = 64 * 1024
+
+
+def submission_key(header_info, zip_file):
+    """Hex SHA-256 over the header fields and the ZIP bytes; leaves zip_file at offset 0."""
+    digest = hashlib.sha256()
+    for name in sorted(header_info):
+        digest.update(f"{name}={header_info[name]}\0".encode("utf-8"))
+    zip_file.seek(0)
+    for chunk in iter(lambda: zip_file.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    zip_file.seek(0)
+    return digest.hexdigest()
+
+
+class DedupCache:
+    """LRU map of submission key -> response, entries expiring after ttl seconds.
+
+    claim() is the check and the insert in one step, so two copies of a
+    submission arriving together are processed once.
+    """
+
+    def __init__(self, max_entries=10000, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (expires, response, lote)
+        self._keys = {}                # lote -> key
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def claim(self, key, response, lote=None):
+        """Returns the response already issued for key (a hit), or records response
+        (issued for lote) and returns None (a miss: the caller processes the submission)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self._forget(key)
+            self._entries[key] = (now + self.ttl, response, lote)
+            if lote is not None:
+                self._keys[lote] = key
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return None
+
+    def release(self, key):
+        """Forgets a claimed key whose submission was not accepted after all (so a retry is processed)."""
+        with self._lock:
+            self._forget(key)
+
+    def forget_lotes(self, lotes):
+        """Forgets the submissions of deleted lotes (so a retry is stored again)."""
+        with self._lock:
+            for lote in lotes:
+                key = self._keys.get(lote)
+                if key is not None:
+                    self._forget(key)
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            self._keys.pop(entry[2], None)
+
+    def _evict(self, now):
+        entries = self._entries
+        while len(entries) > self.max_entries:
+            self._forget(next(iter(entries)))
+        # Oldest first by use; expired entries past the front go when they are looked up
+        while entries:
+            key, (expires, _, _) = next(iter(entries.items()))
+            if expires > now:
+                break
+            self._forget(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
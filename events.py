@@ -0,0 +1,71 @@
+"""Change feed behind the dashboard's /events stream (Server-Sent Events).
+
+Every change to the in-memory view is published once as a numbered event:
+"put" (the stored request), "del" (its ID) or "reset" (the view was cleared
+or reloaded, so watchers should fetch the list again). The last `history`
+events are kept so a reader can catch up from its position; each reader
+only keeps that position, so serving one costs the same however many
+requests are stored.
+
+The app's feed is read through /events/poll by front.py, which republishes
+it in a feed of its own and serves every /events stream from that one
+(see front.EventRelay).
+
+Event IDs are "<epoch>-<seq>", where epoch is unique per process: an ID
+from another process or from before a restart cannot be resumed and gets a
+"reset" instead, as does one older than the history.
+"""
+import itertools
+import threading
+import uuid
+from collections import deque
+
+
+class Event:
+    __slots__ = ("seq", "kind", "payload", "rendered")
+
+    def __init__(self, seq, kind, payload):
+        self.seq = seq
+        self.kind = kind
+        self.payload = payload
+        self.rendered = {}  # filter key -> SSE data line (or None if filtered out), shared by watchers
+
+
+class EventFeed:
+    def __init__(self, history=1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, kind, payload=None):
+        with self._lock:
+            self._seq += 1
+            self._events.append(Event(self._seq, kind, payload))
+
+    @property
+    def latest(self):
+        with self._lock:
+            return self._seq
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def parse_id(self, value):
+        """Returns the sequence number in an event ID from this process, or None."""
+        epoch, _, seq = (value or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def since(self, seq):
+        """Events after seq, or None if some of them are no longer in the
+        history (the reader must start over)."""
+        with self._lock:
+            if seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            if not self._events or self._events[0].seq > seq + 1:
+                return None
+            return list(itertools.islice(self._events, seq + 1 - self._events[0].seq, None))
@@ -0,0 +1,89 @@
+"""Streaming serialization of stored requests for /export.
+
+Every function here is a generator over its input, so an export holds one
+request (and one output chunk) at a time however many rows it produces:
+ndjson_lines/csv_lines turn requests into text lines, chunks batches the
+lines into response-sized strings and gzip_chunks compresses them.
+"""
+import csv
+import io
+import json
+import zlib
+
+from records import to_plain
+
+CHUNK_BYTES = 64 * 1024
+
+CSV_COLUMNS = (
+    "id", "lote", "timestamp", "arrendador", "tipo", "referencia",
+    "fechaReserva", "fechaEntrada", "fechaSalida", "tipoPago",
+    "nombre", "documento", "soporte", "nacimiento", "nacionalidad", "sexo", "direccion", "contacto",
+)
+PERSONA_COLUMNS = ("nombre", "documento", "soporte", "nacimiento", "nacionalidad", "sexo", "direccion", "contacto")
+
+
+def plain_record(req):
+    """The stored request as a plain dict, without the view's internal keys."""
+    return {key: to_plain(value) for key, value in req.items() if not key.startswith("_")}
+
+
+def ndjson_lines(matches):
+    """One JSON line per (req, tipo, contracts) match with the full stored record."""
+    for req, _, _ in matches:
+        yield json.dumps(plain_record(req), ensure_ascii=False) + "\n"
+
+
+def csv_lines(matches):
+    """A header line, then one line per persona of the matching contracts."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(CSV_COLUMNS)
+    for req, request_type, contracts in matches:
+        header = req.get("header") or {}
+        prefix = (req["id"], req.get("lote", ""), req.get("timestamp", ""), header.get("arrendador", ""), request_type)
+        for contract in contracts:
+            fechas = contract.get("fechas") or {}
+            stay = (contract.get("referencia", ""), fechas.get("Reserva", ""), fechas.get("Entrada", ""),
+                    fechas.get("Salida", ""), fechas.get("Pago", ""))
+            for persona in contract.get("personas", ()):
+                yield line(prefix + stay + tuple(persona.get(column, "") for column in PERSONA_COLUMNS))
+
+
+def chunks(lines, size=CHUNK_BYTES):
+    """Joins lines into strings of about size characters; the first line goes out on its own
+    so the client sees bytes as soon as the export starts."""
+    pending = []
+    pending_size = 0
+    first = True
+    for text in lines:
+        if first:
+            first = False
+            yield text
+            continue
+        pending.append(text)
+        pending_size += len(text)
+        if pending_size >= size:
+            yield "".join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending)
+
+
+def gzip_chunks(texts, level=6):
+    """Gzip stream of the UTF-8 encoded texts, sync-flushed after each one so every
+    chunk can be decompressed as soon as it arrives."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for text in texts:
+        data = compressor.compress(text.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
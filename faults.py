@@ -0,0 +1,228 @@
+"""Latency, throttling and fault-injection profiles for the comunicacion endpoint.
+
+A profile is a JSON object, every part optional:
+
+    {
+        "latency": {"dist": "fixed", "ms": 300},
+                   {"dist": "normal", "mean_ms": 300, "stddev_ms": 80},
+                   {"dist": "lognormal", "median_ms": 200, "sigma": 1.2},   # long tail
+                   (any of them with "max_ms", default 60000)
+        "rate_limit": {"rate": 5, "burst": 10,
+                       "status": 429, "codigo": 1, "descripcion": "..."},
+        "errors": [{"probability": 0.02, "codigo": 1, "descripcion": "...", "status": 500}],
+        "drip": {"bytes_per_second": 200, "chunk_bytes": 32}
+    }
+
+Profiles are set globally or per codigoArrendador (which then replaces the
+global one for that arrendador); each has its own token bucket. They live
+in the process, like the dedup cache: with several gunicorn workers, set
+them in every worker (or through FAULT_PROFILES at startup).
+
+Latency and drip are not waited out here: the response carries them in the
+HOLD_HEADER and DRIP_HEADER headers, and front.py holds and drips it on its
+event loop, so a held response keeps no gunicorn thread.
+"""
+import math
+import random
+import threading
+import time
+
+DISTRIBUTIONS = ("fixed", "normal", "lognormal")
+DEFAULT_MAX_MS = 60000
+
+THROTTLE_STATUS = 429
+THROTTLE_CODIGO = 1
+THROTTLE_DESCRIPCION = "Demasiadas peticiones, reintente mas tarde (Mock)"
+ERROR_CODIGO = 1
+ERROR_DESCRIPCION = "Error interno del servicio (Mock)"
+
+HOLD_HEADER = "X-Mock-Hold-Ms"  # milliseconds to hold the response
+DRIP_HEADER = "X-Mock-Drip"  # "<bytes_per_second> <chunk_bytes>"
+
+
+def number(config, key, default=None, minimum=0.0):
+    """A non-negative number from a profile section; raises ValueError."""
+    value = config.get(key, default)
+    if value is None:
+        raise ValueError(f"Missing {key}")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise ValueError(f"Invalid {key}: {value!r}")
+    return float(value)
+
+
+def section(config, key):
+    """An optional object inside a profile; raises ValueError if it is something else."""
+    value = config.get(key)
+    if value is not None and not isinstance(value, dict):
+        raise ValueError(f"{key} must be a JSON object")
+    return value
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst; take() is called under the registry lock."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Takes a token; returns 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else math.inf
+
+
+class FaultProfile:
+    """One validated profile; config is kept as given for the admin API."""
+
+    def __init__(self, config):
+        if not isinstance(config, dict):
+            raise ValueError("A profile must be a JSON object")
+        unknown = set(config) - {"latency", "rate_limit", "errors", "drip"}
+        if unknown:
+            raise ValueError(f"Unknown profile keys: {', '.join(sorted(unknown))}")
+        self.config = config
+
+        self.latency = section(config, "latency")
+        if self.latency is not None:
+            dist = self.latency.get("dist", "fixed")
+            if dist not in DISTRIBUTIONS:
+                raise ValueError(f"Invalid latency dist: {dist} (use {', '.join(DISTRIBUTIONS)})")
+            if dist == "fixed":
+                number(self.latency, "ms")
+            elif dist == "normal":
+                number(self.latency, "mean_ms")
+                number(self.latency, "stddev_ms", 0)
+            else:
+                number(self.latency, "median_ms", minimum=1)
+                number(self.latency, "sigma", 1.0)
+            number(self.latency, "max_ms", DEFAULT_MAX_MS)
+
+        self.bucket = None
+        self.throttle = (THROTTLE_STATUS, THROTTLE_CODIGO, THROTTLE_DESCRIPCION)
+        rate_limit = section(config, "rate_limit")
+        if rate_limit is not None:
+            rate = number(rate_limit, "rate")
+            self.bucket = TokenBucket(rate, number(rate_limit, "burst", max(1.0, rate), minimum=1))
+            self.throttle = (
+                int(number(rate_limit, "status", THROTTLE_STATUS, minimum=100)),
+                int(number(rate_limit, "codigo", THROTTLE_CODIGO)),
+                str(rate_limit.get("descripcion", THROTTLE_DESCRIPCION)),
+            )
+
+        self.errors = []
+        total = 0.0
+        errors = config.get("errors") or []
+        if not isinstance(errors, list) or not all(isinstance(error, dict) for error in errors):
+            raise ValueError("errors must be a list of JSON objects")
+        for error in errors:
+            probability = number(error, "probability")
+            total += probability
+            self.errors.append((
+                probability,
+                int(number(error, "status", 200, minimum=100)),
+                int(number(error, "codigo", ERROR_CODIGO)),
+                str(error.get("descripcion", ERROR_DESCRIPCION)),
+            ))
+        if total > 1:
+            raise ValueError("Error probabilities add up to more than 1")
+
+        self.drip = section(config, "drip")
+        if self.drip is not None:
+            number(self.drip, "bytes_per_second", minimum=1)
+            number(self.drip, "chunk_bytes", 64, minimum=1)
+
+    def sample_latency(self, rng=random):
+        """Seconds to hold the response."""
+        latency = self.latency
+        if latency is None:
+            return 0.0
+        dist = latency.get("dist", "fixed")
+        if dist == "fixed":
+            ms = latency["ms"]
+        elif dist == "normal":
+            ms = rng.gauss(latency["mean_ms"], latency.get("stddev_ms", 0))
+        else:
+            ms = rng.lognormvariate(math.log(latency["median_ms"]), latency.get("sigma", 1.0))
+        return max(0.0, min(ms, latency.get("max_ms", DEFAULT_MAX_MS))) / 1000
+
+    def draw_error(self, rng=random):
+        """(status, codigo, descripcion) of an injected error, or None."""
+        if not self.errors:
+            return None
+        roll = rng.random()
+        for probability, status, codigo, descripcion in self.errors:
+            if roll < probability:
+                return status, codigo, descripcion
+            roll -= probability
+        return None
+
+    def hold_headers(self, delay):
+        """Headers asking front.py to hold the response delay seconds and drip it as configured."""
+        headers = {HOLD_HEADER: str(round(delay * 1000))}
+        if self.drip is not None:
+            headers[DRIP_HEADER] = f"{self.drip['bytes_per_second']} {int(self.drip.get('chunk_bytes', 64))}"
+        return headers
+
+
+class FaultProfiles:
+    """The global profile and the per-arrendador ones."""
+
+    def __init__(self):
+        self._global = None
+        self._arrendadores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._global is not None or bool(self._arrendadores)
+
+    def set(self, config, arrendador=None):
+        """Validates and installs a profile (a fresh token bucket); raises ValueError."""
+        profile = FaultProfile(config)
+        with self._lock:
+            if arrendador is None:
+                self._global = profile
+            else:
+                self._arrendadores[arrendador] = profile
+        return profile
+
+    def remove(self, arrendador=None):
+        """Removes a profile; returns False if there was none."""
+        with self._lock:
+            if arrendador is None:
+                removed, self._global = self._global, None
+            else:
+                removed = self._arrendadores.pop(arrendador, None)
+        return removed is not None
+
+    def load(self, configs):
+        """Installs {"global": {...}, "arrendadores": {code: {...}}} (FAULT_PROFILES)."""
+        if configs.get("global") is not None:
+            self.set(configs["global"])
+        for arrendador, config in (configs.get("arrendadores") or {}).items():
+            self.set(config, arrendador)
+
+    def for_arrendador(self, arrendador):
+        with self._lock:
+            return self._arrendadores.get(arrendador) or self._global
+
+    def throttle_wait(self, profile):
+        """0 if the profile lets a request through now, else the seconds until it would."""
+        if profile.bucket is None:
+            return 0.0
+        with self._lock:
+            return profile.bucket.take()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "global": self._global.config if self._global else None,
+                "arrendadores": {code: profile.config for code, profile in self._arrendadores.items()},
+            }
@@ -0,0 +1,473 @@
+"""Asynchronous front for the gunicorn app: the part of the mock that waits.
+
+gunicorn's gthread workers keep a thread for every open request, so
+anything that mostly waits is done here instead, on one asyncio loop.
+This process listens on $PORT and proxies every request to gunicorn on
+FRONT_UPSTREAM. A held fault response (see faults.py) comes back from the
+app at once with HOLD_HEADER and DRIP_HEADER, and the front waits out the
+delay and drips the body, however many responses are held at a time.
+
+The dashboard's /events streams are served here too. One task polls the
+app's change feed (/events/poll) once a second while anyone watches, and
+every stream reads from the relay's copy (see EventRelay).
+
+    python front.py -- gunicorn --bind 127.0.0.1:8081 ... app:app
+
+starts gunicorn as a child and exits with it (the Dockerfile does this).
+Without a command, it proxies to a gunicorn started separately.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import urllib.parse
+
+import events
+import faults
+import query
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get("PORT", 8080))
+FRONT_UPSTREAM = os.environ.get("FRONT_UPSTREAM", "127.0.0.1:8081")
+UPSTREAM_HOST, _, UPSTREAM_PORT = FRONT_UPSTREAM.rpartition(":")
+# Idle time before a keep-alive client connection is closed
+KEEPALIVE_SECONDS = float(os.environ.get("FRONT_KEEPALIVE_SECONDS", 75))
+MAX_HEAD_BYTES = 64 * 1024
+COPY_CHUNK = 64 * 1024
+
+# Dashboard live updates (/events): changes kept for Last-Event-ID resume, how often the
+# app's feed is polled, stream length before the browser reconnects, and keep-alive interval
+EVENTS_HISTORY = int(os.environ.get("EVENTS_HISTORY", 1000))
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", 1.0))
+EVENTS_STREAM_SECONDS = float(os.environ.get("EVENTS_STREAM_SECONDS", 300))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", 15))
+
+# Connection-level headers, not passed on in either direction
+HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "te", "trailer", "upgrade", "expect"}
+REASONS = {400: "Bad Request", 431: "Request Header Fields Too Large", 502: "Bad Gateway"}
+
+
+def parse_head(head):
+    """(start line fields, [(name, value)]) of a request or response head; raises ValueError."""
+    lines = head.decode("latin-1").split("\r\n")
+    start = lines[0].split(" ", 2)
+    if len(start) < 2:
+        raise ValueError(f"Bad start line: {lines[0]!r}")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep or not name.strip():
+            raise ValueError(f"Bad header line: {line!r}")
+        headers.append((name.strip(), value.strip()))
+    return start, headers
+
+
+def header(headers, name):
+    """The value of a header (case-insensitive), or None."""
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def render_head(start_line, headers):
+    lines = [start_line] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def body_framing(headers):
+    """("chunked", None), ("length", n) or (None, None) for a body delimited by the connection closing."""
+    if "chunked" in (header(headers, "Transfer-Encoding") or "").lower():
+        return "chunked", None
+    length = header(headers, "Content-Length")
+    if length is not None:
+        if not length.isdigit():
+            raise ValueError(f"Bad Content-Length: {length!r}")
+        return "length", int(length)
+    return None, None
+
+
+async def copy_exact(reader, writer, size):
+    while size:
+        data = await reader.readexactly(min(size, COPY_CHUNK))
+        size -= len(data)
+        writer.write(data)
+        await writer.drain()
+
+
+async def copy_chunked(reader, writer):
+    """Relays a chunked body as is, framing included."""
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        writer.write(line)
+        size = int(line.split(b";", 1)[0], 16)
+        if size == 0:
+            # Trailers, up to the empty line
+            while line != b"\r\n":
+                line = await reader.readuntil(b"\r\n")
+                writer.write(line)
+            await writer.drain()
+            return
+        await copy_exact(reader, writer, size + 2)
+
+
+async def copy_to_eof(reader, writer):
+    while data := await reader.read(COPY_CHUNK):
+        writer.write(data)
+        await writer.drain()
+
+
+async def read_body(reader, headers):
+    """The whole (de-chunked) body of a response."""
+    framing, size = body_framing(headers)
+    if framing == "length":
+        return await reader.readexactly(size)
+    if framing is None:
+        return await reader.read()
+    parts = []
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+        if size == 0:
+            while await reader.readuntil(b"\r\n") != b"\r\n":
+                pass
+            return b"".join(parts)
+        parts.append((await reader.readexactly(size + 2))[:-2])
+
+
+async def send_error(writer, status, message):
+    body = message.encode("utf-8")
+    writer.write(render_head(f"HTTP/1.1 {status} {REASONS[status]}", [
+        ("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body))), ("Connection", "close")]))
+    writer.write(body)
+    await writer.drain()
+
+
+async def send_held(writer, status_line, headers, body, keep_alive):
+    """Sends a response after the hold its headers ask for, dripping the body if they say so."""
+    hold_ms = header(headers, faults.HOLD_HEADER)
+    drip = header(headers, faults.DRIP_HEADER)
+    skip = HOP_HEADERS | {"transfer-encoding", "content-length", faults.HOLD_HEADER.lower(), faults.DRIP_HEADER.lower()}
+    headers = [(name, value) for name, value in headers if name.lower() not in skip]
+    headers.append(("Content-Length", str(len(body))))
+    if not keep_alive:
+        headers.append(("Connection", "close"))
+
+    # Nothing (headers included) reaches the client before the delay is over
+    if hold_ms:
+        await asyncio.sleep(int(hold_ms) / 1000)
+    writer.write(render_head(status_line, headers))
+    if drip is None:
+        writer.write(body)
+        await writer.drain()
+        return
+    bytes_per_second, chunk = drip.split()
+    chunk = int(chunk)
+    pause = chunk / float(bytes_per_second)
+    for start in range(0, len(body), chunk):
+        if start:
+            await writer.drain()
+            await asyncio.sleep(pause)
+        writer.write(body[start:start + chunk])
+    await writer.drain()
+
+
+async def proxy(request_line, headers, client_reader, client_writer, keep_alive):
+    """Relays one request to gunicorn (on a connection of its own) and the response back.
+
+    Returns whether the client connection can take another request.
+    """
+    method, target, version = request_line
+    try:
+        up_reader, up_writer = await asyncio.open_connection(UPSTREAM_HOST, int(UPSTREAM_PORT), limit=MAX_HEAD_BYTES)
+    except OSError as e:
+        logger.warning(f"Upstream {FRONT_UPSTREAM} unavailable: {e}")
+        await send_error(client_writer, 502, "Upstream unavailable")
+        return False
+    try:
+        if (header(headers, "Expect") or "").lower() == "100-continue":
+            client_writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        framing, size = body_framing(headers)
+        forwarded = [(name, value) for name, value in headers if name.lower() not in HOP_HEADERS]
+        up_writer.write(render_head(f"{method} {target} {version}", forwarded + [("Connection", "close")]))
+        try:
+            if framing == "chunked":
+                await copy_chunked(client_reader, up_writer)
+            elif framing == "length":
+                await copy_exact(client_reader, up_writer, size)
+            else:
+                await up_writer.drain()
+        except ConnectionError:
+            # gunicorn answered (e.g. 413) without reading the whole body; the rest is never read
+            keep_alive = False
+
+        try:
+            start, response_headers = parse_head(await up_reader.readuntil(b"\r\n\r\n"))
+            status = int(start[1])
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError) as e:
+            logger.warning(f"No response from upstream for {method} {target}: {e!r}")
+            await send_error(client_writer, 502, "Bad response from upstream")
+            return False
+        status_line = " ".join(start)
+        has_body = method != "HEAD" and status >= 200 and status not in (204, 304)
+
+        if has_body and header(response_headers, faults.HOLD_HEADER) is not None:
+            body = await read_body(up_reader, response_headers)
+            up_writer.close()
+            await send_held(client_writer, status_line, response_headers, body, keep_alive)
+            return keep_alive
+
+        framing, size = body_framing(response_headers) if has_body else ("length", 0)
+        if framing is None:
+            keep_alive = False
+        relayed = [(name, value) for name, value in response_headers if name.lower() not in HOP_HEADERS]
+        if not keep_alive:
+            relayed.append(("Connection", "close"))
+        client_writer.write(render_head(status_line, relayed))
+        if framing == "chunked":
+            await copy_chunked(up_reader, client_writer)
+        elif framing == "length":
+            await copy_exact(up_reader, client_writer, size)
+        else:
+            await copy_to_eof(up_reader, client_writer)
+        return keep_alive
+    finally:
+        up_writer.close()
+
+
+def render_event(event, flt):
+    """The data line of an event for streams using flt, or None if it does not concern them.
+
+    A put carries the request as /api/requests would list it with the same
+    filter; the result is cached on the event for every stream with that filter.
+    """
+    key = (flt.tab, flt.q, tuple(sorted(flt.dates.items())), flt.arrendador)
+    if key in event.rendered:
+        return event.rendered[key]
+    data = "{}"
+    if event.kind == "put":
+        request_type, contracts = flt.matching_contracts(event.payload)
+        data = json.dumps(query.project(event.payload, request_type, contracts, query.DEFAULT_FIELDS)) if contracts else None
+    elif event.kind == "del":
+        data = json.dumps({"id": event.payload})
+    event.rendered[key] = data
+    return data
+
+
+class EventRelay:
+    """The app's change feed, polled by one task while anyone watches and fanned out to every stream.
+
+    The events are renumbered in a feed of the relay's own: a poll may reach
+    another gunicorn worker or a restarted app, whose IDs do not follow on from
+    the last ones, and the relay publishes a "reset" then.
+    """
+
+    def __init__(self, history):
+        self.feed = events.EventFeed(history)
+        self.watchers = 0
+        self._changed = asyncio.Event()  # set (and replaced) when events are published
+        self._watched = asyncio.Event()
+        self._after = ""  # the app's event ID the next poll continues from
+        self._upstream = None
+
+    async def run(self):
+        while True:
+            if not self.watchers:
+                self._disconnect()
+                self._watched.clear()
+                await self._watched.wait()
+            try:
+                reply = await self._poll()
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                logger.warning(f"Event poll failed: {e!r}")
+                self._disconnect()
+                await asyncio.sleep(EVENTS_POLL_SECONDS)
+                continue
+            published = bool(reply["events"])
+            if reply["reset"] and self._after:
+                self.feed.publish("reset")
+                published = True
+            for event in reply["events"]:
+                self.feed.publish(event["kind"], event["data"])
+            self._after = reply["after"]
+            if published:
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+            if not reply["more"]:
+                await asyncio.sleep(EVENTS_POLL_SECONDS)
+
+    async def _poll(self):
+        """GETs /events/poll on a kept-alive connection, so it keeps reaching the same worker."""
+        if self._upstream is None:
+            self._upstream = await asyncio.open_connection(UPSTREAM_HOST, int(UPSTREAM_PORT), limit=MAX_HEAD_BYTES)
+        reader, writer = self._upstream
+        target = "/events/poll?" + urllib.parse.urlencode({"after": self._after})
+        writer.write(render_head(f"GET {target} HTTP/1.1", [("Host", FRONT_UPSTREAM)]))
+        start, headers = parse_head(await reader.readuntil(b"\r\n\r\n"))
+        body = await read_body(reader, headers)
+        if "close" in (header(headers, "Connection") or "").lower():
+            self._disconnect()
+        if start[1] != "200":
+            raise ValueError(f"/events/poll answered {' '.join(start)}")
+        return json.loads(body)
+
+    def _disconnect(self):
+        if self._upstream is not None:
+            self._upstream[1].close()
+            self._upstream = None
+
+    async def messages(self, flt, last_event_id):
+        """Yields SSE messages: the changes after last_event_id (or from now on), keep-alive
+        comments while idle, and ends after EVENTS_STREAM_SECONDS so the browser reconnects."""
+        self.watchers += 1
+        self._watched.set()
+        try:
+            yield "retry: 3000\n\n"
+            seq = self.feed.latest
+            if last_event_id:
+                resumed = self.feed.parse_id(last_event_id)
+                if resumed is None or resumed > seq:
+                    yield f"id: {self.feed.event_id(seq)}\nevent: reset\ndata: {{}}\n\n"
+                else:
+                    seq = resumed
+
+            deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+            next_heartbeat = time.monotonic() + EVENTS_HEARTBEAT_SECONDS
+            while (now := time.monotonic()) < deadline:
+                changed = self._changed
+                pending = self.feed.since(seq)
+                if pending is None:
+                    # Fell out of the history: the watcher has to fetch the list again
+                    seq = self.feed.latest
+                    yield f"id: {self.feed.event_id(seq)}\nevent: reset\ndata: {{}}\n\n"
+                    continue
+                if not pending:
+                    if now >= next_heartbeat:
+                        next_heartbeat = now + EVENTS_HEARTBEAT_SECONDS
+                        yield ": keep-alive\n\n"
+                        continue
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(changed.wait(), min(deadline, next_heartbeat) - now)
+                    continue
+                for event in pending:
+                    seq = event.seq
+                    data = render_event(event, flt)
+                    if data is not None:
+                        yield f"id: {self.feed.event_id(seq)}\nevent: {event.kind}\ndata: {data}\n\n"
+        finally:
+            self.watchers -= 1
+
+
+event_relay = EventRelay(EVENTS_HISTORY)
+
+
+async def serve_events(target, headers, writer, keep_alive):
+    """/events: Server-Sent Events with the requests added to and deleted from the dashboard.
+
+    Takes the /api/requests filter parameters (tab, q, fecha*, arrendador) and resumes
+    after the Last-Event-ID header (or lastEventId parameter) when given.
+    """
+    args = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(target).query))
+    flt = query.RequestFilter.from_args(args)
+    last_event_id = header(headers, "Last-Event-ID") or args.get("lastEventId")
+    response_headers = [("Content-Type", "text/event-stream; charset=utf-8"), ("Cache-Control", "no-cache"),
+                        ("X-Accel-Buffering", "no"), ("Transfer-Encoding", "chunked")]
+    if not keep_alive:
+        response_headers.append(("Connection", "close"))
+    writer.write(render_head("HTTP/1.1 200 OK", response_headers))
+    async with contextlib.aclosing(event_relay.messages(flt, last_event_id)) as messages:
+        async for message in messages:
+            data = message.encode("utf-8")
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    return keep_alive
+
+
+async def handle_client(reader, writer):
+    """Serves the requests of one client connection, one at a time."""
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                return
+            except asyncio.LimitOverrunError:
+                await send_error(writer, 431, "Request head too large")
+                return
+            try:
+                request_line, headers = parse_head(head)
+                if len(request_line) != 3 or not request_line[2].startswith("HTTP/1."):
+                    raise ValueError(f"Bad request line: {' '.join(request_line)!r}")
+                body_framing(headers)
+            except ValueError as e:
+                await send_error(writer, 400, str(e))
+                return
+            connection = (header(headers, "Connection") or "").lower()
+            if request_line[2] == "HTTP/1.0":
+                keep_alive = "keep-alive" in connection
+            else:
+                keep_alive = "close" not in connection
+            if request_line[0] == "GET" and urllib.parse.urlsplit(request_line[1]).path == "/events":
+                # A body on the GET is never read, so the connection cannot be reused
+                keep_alive = keep_alive and body_framing(headers) == (None, None)
+                if not await serve_events(request_line[1], headers, writer, keep_alive):
+                    return
+            elif not await proxy(request_line, headers, reader, writer, keep_alive):
+                return
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def wait_for_upstream(child):
+    """Waits until gunicorn accepts connections (or has exited)."""
+    while child.returncode is None:
+        try:
+            _, writer = await asyncio.open_connection(UPSTREAM_HOST, int(UPSTREAM_PORT))
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+
+
+async def serve(command):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    child = None
+    if command:
+        child = await asyncio.create_subprocess_exec(*command)
+        await wait_for_upstream(child)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        # gunicorn shuts down gracefully on SIGTERM; the front stops once it has exited
+        loop.add_signal_handler(signum, child.send_signal if child else lambda signum: stop.set(), signum)
+
+    relay = asyncio.create_task(event_relay.run())
+    server = await asyncio.start_server(handle_client, port=PORT, limit=MAX_HEAD_BYTES)
+    logger.info(f"Front listening on :{PORT}, upstream {FRONT_UPSTREAM}")
+    waits = [asyncio.create_task(stop.wait())]
+    if child:
+        waits.append(asyncio.create_task(child.wait()))
+    await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+    server.close()
+    relay.cancel()
+    if child and child.returncode is None:
+        child.send_signal(signal.SIGTERM)
+        await child.wait()
+    return child.returncode if child else 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    sys.exit(asyncio.run(serve(argv[1:] if argv[:1] == ["--"] else argv)))
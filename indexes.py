@@ -0,0 +1,275 @@
+"""Incrementally maintained secondary indexes over stored requests.
+
+Postings point at requests (by ID) or at individual contracts, keyed as
+(request_id, contract_index). All methods expect the caller to serialize
+access (app.py holds the lock of each view shard around its mutations and lookups).
+"""
+from bisect import bisect_left, bisect_right, insort
+
+from query import normalize_date, request_type_and_contracts
+
+NGRAM = 3
+DATE_FIELDS = ("Reserva", "Entrada", "Salida")
+
+
+def ngrams(text):
+    """Returns the set of character trigrams of an already lowercased string."""
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def document_number(documento):
+    """Extracts the number from a persona documento ("NIF: 12345678Z" -> "12345678z")."""
+    if not documento:
+        return ""
+    return documento.rpartition(":")[2].strip().lower()
+
+
+class SortedKeyIndex:
+    """Maps a sortable value to postings, with range queries over the distinct values."""
+
+    def __init__(self):
+        self.postings = {}
+        self.keys = []
+
+    def add(self, value, posting):
+        bucket = self.postings.get(value)
+        if bucket is None:
+            bucket = self.postings[value] = set()
+            insort(self.keys, value)
+        bucket.add(posting)
+
+    def remove(self, value, posting):
+        bucket = self.postings.get(value)
+        if bucket is None:
+            return
+        bucket.discard(posting)
+        if not bucket:
+            del self.postings[value]
+            del self.keys[bisect_left(self.keys, value)]
+
+    def range(self, start=None, end=None):
+        """Postings whose value is within [start, end] (either bound optional)."""
+        lo = bisect_left(self.keys, start) if start else 0
+        hi = bisect_right(self.keys, end) if end else len(self.keys)
+        result = set()
+        for value in self.keys[lo:hi]:
+            result |= self.postings[value]
+        return result
+
+    def get(self, value):
+        return self.postings.get(value, set())
+
+    def clear(self):
+        self.postings.clear()
+        self.keys.clear()
+
+
+class RequestIndex:
+    """Indexes over personas, documents, contract dates, arrendador and referencia."""
+
+    def __init__(self):
+        self.by_id = {}
+        self.text = {}          # trigram -> {request_id}
+        self.documents = {}     # document number -> {(request_id, contract_index)}
+        self.dates = {field: SortedKeyIndex() for field in DATE_FIELDS}
+        self.arrendador = {}    # codigoArrendador -> {request_id}
+        self.referencia = {}    # contract referencia -> {(request_id, contract_index)}
+        self.lotes = {}         # lote ID -> request_id
+
+    def __len__(self):
+        return len(self.by_id)
+
+    @staticmethod
+    def _add_posting(index, key, posting):
+        index.setdefault(key, set()).add(posting)
+
+    @staticmethod
+    def _remove_posting(index, key, posting):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(posting)
+            if not bucket:
+                del index[key]
+
+    def _entries(self, req):
+        """Yields (kind, key, posting) for every index entry of a request."""
+        rid = req["id"]
+        header = req.get("header") or {}
+        yield "arrendador", header.get("arrendador"), rid
+        _, contracts = request_type_and_contracts(req)
+        grams = set()
+        for ci, contract in enumerate(contracts):
+            key = (rid, ci)
+            yield "referencia", contract.get("referencia"), key
+            fechas = contract.get("fechas") or {}
+            for field in DATE_FIELDS:
+                value = normalize_date(fechas.get(field))
+                if value:
+                    yield field, value, key
+            for persona in contract.get("personas", []):
+                grams |= ngrams((persona.get("nombre") or "").lower())
+                grams |= ngrams((persona.get("documento") or "").lower())
+                number = document_number(persona.get("documento"))
+                if number and number != "n/a":
+                    yield "documento", number, key
+        for gram in grams:
+            yield "text", gram, rid
+
+    def _target(self, kind):
+        return {
+            "arrendador": self.arrendador,
+            "referencia": self.referencia,
+            "documento": self.documents,
+            "text": self.text,
+        }.get(kind)
+
+    def add(self, req):
+        self.by_id[req["id"]] = req
+        if req.get("lote"):
+            self.lotes[req["lote"]] = req["id"]
+        for kind, key, posting in self._entries(req):
+            if kind in self.dates:
+                self.dates[kind].add(key, posting)
+            else:
+                self._add_posting(self._target(kind), key, posting)
+
+    def remove(self, request_id):
+        req = self.by_id.pop(request_id, None)
+        if req is None:
+            return None
+        if self.lotes.get(req.get("lote")) == request_id:
+            del self.lotes[req["lote"]]
+        for kind, key, posting in self._entries(req):
+            if kind in self.dates:
+                self.dates[kind].remove(key, posting)
+            else:
+                self._remove_posting(self._target(kind), key, posting)
+        return req
+
+    def replace(self, req):
+        """Swaps in another object for an indexed request with the same indexed fields
+        (a full record for its summary); postings stay as they are."""
+        if req["id"] in self.by_id:
+            self.by_id[req["id"]] = req
+
+    def rebuild(self, requests):
+        self.clear()
+        for req in requests:
+            self.add(req)
+
+    def clear(self):
+        self.by_id.clear()
+        self.text.clear()
+        self.documents.clear()
+        self.arrendador.clear()
+        self.referencia.clear()
+        self.lotes.clear()
+        for index in self.dates.values():
+            index.clear()
+
+    # -- lookups ---------------------------------------------------------
+
+    def get(self, request_id):
+        return self.by_id.get(request_id)
+
+    def get_by_lote(self, lote):
+        return self.by_id.get(self.lotes.get(lote))
+
+    def search_text(self, q):
+        """Request IDs that may contain q in a persona name or document.
+
+        Returns None when q is too short to use the trigram index; callers
+        must still verify candidates (trigrams can match out of order).
+        """
+        q = q.lower()
+        if len(q) < NGRAM:
+            return None
+        result = None
+        for gram in sorted(ngrams(q), key=lambda g: len(self.text.get(g, ()))):
+            postings = self.text.get(gram)
+            if not postings:
+                return set()
+            result = set(postings) if result is None else result & postings
+            if not result:
+                break
+        return result
+
+    def contracts_by_date(self, field, start=None, end=None):
+        """(request_id, contract_index) postings with fechas[field] within [start, end]."""
+        return self.dates[field].range(normalize_date(start), normalize_date(end))
+
+    def contracts_by_document(self, documento):
+        return set(self.documents.get(document_number(documento), ()))
+
+    def contracts_by_referencia(self, referencia):
+        return set(self.referencia.get(referencia, ()))
+
+    def requests_by_arrendador(self, arrendador):
+        return set(self.arrendador.get(arrendador, ()))
+
+    def candidate_ids(self, flt):
+        """Request IDs that can match a query.RequestFilter, or None if no index applies."""
+        candidates = None
+        if flt.q:
+            candidates = self.search_text(flt.q)
+        for field, value in flt.dates.items():
+            ids = {rid for rid, _ in self.dates[field].get(value)}
+            candidates = ids if candidates is None else candidates & ids
+        return candidates
+
+    def select(self, selection):
+        """IDs of the requests matching a query.SelectionFilter.
+
+        The indexes narrow the candidates (a full pass over the IDs only when
+        no indexed criterion is given) and each candidate is then checked.
+        """
+        candidates = None
+
+        def narrow(current, found):
+            return found if current is None else current & found
+
+        if selection.ids is not None:
+            candidates = {rid for rid in selection.ids if rid in self.by_id}
+        if selection.arrendador:
+            candidates = narrow(candidates, self.requests_by_arrendador(selection.arrendador))
+        if selection.referencia:
+            candidates = narrow(candidates, {rid for rid, _ in self.contracts_by_referencia(selection.referencia)})
+        if selection.start or selection.end:
+            found = self.contracts_by_date(selection.field, selection.start, selection.end)
+            candidates = narrow(candidates, {rid for rid, _ in found})
+        if candidates is None:
+            candidates = self.by_id.keys()
+        return {rid for rid in candidates if selection.matches(self.by_id[rid])}
+
+    def _date_in_range(self, key, field, start, end):
+        rid, ci = key
+        _, contracts = request_type_and_contracts(self.by_id[rid])
+        value = normalize_date((contracts[ci].get("fechas") or {}).get(field))
+        return bool(value) and (not start or value >= start) and (not end or value <= end)
+
+    def stays(self, documento=None, arrendador=None, referencia=None, field="Entrada", start=None, end=None):
+        """Contracts matching every given criterion, as (request, contract_index) pairs, newest first."""
+        keys = None
+
+        def narrow(current, found):
+            return found if current is None else current & found
+
+        if documento:
+            keys = narrow(keys, self.contracts_by_document(documento))
+        if referencia:
+            keys = narrow(keys, self.contracts_by_referencia(referencia))
+        if start or end:
+            if keys is None:
+                keys = self.contracts_by_date(field, start, end)
+            else:
+                # Checking a handful of candidates beats materializing the whole range
+                keys = {key for key in keys if self._date_in_range(key, field, normalize_date(start), normalize_date(end))}
+        if arrendador:
+            rids = self.requests_by_arrendador(arrendador)
+            if keys is None:
+                keys = {(rid, ci) for rid in rids for ci in range(len(request_type_and_contracts(self.by_id[rid])[1]))}
+            else:
+                keys = {key for key in keys if key[0] in rids}
+        if keys is None:
+            return []
+        return [(self.by_id[rid], ci) for rid, ci in sorted(keys, reverse=True)]
@@ -0,0 +1,228 @@
+"""Streaming reads of SOAP comunicacion envelopes and their solicitud ZIP.
+
+The envelope is parsed incrementally, the base64 solicitud is decoded in
+chunks into a spooled temporary file and each XML member is read from the
+ZIP a chunk at a time, with the size and ratio limits checked on the bytes
+actually read. Memory stays bounded only up to that point: the XML member
+itself is then held whole, both as a str (the document the blob store
+keeps) and as the lxml tree parse_ses_xml() works on, so a lote still
+costs several times the size of its inner XML.
+"""
+import base64
+import codecs
+import re
+import tempfile
+import zipfile
+
+from lxml import etree
+
+CHUNK_SIZE = 64 * 1024
+
+HEADER_FIELDS = ("codigoArrendador", "aplicacion", "tipoOperacion", "tipoComunicacion")
+
+# b64decode() without validate silently drops anything outside the alphabet;
+# we do the same up front so chunk boundaries stay aligned to 4 characters.
+NON_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+
+
+class IngestError(Exception):
+    """A submission rejected before it reaches the parser (bad envelope or over a limit)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class IngestLimits:
+    """Size limits enforced while a submission is being streamed in."""
+
+    def __init__(self, max_body_bytes, max_uncompressed_bytes, max_compression_ratio, spool_max_bytes=1024 * 1024):
+        self.max_body_bytes = max_body_bytes
+        self.max_uncompressed_bytes = max_uncompressed_bytes
+        self.max_compression_ratio = max_compression_ratio
+        self.spool_max_bytes = spool_max_bytes
+
+
+class Base64Decoder:
+    """Decodes base64 text fed in arbitrary pieces and writes the bytes to sink."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pending = b""
+
+    def feed(self, text):
+        data = self.pending + NON_BASE64.sub(b"", text.encode("ascii", "ignore"))
+        cut = len(data) - len(data) % 4
+        self.pending = data[cut:]
+        if cut:
+            self.sink.write(base64.b64decode(data[:cut]))
+
+    def close(self):
+        if self.pending:
+            self.sink.write(base64.b64decode(self.pending))
+            self.pending = b""
+
+
+class SoapEnvelopeTarget:
+    """lxml parser target that reads a SES SOAP envelope without building a tree.
+
+    Mirrors find_local_node()/get_local_text() on the envelope: the first
+    cabecera below the root provides the header fields, and the text of the
+    first solicitud below the root is base64-decoded straight into sink.
+    """
+
+    def __init__(self, sink):
+        self.decoder = Base64Decoder(sink)
+        self.header = {}
+        self.has_solicitud = False
+        self._depth = 0
+        self._cabecera_depth = None
+        self._cabecera_done = False
+        self._capture = None
+
+    def start(self, tag, attrib):
+        # Only text before the first child counts as an element's .text
+        self._capture = None
+        self._depth += 1
+        if self._depth == 1:
+            return
+        name = tag.rpartition("}")[2]
+        if self._cabecera_depth is not None:
+            if name in HEADER_FIELDS and name not in self.header:
+                self.header[name] = []
+                self._capture = self.header[name].append
+        elif name == "cabecera" and not self._cabecera_done:
+            self._cabecera_depth = self._depth
+        if name == "solicitud" and not self.has_solicitud:
+            self.has_solicitud = True
+            self._capture = self.decoder.feed
+
+    def data(self, data):
+        if self._capture is not None:
+            self._capture(data)
+
+    def end(self, tag):
+        self._capture = None
+        if self._cabecera_depth == self._depth:
+            self._cabecera_depth = None
+            self._cabecera_done = True
+        self._depth -= 1
+
+    def close(self):
+        self.decoder.close()
+        return {name: "".join(self.header.get(name, [])) or "N/A" for name in HEADER_FIELDS}
+
+
+def read_envelope(stream, limits):
+    """Streams a SOAP request body.
+
+    Returns (header_fields, zip_file) where zip_file is a spooled temporary
+    file holding the decoded solicitud payload, positioned at 0.
+    """
+    zip_file = tempfile.SpooledTemporaryFile(max_size=limits.spool_max_bytes)
+    target = SoapEnvelopeTarget(zip_file)
+    # huge_tree lifts libxml2's 10MB text-node cap; the body limit bounds it instead.
+    parser = etree.XMLParser(target=target, recover=True, huge_tree=True)
+    total = 0
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > limits.max_body_bytes:
+                raise IngestError(f"Request body exceeds {limits.max_body_bytes} bytes", 413)
+            parser.feed(chunk)
+        header = parser.close()
+    except Exception:
+        zip_file.close()
+        raise
+
+    if not target.has_solicitud:
+        zip_file.close()
+        raise IngestError("Missing solicitud node", 400)
+
+    zip_file.seek(0)
+    return header, zip_file
+
+
+def _stream_member(archive, info, max_bytes, limits, parser=None):
+    """Reads one ZIP member in chunks, counting what actually comes out (declared sizes can lie).
+
+    Chunks are also fed to parser when given. Returns (text, parse_ok, size in bytes).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parse_ok = parser is not None
+    pieces = []
+    total = 0
+    with archive.open(info) as member:
+        while True:
+            chunk = member.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise IngestError(
+                    f"XML member exceeds the uncompressed size or compression ratio limit "
+                    f"({limits.max_uncompressed_bytes} bytes, {limits.max_compression_ratio}:1)", 413)
+            pieces.append(decoder.decode(chunk))
+            if parse_ok:
+                try:
+                    parser.feed(chunk)
+                except etree.XMLSyntaxError:
+                    parse_ok = False
+    pieces.append(decoder.decode(b"", final=True))
+    return "".join(pieces), parse_ok, total
+
+
+def _member_budget(info, limits, remaining):
+    if info.file_size > remaining:
+        raise IngestError(f"XML member exceeds {limits.max_uncompressed_bytes} bytes uncompressed", 413)
+    return min(remaining, max(info.compress_size, 1) * limits.max_compression_ratio)
+
+
+def read_xml_member(zip_file, limits):
+    """Streams the first .xml member of the ZIP into an incremental parser.
+
+    The member is read in chunks, but the whole text and the whole tree are
+    in memory when this returns. Returns (xml_content, root). root is None when the member could not be
+    parsed, so the caller can fall back to the regular error path.
+    """
+    with zipfile.ZipFile(zip_file, "r") as archive:
+        for info in archive.infolist():
+            if info.filename.endswith(".xml"):
+                break
+        else:
+            return "", None
+
+        max_bytes = _member_budget(info, limits, limits.max_uncompressed_bytes)
+        parser = etree.XMLParser(recover=True, remove_blank_text=True)
+        xml_content, parse_ok, _ = _stream_member(archive, info, max_bytes, limits, parser)
+
+    root = None
+    if parse_ok:
+        try:
+            root = parser.close()
+        except etree.XMLSyntaxError:
+            root = None
+    return xml_content, root
+
+
+def read_xml_members(zip_file, limits, max_members):
+    """Reads every .xml member of the ZIP (a batch of lotes) as text, in archive order.
+
+    The uncompressed size limit applies to all members together and the
+    compression ratio limit to each one.
+    """
+    members = []
+    remaining = limits.max_uncompressed_bytes
+    with zipfile.ZipFile(zip_file, "r") as archive:
+        for info in archive.infolist():
+            if not info.filename.endswith(".xml"):
+                continue
+            if len(members) == max_members:
+                raise IngestError(f"Batch exceeds {max_members} lotes", 413)
+            xml_content, _, size = _stream_member(archive, info, _member_budget(info, limits, remaining), limits)
+            remaining -= size
+            members.append(xml_content)
+    return members
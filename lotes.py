@@ -0,0 +1,127 @@
+"""Asynchronous processing of accepted lotes.
+
+mock_ses() acknowledges a submission as soon as the envelope is valid and
+hands the rest (unzip, parse, persist) to a LoteQueue: a bounded queue
+drained by a few worker threads. When the queue is full, submit() raises
+queue.Full so the caller can push back on the client instead of piling up
+work. The queue remembers the state of recent lotes for the consultaLote
+endpoint.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PENDING = "PENDIENTE"
+PROCESSED = "PROCESADO"
+ERROR = "ERROR"
+UNKNOWN = "DESCONOCIDO"
+
+
+def new_lote_id():
+    """A lote ID that stays the same for the life of the request (unlike a position in the list)."""
+    return f"MOCK-{uuid.uuid4().hex}"
+
+
+class LoteQueue:
+    """Bounded work queue with worker threads and a per-lote status table.
+
+    process(*args) does the work for one lote and returns the stored
+    request ID. Statuses of finished lotes are kept up to max_statuses,
+    oldest evicted first.
+    """
+
+    def __init__(self, process, workers=2, maxsize=1000, max_statuses=100000):
+        self.process = process
+        self.workers = workers
+        self.max_statuses = max_statuses
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._statuses = OrderedDict()  # lote -> {"estado", "id", "error", "recibido"}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+
+        self.processed = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def submit(self, lote, *args):
+        """Queues a lote; raises queue.Full when the backlog is at its limit."""
+        self._ensure_workers()
+        self._set(lote, {"estado": PENDING, "id": None, "error": None, "recibido": time.time()})
+        try:
+            self._queue.put_nowait((lote, args))
+        except queue.Full:
+            with self._lock:
+                self._statuses.pop(lote, None)
+                self.rejected += 1
+            raise
+
+    def record(self, lote, request_id):
+        """Records a lote that was processed synchronously."""
+        self._set(lote, {"estado": PROCESSED, "id": request_id, "error": None, "recibido": time.time()})
+
+    def _set(self, lote, status):
+        with self._lock:
+            self._statuses[lote] = status
+            self._statuses.move_to_end(lote)
+            while len(self._statuses) > self.max_statuses:
+                self._statuses.popitem(last=False)
+
+    def _update(self, lote, **changes):
+        with self._lock:
+            status = self._statuses.get(lote)
+            if status is not None:
+                status.update(changes)
+
+    def status(self, lote):
+        with self._lock:
+            status = self._statuses.get(lote)
+            return dict(status) if status is not None else None
+
+    def _ensure_workers(self):
+        with self._threads_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"lote-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            lote, args = self._queue.get()
+            try:
+                request_id = self.process(*args)
+            except Exception as e:
+                logger.exception(f"Error processing lote {lote}")
+                self.errors += 1
+                self._update(lote, estado=ERROR, error=str(e))
+            else:
+                self.processed += 1
+                self._update(lote, estado=PROCESSED, id=request_id)
+            finally:
+                self._queue.task_done()
+
+    def drain(self, timeout=30.0):
+        """Waits until every queued lote was processed. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Drain timed out with {self._queue.unfinished_tasks} lotes unprocessed")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "processed": self.processed,
+            "errors": self.errors,
+            "rejected": self.rejected,
+        }
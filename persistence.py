@@ -0,0 +1,260 @@
+"""Write-behind object storage uploads.
+
+Backends hand mutations to a WriteBehindUploader instead of talking to GCS
+inside the request handler. The uploader coalesces them per object name and
+pushes them from a background thread once per interval (or sooner when too
+many objects are dirty), so a burst of ingests costs one upload per object.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindUploader:
+    """Coalesces uploads/deletes per object name and applies them in the background."""
+
+    def __init__(self, bucket_getter, interval=5.0, max_dirty=100, sync=False):
+        self.bucket_getter = bucket_getter
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.sync = sync
+
+        self._pending = OrderedDict()   # object name -> (op, source, content_type)
+        self._dirty_since = None        # monotonic time of the oldest pending change
+        self._in_flight = 0
+        self._in_flight_since = None
+        self._flush_requested = False
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.uploads = 0
+        self.deletes = 0
+        self.errors = 0
+        self.last_success = None        # wall clock time of the last completed batch
+
+    # -- producers -------------------------------------------------------
+
+    def upload_file(self, name, path, content_type=None):
+        """Uploads the file at path under name; the file is read when the upload runs."""
+        self._mark(name, ("file", path, content_type))
+
+    def upload_string(self, name, producer, content_type=None):
+        """Uploads producer() under name; called at upload time, so only the latest state is sent."""
+        self._mark(name, ("string", producer, content_type))
+
+    def delete(self, name):
+        self._mark(name, ("delete", None, None))
+
+    def _mark(self, name, op):
+        if self.bucket_getter() is None:
+            return
+        if self.sync:
+            self._apply_batch(OrderedDict([(name, op)]))
+            return
+        with self._cond:
+            self._pending[name] = op
+            self._pending.move_to_end(name)
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._ensure_thread()
+            if len(self._pending) >= self.max_dirty:
+                self._cond.notify_all()
+
+    # -- worker ----------------------------------------------------------
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="gcs-write-behind", daemon=True)
+            self._thread.start()
+
+    def _due(self):
+        if not self._pending:
+            return False
+        if self._stop or self._flush_requested or len(self._pending) >= self.max_dirty:
+            return True
+        return time.monotonic() - self._dirty_since >= self.interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._stop:
+                        return
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self.interval - (time.monotonic() - self._dirty_since))
+                    self._cond.wait(timeout)
+                batch = self._pending
+                self._pending = OrderedDict()
+                dirty_since = self._dirty_since
+                self._dirty_since = None
+                self._in_flight = len(batch)
+                self._in_flight_since = dirty_since
+
+            failed = self._apply_batch(batch)
+
+            with self._cond:
+                self._in_flight = 0
+                # Retry failures next round unless a newer change superseded them
+                for name, op in reversed(failed.items()):
+                    if name not in self._pending:
+                        self._pending[name] = op
+                        self._pending.move_to_end(name, last=False)
+                self._in_flight_since = None
+                if failed:
+                    # The failed changes are older than anything marked meanwhile
+                    self._dirty_since = dirty_since
+                if not self._pending:
+                    self._flush_requested = False
+                self._cond.notify_all()
+            if failed:
+                # Back off instead of hammering a failing bucket
+                time.sleep(min(self.interval, 5.0) or 1.0)
+
+    def _apply_batch(self, batch):
+        """Applies a batch in order; returns the operations that failed."""
+        bucket = self.bucket_getter()
+        failed = OrderedDict()
+        for name, op in batch.items():
+            kind, source, content_type = op
+            operation = "delete" if kind == "delete" else "upload"
+            started = time.perf_counter()
+            try:
+                blob = bucket.blob(name)
+                if kind == "file":
+                    if os.path.exists(source):
+                        blob.upload_from_filename(source, content_type=content_type)
+                        self.uploads += 1
+                elif kind == "string":
+                    blob.upload_from_string(source(), content_type=content_type)
+                    self.uploads += 1
+                else:
+                    try:
+                        blob.delete()
+                    except Exception as e:
+                        # Deleting something that was never uploaded is fine
+                        if "404" not in str(e) and not isinstance(e, FileNotFoundError):
+                            raise
+                    self.deletes += 1
+            except Exception as e:
+                self.errors += 1
+                metrics.GCS_ERRORS.inc(operation=operation)
+                failed[name] = op
+                logger.error(f"Error persisting {name} to object storage: {e}")
+            metrics.GCS_SECONDS.observe(time.perf_counter() - started, operation=operation)
+        if not failed:
+            self.last_success = time.time()
+        return failed
+
+    # -- control ---------------------------------------------------------
+
+    def flush(self, timeout=30.0):
+        """Pushes every pending change now and waits for it. Returns True if nothing is left."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if not self._pending and not self._in_flight:
+                return True
+            self._flush_requested = True
+            self._ensure_thread()
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Flush timed out with {len(self._pending) + self._in_flight} objects pending")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=30.0):
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        return flushed
+
+    def status(self):
+        """Persistence lag: pending objects and age of the oldest unpersisted change."""
+        with self._cond:
+            pending = len(self._pending) + self._in_flight
+            oldest = [t for t in (self._dirty_since, self._in_flight_since) if t is not None]
+            lag = time.monotonic() - min(oldest) if oldest else 0.0
+            return {
+                "pending": pending,
+                "lag_seconds": round(lag, 3),
+                "uploads": self.uploads,
+                "deletes": self.deletes,
+                "errors": self.errors,
+                "last_success": self.last_success,
+            }
+
+
+class LocalBlob:
+    """Minimal google.cloud.storage.Blob stand-in backed by a file."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, name)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _prepare(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def upload_from_string(self, data, content_type=None):
+        self._prepare()
+        mode = "wb" if isinstance(data, bytes) else "w"
+        tmp = self.path + ".upload"
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def upload_from_filename(self, filename, content_type=None):
+        self._prepare()
+        tmp = self.path + ".upload"
+        shutil.copyfile(filename, tmp)
+        os.replace(tmp, self.path)
+
+    def download_as_text(self):
+        with open(self.path, "r") as f:
+            return f.read()
+
+    def download_as_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.path, filename)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class LocalDirBucket:
+    """Minimal google.cloud.storage.Bucket stand-in backed by a directory (GCS_FAKE_DIR)."""
+
+    def __init__(self, root):
+        self.root = root
+        self.name = f"file://{os.path.abspath(root)}"
+        os.makedirs(root, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in sorted(filenames):
+                if filename.endswith(".upload"):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    yield LocalBlob(self, name)
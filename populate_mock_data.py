@@ -1,4 +1,3 @@
-import requests
 import base64
 import zipfile
 import io
@@ -32,6 +31,8 @@ def create_soap_payload(xml_content):
     return soap_envelope
 
 def send_request(xml_content):
+    # Imported here so the payload helpers can be reused (bench/) without the HTTP client
+    import requests
     payload = create_soap_payload(xml_content)
     try:
         response = requests.post(URL, data=payload, headers={"Content-Type": "text/xml"})
@@ -107,15 +108,19 @@ xml_rh_2 = """<?xml version="1.0" encoding="UTF-8"?>
     </comunicacion>
 </solicitud>"""
 
-print("Sending RH 1...")
-send_request(xml_rh_1)
-time.sleep(1)
+def main():
+    print("Sending RH 1...")
+    send_request(xml_rh_1)
+    time.sleep(1)
 
-print("Sending PV 1...")
-send_request(xml_pv_1)
-time.sleep(1)
+    print("Sending PV 1...")
+    send_request(xml_pv_1)
+    time.sleep(1)
 
-print("Sending RH 2...")
-send_request(xml_rh_2)
+    print("Sending RH 2...")
+    send_request(xml_rh_2)
 
-print("Done.")
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""On-demand profiling of selected requests and ingested lotes.
+
+Disabled (the default), the hooks in app.py cost one attribute check. A
+configuration set through /admin/profiler (or PROFILER_CONFIG) turns it on,
+every part optional:
+
+    {
+        "mode": "sample",               # or "cprofile"
+        "every": 10,                    # one in every N matching units (default 1)
+        "arrendador": "0000000001",     # ?arrendador= of a request, codigoArrendador of a lote
+        "min_bytes": 100000,            # request body / lote payload size
+        "endpoints": ["ingest", "/api/requests"],   # URL rules, "ingest" = lote processing
+        "interval_ms": 5,               # sample mode: time between stack samples
+        "max_profiles": 50              # ring buffer size
+    }
+
+"cprofile" traces every call of the profiled unit (exact counts, and a
+noticeable slowdown of that unit); "sample" records the stack of its thread
+every interval_ms from a helper thread and barely slows it down. The last
+max_profiles profiles are kept: the cProfile ones are served merged as a
+pstats file, the sampled ones as collapsed stacks (flamegraph.pl, speedscope).
+Like the fault profiles, the profiler lives in the process.
+"""
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+MODES = ("sample", "cprofile")
+INGEST = "ingest"
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_MAX_PROFILES = 50
+
+
+def integer(config, key, default, minimum=1):
+    """An integer of at least minimum from the configuration; raises ValueError."""
+    value = config.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum or value != int(value):
+        raise ValueError(f"Invalid {key}: {value!r}")
+    return int(value)
+
+
+class ProfilerConfig:
+    """A validated configuration; config is kept as given for the admin API."""
+
+    def __init__(self, config):
+        if not isinstance(config, dict):
+            raise ValueError("The profiler configuration must be a JSON object")
+        unknown = set(config) - {"mode", "every", "arrendador", "min_bytes", "endpoints", "interval_ms", "max_profiles"}
+        if unknown:
+            raise ValueError(f"Unknown profiler keys: {', '.join(sorted(unknown))}")
+        self.config = config
+        self.mode = config.get("mode", "sample")
+        if self.mode not in MODES:
+            raise ValueError(f"Invalid mode: {self.mode} (use {', '.join(MODES)})")
+        self.every = integer(config, "every", 1)
+        self.arrendador = config.get("arrendador") or None
+        self.min_bytes = integer(config, "min_bytes", 0, minimum=0)
+        endpoints = config.get("endpoints")
+        if endpoints is not None and (not isinstance(endpoints, list) or not all(isinstance(e, str) for e in endpoints)):
+            raise ValueError("endpoints must be a list of strings")
+        self.endpoints = set(endpoints) if endpoints else None
+        self.interval = integer(config, "interval_ms", DEFAULT_INTERVAL_MS) / 1000
+        self.max_profiles = integer(config, "max_profiles", DEFAULT_MAX_PROFILES)
+
+    def matches(self, endpoint, arrendador, size):
+        if self.endpoints is not None and endpoint not in self.endpoints:
+            return False
+        if self.arrendador and arrendador != self.arrendador:
+            return False
+        return size >= self.min_bytes
+
+
+def collapse(frame):
+    """The stack of a frame, root first, as one collapsed-stack line (without the count),
+    or None while the thread runs the profiler itself (starting or stopping a session)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__:
+            return None
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled every interval seconds from a helper thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = collapse(frame) if frame is not None else None
+            if stack is not None:
+                self.stacks[stack] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+class Session:
+    """One unit of work being profiled; stop() files its profile with the profiler."""
+
+    def __init__(self, profiler, config, endpoint, arrendador, size):
+        self.profiler = profiler
+        self.config = config
+        self.info = {"endpoint": endpoint, "arrendador": arrendador, "bytes": size, "mode": config.mode,
+                     "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self._profile = None
+        self._sampler = None
+        self._started = time.perf_counter()
+        if config.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()  # ValueError on Python 3.12+ if another profiler runs
+        else:
+            self._sampler = StackSampler(threading.get_ident(), config.interval)
+
+    def stop(self):
+        seconds = time.perf_counter() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+            data = pstats.Stats(self._profile)
+        else:
+            data = self._sampler.stop()
+        self.info["seconds"] = round(seconds, 6)
+        self.profiler._record(self.info, data)
+
+
+class Profiler:
+    """The current configuration and the ring buffer of recorded profiles."""
+
+    def __init__(self):
+        self.active = False     # read without the lock by the hooks
+        self._config = None
+        self._profiles = deque(maxlen=DEFAULT_MAX_PROFILES)
+        self._seen = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, config):
+        """Validates and installs a configuration (enabling the profiler); raises ValueError."""
+        parsed = ProfilerConfig(config)
+        with self._lock:
+            self._config = parsed
+            self._seen = 0
+            if self._profiles.maxlen != parsed.max_profiles:
+                self._profiles = deque(self._profiles, maxlen=parsed.max_profiles)
+            self.active = True
+        return parsed
+
+    def disable(self):
+        """Stops selecting new units; the recorded profiles stay available."""
+        with self._lock:
+            self.active = False
+            self._config = None
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def start(self, endpoint, arrendador=None, size=0):
+        """A Session if this unit is to be profiled, else None. A thread already being
+        profiled is not profiled again (cProfile sessions cannot nest)."""
+        if getattr(self._local, "busy", False):
+            return None
+        with self._lock:
+            config = self._config
+            if config is None or not config.matches(endpoint, arrendador, size):
+                return None
+            self._seen += 1
+            if (self._seen - 1) % config.every:
+                return None
+        try:
+            session = Session(self, config, endpoint, arrendador, size)
+        except ValueError:
+            return None
+        self._local.busy = True
+        return session
+
+    def _record(self, info, data):
+        self._local.busy = False
+        with self._lock:
+            info["id"] = self._next_id
+            self._next_id += 1
+            self._profiles.append((info, data))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "config": self._config.config if self._config else None,
+                "matched": self._seen,
+                "profiles": [dict(info, samples=sum(data.values())) if isinstance(data, Counter) else dict(info)
+                             for info, data in self._profiles],
+            }
+
+    def pstats_bytes(self):
+        """The cProfile profiles in the buffer merged into one pstats file, or None if there are none."""
+        with self._lock:
+            stats = [data for _, data in self._profiles if isinstance(data, pstats.Stats)]
+        if not stats:
+            return None
+        merged = pstats.Stats()
+        merged.add(*stats)
+        return marshal.dumps(merged.stats)
+
+    def collapsed(self):
+        """The sampled profiles in the buffer summed as collapsed stacks, or None if there are none."""
+        with self._lock:
+            counters = [data for _, data in self._profiles if isinstance(data, Counter)]
+        if not counters:
+            return None
+        total = Counter()
+        for counter in counters:
+            total.update(counter)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(total.items()))
@@ -0,0 +1,270 @@
+"""Server-side filtering, projection and pagination of stored requests.
+
+Mirrors the filters the dashboard used to apply in the browser: tab (RH/PV),
+traveler name/document substring, exact fechaReserva/Entrada/Salida,
+arrendador and ingest order.
+"""
+from collections.abc import Mapping
+
+from records import to_plain
+
+DEFAULT_FIELDS = ("id", "timestamp", "header", "structured")
+ALLOWED_FIELDS = ("id", "timestamp", "header", "structured", "xml")
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+DATE_FILTERS = (
+    ("fechaReserva", "Reserva"),
+    ("fechaEntrada", "Entrada"),
+    ("fechaSalida", "Salida"),
+)
+
+
+def normalize_date(value):
+    """Normalizes a date to YYYYMMDD.
+
+    Handles YYYY-MM-DDTHH:MM:SS (Oracle), YYYY-MM-DD (date inputs) and
+    YYYYMMDD (SES).
+    """
+    if not value:
+        return ""
+    return value[:10].replace("-", "")
+
+
+def request_type_and_contracts(req):
+    """Returns (tipo, contracts) for both the current and the legacy structured format."""
+    structured = req.get("structured")
+    if not structured:
+        return None, []
+    if isinstance(structured, list):
+        # Legacy format: structured is just the list of contracts
+        contracts = structured
+        request_type = "Desconocido"
+        if contracts:
+            if "Reserva" in contracts[0].get("tipo", ""):
+                request_type = "Reserva de Hospedaje (RH)"
+            elif "Parte" in contracts[0].get("tipo", ""):
+                request_type = "Parte de Viajero (PV)"
+        return request_type, contracts
+    return structured.get("tipo") or "Desconocido", structured.get("contracts") or []
+
+
+class RequestFilter:
+    """Filter parameters shared by the dashboard API and anything else that selects requests."""
+
+    def __init__(self, tab="all", q="", dates=None, sort="date_desc", arrendador=None):
+        self.tab = tab or "all"
+        self.q = (q or "").strip().lower()
+        # {"Reserva": "20250101", ...} already normalized
+        self.dates = {key: normalize_date(value) for key, value in (dates or {}).items() if value}
+        self.sort = sort if sort in ("date_desc", "date_asc") else "date_desc"
+        # Exact codigoArrendador: the listing then reads that arrendador's shard alone
+        self.arrendador = arrendador or None
+
+    @classmethod
+    def from_args(cls, args):
+        """Builds a filter from request query parameters."""
+        return cls(
+            tab=args.get("tab", "all"),
+            q=args.get("q", ""),
+            dates={key: args.get(param) for param, key in DATE_FILTERS},
+            sort=args.get("sort", "date_desc"),
+            arrendador=args.get("arrendador"),
+        )
+
+    def matches_type(self, request_type):
+        if self.tab == "rh":
+            return "Reserva" in request_type
+        if self.tab == "pv":
+            return "Parte" in request_type
+        return True
+
+    def matches_contract(self, contract):
+        if self.q:
+            found = False
+            for persona in contract.get("personas", []):
+                if self.q in (persona.get("nombre") or "").lower() or self.q in (persona.get("documento") or "").lower():
+                    found = True
+                    break
+            if not found:
+                return False
+        fechas = contract.get("fechas") or {}
+        for key, wanted in self.dates.items():
+            if normalize_date(fechas.get(key)) != wanted:
+                return False
+        return True
+
+    def matching_contracts(self, req):
+        """Returns (tipo, contracts that pass the filter) or (tipo, []) if the request is excluded."""
+        request_type, contracts = request_type_and_contracts(req)
+        if request_type is None or not self.matches_type(request_type):
+            return request_type, []
+        if self.arrendador and (req.get("header") or {}).get("arrendador") != self.arrendador:
+            return request_type, []
+        return request_type, [c for c in contracts if self.matches_contract(c)]
+
+
+class SelectionFilter:
+    """Criteria of a bulk operation, combined with AND: an ID list and/or range,
+    arrendador, tipo (rh/pv), and a contract referencia and/or date range on one
+    fechas field (both on the same contract)."""
+
+    def __init__(self, ids=None, id_from=None, id_to=None, arrendador=None, referencia=None,
+                 field="Entrada", start=None, end=None, tipo=None):
+        self.ids = set(ids) if ids is not None else None
+        self.id_from = id_from
+        self.id_to = id_to
+        self.arrendador = arrendador or None
+        self.referencia = referencia or None
+        self.field = field
+        self.start = normalize_date(start)
+        self.end = normalize_date(end)
+        self.tipo = tipo or None
+
+    @classmethod
+    def from_params(cls, params):
+        """Builds a filter from request parameters (query string or JSON body); raises ValueError."""
+        def integer(name):
+            value = params.get(name)
+            if value in (None, ""):
+                return None
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid {name}: {value}")
+
+        ids = params.get("ids")
+        if isinstance(ids, str):
+            ids = [part for part in ids.split(",") if part.strip()]
+        if ids is not None:
+            try:
+                ids = [int(value) for value in ids]
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid ids: {ids}")
+        field = params.get("campo") or "Entrada"
+        if field not in [key for _, key in DATE_FILTERS]:
+            raise ValueError(f"Invalid campo: {field}")
+        tipo = params.get("tipo")
+        if tipo and tipo not in ("rh", "pv"):
+            raise ValueError(f"Invalid tipo: {tipo}")
+        return cls(
+            ids=ids,
+            id_from=integer("id_desde"),
+            id_to=integer("id_hasta"),
+            arrendador=params.get("arrendador"),
+            referencia=params.get("referencia"),
+            field=field,
+            start=params.get("desde"),
+            end=params.get("hasta"),
+            tipo=tipo,
+        )
+
+    def is_empty(self):
+        return (self.ids is None and self.id_from is None and self.id_to is None and not self.arrendador
+                and not self.referencia and not self.start and not self.end and not self.tipo)
+
+    def matches_contract(self, contract):
+        if self.referencia and contract.get("referencia") != self.referencia:
+            return False
+        if self.start or self.end:
+            value = normalize_date((contract.get("fechas") or {}).get(self.field))
+            if not value or (self.start and value < self.start) or (self.end and value > self.end):
+                return False
+        return True
+
+    def matches(self, req):
+        request_id = req["id"]
+        if self.ids is not None and request_id not in self.ids:
+            return False
+        if (self.id_from is not None and request_id < self.id_from) or (self.id_to is not None and request_id > self.id_to):
+            return False
+        if self.arrendador and (req.get("header") or {}).get("arrendador") != self.arrendador:
+            return False
+        request_type, contracts = request_type_and_contracts(req)
+        if self.tipo and not RequestFilter(tab=self.tipo).matches_type(request_type or ""):
+            return False
+        if self.referencia or self.start or self.end:
+            return any(self.matches_contract(contract) for contract in contracts)
+        return True
+
+
+def parse_fields(value):
+    """Parses the comma separated fields parameter; raw XML is only included on request."""
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(f for f in (part.strip() for part in value.split(",")) if f in ALLOWED_FIELDS)
+    return fields or DEFAULT_FIELDS
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def project(req, request_type, contracts, fields):
+    """Builds the API view of a request with only the filtered contracts and the requested fields."""
+    item = {}
+    for field in fields:
+        if field == "structured":
+            structured = req.get("structured")
+            view = {"tipo": request_type, "contracts": to_plain(contracts)}
+            if isinstance(structured, Mapping) and "error" in structured:
+                view["error"] = structured["error"]
+            item["structured"] = view
+        elif field in req:
+            item[field] = to_plain(req[field])
+    return item
+
+
+def iter_matches(requests, flt, after_id=None, presorted=False):
+    """Yields (req, tipo, contracts) for matching requests in the filter's sort order.
+
+    requests must be in ingest order, newest first (the order of
+    the view), or already in the filter's order with presorted
+    (any iterable then). after_id resumes right after the request with that ID.
+    """
+    ordered = requests if presorted or flt.sort == "date_desc" else reversed(requests)
+    for req in ordered:
+        if after_id is not None:
+            if flt.sort == "date_desc" and req["id"] >= after_id:
+                continue
+            if flt.sort == "date_asc" and req["id"] <= after_id:
+                continue
+        request_type, contracts = flt.matching_contracts(req)
+        if contracts:
+            yield req, request_type, contracts
+
+
+def parse_cursor(cursor):
+    """The request ID in a pagination cursor (None for the first page)."""
+    if not cursor:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def paginate(requests, flt, cursor=None, limit=DEFAULT_LIMIT, fields=DEFAULT_FIELDS, resolve=None, presorted=False):
+    """Returns one page of results and the cursor for the next one (None on the last page).
+
+    resolve maps a (possibly summarized) request to its full record; only
+    the requests on the page are resolved.
+    """
+    after_id = parse_cursor(cursor)
+    items = []
+    last_id = None
+    next_cursor = None
+    for req, request_type, contracts in iter_matches(requests, flt, after_id, presorted):
+        if len(items) == limit:
+            next_cursor = str(last_id)
+            break
+        if resolve is not None and req.get("_summary"):
+            req = resolve(req)
+            request_type, contracts = flt.matching_contracts(req)
+        items.append(project(req, request_type, contracts, fields))
+        last_id = req["id"]
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,172 @@
+"""Compact in-memory representation of stored requests.
+
+The view (the shard lists and their indexes) holds every stored request,
+so at 100k+ requests the per-object overhead of nested dicts dominates the
+process memory. Request, Header, Structured, Contract, Fechas and Persona
+keep their fields in __slots__ instead, personas and contracts sit in
+tuples, and low-cardinality values (tipo, sexo, nacionalidad, tipoPago,
+arrendador, dates, ...) are interned so equal values share one string.
+
+Records are read-only Mappings with the same keys as the JSON documents
+(unset slots are missing keys, unknown keys are kept aside), so the query
+and index code reads them like the dicts they replace. They are built by
+compact() when a request enters the view and turned back into plain
+dicts/lists by to_plain() at the API and persistence boundary.
+"""
+import sys
+from collections.abc import Mapping
+
+
+def intern_value(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Record(Mapping):
+    """Read-only mapping over __slots__ fields plus an optional _extra dict for unknown keys."""
+
+    __slots__ = ("_extra",)
+    FIELDS = ()
+    _field_set = frozenset()
+    CATEGORICAL = frozenset()  # interned
+    NESTED = {}                 # field -> converter for nested records
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        record = cls.__new__(cls)
+        fields = cls._field_set
+        extra = None
+        for key, value in data.items():
+            if key in fields:
+                convert = cls.NESTED.get(key)
+                if convert is not None and value is not None:
+                    value = convert(value)
+                elif key in cls.CATEGORICAL:
+                    value = intern_value(value)
+                setattr(record, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        if extra:
+            record._extra = extra
+        return record
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        extra = getattr(self, "_extra", None)
+        if extra and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        extra = getattr(self, "_extra", None)
+        return extra.get(key, default) if extra else default
+
+    def __iter__(self):
+        for name in self.FIELDS:
+            if hasattr(self, name):
+                yield name
+        yield from getattr(self, "_extra", None) or ()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        return {key: to_plain(self[key]) for key in self}
+
+
+def record_tuple(record_class):
+    """Converter for a list of nested records."""
+    return lambda values: tuple(record_class.from_dict(value) for value in values)
+
+
+class Persona(Record):
+    __slots__ = ("nombre", "documento", "soporte", "nacimiento", "nacionalidad", "sexo", "direccion", "contacto")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(("soporte", "nacimiento", "nacionalidad", "sexo"))
+
+
+class Fechas(Record):
+    __slots__ = ("Reserva", "Entrada", "Salida", "Pago")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(FIELDS)
+
+
+class Contract(Record):
+    __slots__ = ("tipo", "referencia", "fechas", "personas")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(("tipo",))
+    NESTED = {"fechas": Fechas.from_dict, "personas": record_tuple(Persona)}
+
+
+class Structured(Record):
+    __slots__ = ("tipo", "contracts", "error")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(("tipo",))
+    NESTED = {"contracts": record_tuple(Contract)}
+
+
+def structured_record(value):
+    # Legacy records keep structured as a bare list of contracts
+    if isinstance(value, list):
+        return [Contract.from_dict(contract) for contract in value]
+    if isinstance(value, Mapping):
+        return Structured.from_dict(value)
+    return value
+
+
+class Header(Record):
+    __slots__ = ("arrendador", "aplicacion", "tipoOperacion", "tipoComunicacion")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(FIELDS)
+
+
+class Request(Record):
+    __slots__ = ("id", "lote", "timestamp", "header", "xml_sha256", "structured", "_summary", "_loc")
+    FIELDS = __slots__
+    CATEGORICAL = frozenset(("timestamp",))
+    NESTED = {"header": Header.from_dict, "structured": structured_record}
+
+
+def compact(entry):
+    """The Request record for a stored request dict (returned as is if it already is one)."""
+    return Request.from_dict(entry)
+
+
+def footprint(value):
+    """Approximate bytes held by a record: its objects and strings (interned ones counted every time)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, Record):
+        for key in value:
+            size += footprint(value[key])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += footprint(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            size += footprint(item)
+    return size
+
+
+def to_plain(value):
+    """Plain JSON-serializable copy of records and the tuples holding them."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    return value
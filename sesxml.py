@@ -0,0 +1,251 @@
+"""Parsing of the inner SES XML (PV/RH comunicaciones and Oracle BI Publisher DATA_DS exports).
+
+Kept free of Flask and storage state so batch ingestion can run it in
+worker processes.
+"""
+import logging
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+
+def get_local_text(node, name, default=""):
+    """Finds a child node by local name and returns its text."""
+    if node is None:
+        return default
+    # Use xpath to find the node by local name
+    results = node.xpath(f".//*[local-name()='{name}']")
+    if results:
+        return results[0].text or default
+    return default
+
+def find_local_node(node, name):
+    """Finds a node by local name."""
+    if node is None:
+        return None
+    results = node.xpath(f".//*[local-name()='{name}']")
+    return results[0] if results else None
+
+# Declarative field maps for the inner XML formats.
+# Each entry is (output key, source local name, default when missing or empty).
+SES_CONTRACT_TYPES = {
+    "contrato": {
+        "tipo": "Parte de Viajero (PV)",
+        "fechas": [("Entrada", "fechaEntrada", ""), ("Salida", "fechaSalida", "")],
+    },
+    "reserva": {
+        "tipo": "Reserva de Hospedaje (RH)",
+        "fechas": [("Reserva", "fechaReserva", ""), ("Entrada", "fechaEntrada", ""), ("Salida", "fechaSalida", "")],
+    },
+}
+
+SES_PERSONA_FIELDS = [
+    ("soporte", "soporteDocumento", "N/A"),
+    ("nacimiento", "fechaNacimiento", ""),
+    ("nacionalidad", "nacionalidad", ""),
+    ("sexo", "sexo", ""),
+]
+
+DATA_DS_CONTRACT_FIELDS = {
+    "referencia": ("CONFIRMATION_NO", "N/A"),
+    "fechas": [("Reserva", "INSERT_DATE", ""), ("Entrada", "BEGIN_DATE", ""), ("Salida", "END_DATE", ""), ("Pago", "PAYMENT_METHOD", "")],
+}
+
+DATA_DS_PERSONA_FIELDS = [
+    ("nacionalidad", "NACIONALIDAD", ""),
+    ("sexo", "SEXO", ""),
+]
+
+def local_name(node):
+    """Returns the tag of an element without its namespace."""
+    return node.tag.rpartition("}")[2]
+
+def scan_subtree(node, collect=()):
+    """Walks the descendants of node once.
+
+    Returns a dict mapping each local name to its first descendant element in
+    document order (what get_local_text/find_local_node would pick), plus a dict
+    with every descendant whose local name is in collect.
+    """
+    first = {}
+    found = {name: [] for name in collect}
+    if node is None:
+        return first, found
+    for el in node.iterdescendants():
+        if not isinstance(el.tag, str):
+            continue  # comments and processing instructions
+        name = local_name(el)
+        if name not in first:
+            first[name] = el
+        if name in found:
+            found[name].append(el)
+    return first, found
+
+def first_text(first, name, default=""):
+    """Text of the first descendant with the given local name, from a scan_subtree() map."""
+    node = first.get(name)
+    if node is None:
+        return default
+    return node.text or default
+
+def extract_fields(first, fields):
+    """Builds an ordered dict from a field map against a scan_subtree() map."""
+    return {key: first_text(first, name, default) for key, name, default in fields}
+
+def parse_data_ds_contract(g1):
+    """Parses one Oracle BI Publisher G_1 block (reservation plus its G_2 guests)."""
+    first, found = scan_subtree(g1, collect=("G_2",))
+    name, default = DATA_DS_CONTRACT_FIELDS["referencia"]
+    data = {
+        "tipo": "Reserva de Hospedaje (RH)", # Assuming these are always reservations based on file name
+        "referencia": first_text(first, name, default),
+        "fechas": extract_fields(first, DATA_DS_CONTRACT_FIELDS["fechas"]),
+        "personas": []
+    }
+    for g2 in found["G_2"]:
+        p_first, _ = scan_subtree(g2)
+        fields = extract_fields(p_first, DATA_DS_PERSONA_FIELDS)
+        data["personas"].append({
+            "nombre": first_text(p_first, "FIRST"),
+            "documento": "N/A", # Not present in the snippet
+            "soporte": "N/A",
+            "nacimiento": "N/A",
+            "nacionalidad": fields["nacionalidad"],
+            "sexo": fields["sexo"],
+            "direccion": f"{first_text(p_first, 'PAIS')}",
+            "contacto": f"Tel: {first_text(p_first, 'TELEFONO')} / Email: {first_text(p_first, 'CORREO')}"
+        })
+    return data
+
+def parse_ses_persona(persona):
+    """Parses one SES persona element."""
+    first, _ = scan_subtree(persona)
+    nombre = first_text(first, "nombre")
+    ap1 = first_text(first, "apellido1")
+    ap2 = first_text(first, "apellido2")
+
+    # Address
+    direccion_node = first.get("direccion")
+    if direccion_node is not None:
+        d_first, _ = scan_subtree(direccion_node)
+        full_address = f"{first_text(d_first, 'direccion')}, {first_text(d_first, 'codigoPostal')}, {first_text(d_first, 'pais')}"
+    else:
+        full_address = "N/A"
+
+    # Contact
+    tel = first_text(first, "telefono")
+    email = first_text(first, "correo")
+    contact_info = []
+    if tel: contact_info.append(f"Tel: {tel}")
+    if email: contact_info.append(f"Email: {email}")
+    full_contact = " / ".join(contact_info) if contact_info else "N/A"
+
+    p_data = {
+        "nombre": f"{nombre} {ap1} {ap2}".strip(),
+        "documento": f"{first_text(first, 'tipoDocumento')}: {first_text(first, 'numeroDocumento')}",
+    }
+    p_data.update(extract_fields(first, SES_PERSONA_FIELDS))
+    p_data["direccion"] = full_address
+    p_data["contacto"] = full_contact
+    return p_data
+
+def parse_ses_comunicacion(com_node):
+    """Parses one SES comunicacion block. Returns None if it has no contrato/reserva."""
+    first, found = scan_subtree(com_node, collect=("persona",))
+
+    # contrato (PV) takes precedence over reserva (RH)
+    for kind in ("contrato", "reserva"):
+        node = first.get(kind)
+        if node is not None:
+            break
+    else:
+        # If no contract/reserva found in this node, skip it (might be just a wrapper or empty)
+        return None
+
+    spec = SES_CONTRACT_TYPES[kind]
+    c_first, _ = scan_subtree(node)
+    pago = c_first.get("pago")
+    if pago is not None:
+        tipo_pago = first_text(scan_subtree(pago)[0], "tipoPago", "N/A")
+    else:
+        tipo_pago = "N/A"
+
+    fechas = extract_fields(c_first, spec["fechas"])
+    fechas["Pago"] = tipo_pago
+    return {
+        "tipo": spec["tipo"],
+        "referencia": first_text(c_first, "referencia", "N/A"),
+        "fechas": fechas,
+        # Extract persons for THIS communication block
+        "personas": [parse_ses_persona(persona) for persona in found["persona"]]
+    }
+
+def parse_ses_xml(xml_content, root=None):
+    """Parses the inner SES XML (PV or RH) or Oracle BI Publisher XML into a structured list of contracts.
+
+    The document is walked once to locate the comunicacion/G_1 blocks, and
+    each block (and each persona/G_2 inside it) is walked once more to pull
+    its fields, so parse time is linear in document size. Pass root when the
+    XML was already parsed (streaming ingest) to avoid parsing it again.
+    """
+    try:
+        if root is None:
+            parser = etree.XMLParser(recover=True, remove_blank_text=True)
+            root = etree.fromstring(xml_content.encode('utf-8'), parser=parser)
+
+        _, found = scan_subtree(root, collect=("DATA_DS", "G_1", "comunicacion"))
+
+        # Check if it's the Oracle BI Publisher format (DATA_DS)
+        if root.tag == 'DATA_DS' or found["DATA_DS"]:
+            return {
+                "tipo": "Reserva de Hospedaje (RH)",
+                "contracts": [parse_data_ds_contract(g1) for g1 in found["G_1"]]
+            }
+
+        # Standard SES XML parsing
+        # Note: In some XMLs, 'comunicacion' is a direct child of 'solicitud' (which is root here)
+        comunicacion_nodes = found["comunicacion"]
+
+        if not comunicacion_nodes:
+            # Fallback for old single-structure or if structure is different
+            comunicacion_nodes = [root]
+
+        contracts = []
+        for com_node in comunicacion_nodes:
+            data = parse_ses_comunicacion(com_node)
+            if data is not None:
+                contracts.append(data)
+
+        # Determine overall type based on what we found
+        # If we found at least one "Parte de Viajero", we call it PV.
+        # If we found "Reserva", we call it RH.
+        # This logic might need to be more robust if mixed types are possible,
+        # but usually a file is one or the other.
+
+        overall_type = "Desconocido"
+        # Check raw string for type as requested for robustness
+        if "<tipoComunicacion>RH</tipoComunicacion>" in xml_content:
+            overall_type = "Reserva de Hospedaje (RH)"
+        elif "<tipoComunicacion>PV</tipoComunicacion>" in xml_content:
+            overall_type = "Parte de Viajero (PV)"
+        else:
+            # Fallback to inferring from parsed content
+            if contracts:
+                first_type = contracts[0].get("tipo", "")
+                if "Parte" in first_type:
+                    overall_type = "Parte de Viajero (PV)"
+                elif "Reserva" in first_type:
+                    overall_type = "Reserva de Hospedaje (RH)"
+
+        return {
+            "tipo": overall_type,
+            "contracts": contracts
+        }
+    except Exception as e:
+        logger.error(f"Error parsing inner XML: {e}")
+        return {
+            "tipo": "Error",
+            "contracts": [],
+            "error": str(e)
+        }
@@ -0,0 +1,356 @@
+"""The in-memory view of stored requests, partitioned by arrendador.
+
+Every codigoArrendador gets a ViewShard: its requests newest first, their
+RequestIndex and a lock of its own, so ingest, listings and deletes of one
+arrendador never wait for another's. ShardedView routes request IDs to
+their shard and merges the shards' newest-first lists for queries across
+arrendadores. Request IDs stay global (one sequence for every shard), so
+they order the merged lists and keep working in URLs and cursors.
+
+Lock order: the view's gate (exclusive(), creating a shard), then shard
+locks by name; a thread holding a shard lock never takes the gate.
+"""
+import bisect
+import hashlib
+import heapq
+import re
+import threading
+from contextlib import contextmanager
+
+import indexes
+import records
+
+UNKNOWN_ARRENDADOR = "N/A"
+COMPACT_MIN = 1024
+CANDIDATE_CHUNK = 256   # requests read from a shard per lock acquisition by candidates()
+
+
+def arrendador_of(entry):
+    return (entry.get("header") or {}).get("arrendador") or UNKNOWN_ARRENDADOR
+
+
+def shard_name(arrendador):
+    """A file-name-safe key for an arrendador (hash-suffixed when characters had to be replaced)."""
+    name = re.sub(r"[^A-Za-z0-9_-]", "_", arrendador)[:64]
+    if name != arrendador or not name:
+        name = f"{name}-{hashlib.sha1(arrendador.encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+
+def entry_shard(entry):
+    """Name of the shard a stored request belongs to."""
+    return shard_name(arrendador_of(entry))
+
+
+def newest_first(lists):
+    """Merges newest-first request lists into one iterator."""
+    return heapq.merge(*lists, key=lambda req: -req["id"])
+
+
+class ViewShard:
+    """One arrendador's requests, newest first, with their index.
+
+    Deleted requests leave the index right away but stay in requests until
+    compact() drops them in one pass, once there are COMPACT_MIN of them or
+    an eighth of the list (so deleting n requests costs O(n), not O(n * shard
+    size)). Every method expects the caller to hold lock.
+    """
+
+    def __init__(self, name, arrendador, owners, track_bytes=False):
+        self.name = name
+        self.arrendador = arrendador
+        self.lock = threading.RLock()
+        self.requests = []
+        self.index = indexes.RequestIndex()
+        self.tombstones = set()
+        self.bytes = 0          # approximate size of the records, kept only with track_bytes
+        self.retired = False    # dropped from the view by a reload or a delete-all
+        self._owners = owners
+        self._track_bytes = track_bytes
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self, entries):
+        """Fills a new shard with compact records, newest first."""
+        self.requests = entries
+        self.index.rebuild(entries)
+        for req in entries:
+            self._owners[req["id"]] = self
+        if self._track_bytes:
+            self.bytes = sum(records.footprint(req) for req in entries)
+
+    def _position(self, request_id):
+        return bisect.bisect_left(self.requests, -request_id, key=lambda req: -req["id"])
+
+    def add(self, entry):
+        """Adds a compact record; returns False if the shard already holds it."""
+        if self.index.get(entry["id"]) is not None:
+            return False
+        if entry["id"] in self.tombstones:
+            # The ID of a deleted request was handed out again (the JSON file and log backends
+            # seed their IdSequence from the highest stored ID when they start; SQLite never reuses one)
+            self.compact()
+        if self._track_bytes:
+            self.bytes += records.footprint(entry)
+        if not self.requests or entry["id"] > self.requests[0]["id"]:
+            self.requests.insert(0, entry)
+        else:
+            # A request that committed before one already in the view
+            self.requests.insert(self._position(entry["id"]), entry)
+        self.index.add(entry)
+        self._owners[entry["id"]] = self
+        return True
+
+    def remove(self, request_id):
+        """Removes a request (tombstoned in the list); returns it, or None if it was not here."""
+        req = self.index.remove(request_id)
+        if req is None:
+            return None
+        if self._owners.get(request_id) is self:
+            del self._owners[request_id]
+        if self._track_bytes:
+            self.bytes -= records.footprint(req)
+        self.tombstones.add(request_id)
+        if len(self.tombstones) >= max(COMPACT_MIN, len(self.requests) // 8):
+            self.compact()
+        return req
+
+    def compact(self):
+        if self.tombstones:
+            self.requests[:] = [req for req in self.requests if req["id"] not in self.tombstones]
+            self.tombstones.clear()
+
+    def live(self):
+        """The shard's requests, newest first, without the tombstoned ones (a copy)."""
+        requests = list(self.requests)
+        if not self.tombstones:
+            return requests
+        return [req for req in requests if req["id"] not in self.tombstones]
+
+    def after(self, after_id, descending, count):
+        """Up to count live requests past after_id (exclusive, None = from the start) in ID
+        order, newest first when descending; bisects to the position instead of scanning."""
+        requests = self.requests
+        found = []
+        if descending:
+            position = 0 if after_id is None else bisect.bisect_right(requests, -after_id, key=lambda req: -req["id"])
+            while position < len(requests) and len(found) < count:
+                req = requests[position]
+                position += 1
+                if req["id"] not in self.tombstones:
+                    found.append(req)
+        else:
+            position = len(requests) if after_id is None else self._position(after_id)
+            while position > 0 and len(found) < count:
+                position -= 1
+                req = requests[position]
+                if req["id"] not in self.tombstones:
+                    found.append(req)
+        return found
+
+    def replace(self, entry):
+        """Swaps a summary for its full record (compact) in place."""
+        position = self._position(entry["id"])
+        if position < len(self.requests) and self.requests[position]["id"] == entry["id"]:
+            if self._track_bytes:
+                self.bytes += records.footprint(entry) - records.footprint(self.requests[position])
+            self.requests[position] = entry
+        self.index.replace(entry)
+
+    def oldest(self, limit):
+        """Up to limit of the oldest requests, oldest first."""
+        self.compact()
+        return self.requests[:-limit - 1:-1] if limit > 0 else []
+
+    def evict(self, request_ids):
+        """Drops requests at the old end of the shard; returns the ones it held."""
+        evicted = []
+        for request_id in request_ids:
+            req = self.index.remove(request_id)
+            if req is not None:
+                self._owners.pop(request_id, None)
+                if self._track_bytes:
+                    self.bytes -= records.footprint(req)
+                evicted.append(req)
+        if evicted:
+            # Only the tail holds them, so leave the rest of the list alone
+            ids = {req["id"] for req in evicted}
+            position = self._position(max(ids))
+            self.requests[position:] = [req for req in self.requests[position:] if req["id"] not in ids]
+        return evicted
+
+
+class ShardedView:
+    """The ViewShards by name, and which shard holds each request ID."""
+
+    def __init__(self, track_bytes=False):
+        self.track_bytes = track_bytes
+        self._shards = {}       # shard name -> ViewShard
+        self._owners = {}       # request ID -> ViewShard (single dict operations, no lock)
+        self._gate = threading.RLock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards())
+
+    @property
+    def bytes(self):
+        return sum(shard.bytes for shard in self.shards())
+
+    def shards(self, arrendador=None):
+        """Every shard (in name order), or only the one of arrendador."""
+        if arrendador is not None:
+            shard = self._shards.get(shard_name(arrendador))
+            return [shard] if shard is not None else []
+        return sorted(self._shards.values(), key=lambda shard: shard.name)
+
+    def _create(self, name, arrendador):
+        with self._gate:
+            shard = self._shards.get(name)
+            if shard is None:
+                shard = self._shards[name] = ViewShard(name, arrendador, self._owners, self.track_bytes)
+            return shard
+
+    @contextmanager
+    def locked(self, arrendador):
+        """The shard of arrendador (created if needed) with its lock held."""
+        name = shard_name(arrendador)
+        while True:
+            shard = self._shards.get(name) or self._create(name, arrendador)
+            with shard.lock:
+                if not shard.retired:
+                    yield shard
+                    return
+
+    @contextmanager
+    def owner_locked(self, request_id):
+        """The shard holding a request with its lock held, or None if no shard holds it."""
+        while True:
+            shard = self._owners.get(request_id)
+            if shard is None:
+                yield None
+                return
+            with shard.lock:
+                if shard.retired or self._owners.get(request_id) is not shard:
+                    continue  # moved or dropped while we waited for the lock
+                yield shard if shard.index.get(request_id) is not None else None
+                return
+
+    @contextmanager
+    def exclusive(self):
+        """Holds every shard lock (and keeps new shards from appearing) for a reload or a delete-all."""
+        with self._gate:
+            shards = self.shards()
+            for shard in shards:
+                shard.lock.acquire()
+            try:
+                yield
+            finally:
+                for shard in reversed(shards):
+                    shard.lock.release()
+
+    def reset(self, entries=()):
+        """Replaces every shard with new ones holding entries (compact, newest first).
+        Caller holds exclusive(); returns the retired shards."""
+        retired = list(self._shards.values())
+        for shard in retired:
+            shard.retired = True
+        self._shards = {}
+        self._owners = {}
+        groups = {}
+        for req in entries:
+            groups.setdefault(arrendador_of(req), []).append(req)
+        for arrendador, group in groups.items():
+            self._create(shard_name(arrendador), arrendador).load(group)
+        return retired
+
+    # -- lookups ---------------------------------------------------------
+
+    def get(self, request_id):
+        shard = self._owners.get(request_id)
+        return shard.index.get(request_id) if shard is not None else None
+
+    def get_by_lote(self, lote):
+        for shard in self.shards():
+            with shard.lock:
+                req = shard.index.get_by_lote(lote)
+            if req is not None:
+                return req
+        return None
+
+    def live(self, arrendador=None):
+        """Every request (or only arrendador's), newest first."""
+        lists = []
+        for shard in self.shards(arrendador):
+            with shard.lock:
+                lists.append(shard.live())
+        return lists[0] if len(lists) == 1 else list(newest_first(lists))
+
+    def shard_live(self, name):
+        """The requests of the shard with that name, newest first (a persistence snapshot)."""
+        shard = self._shards.get(name)
+        if shard is None:
+            return []
+        with shard.lock:
+            return shard.live()
+
+    def candidates(self, flt, arrendador=None, after_id=None, chunk=CANDIDATE_CHUNK):
+        """The requests that can match a query.RequestFilter past the after_id cursor, lazily
+        and in the filter's order (the indexed candidates of each shard when the filter
+        allows it). Each shard is read chunk requests at a time under its lock, so a page
+        costs what it reads rather than the size of the view."""
+        descending = flt.sort != "date_asc"
+        streams = [self._shard_candidates(shard, flt, after_id, descending, chunk) for shard in self.shards(arrendador)]
+        if len(streams) == 1:
+            return streams[0]
+        return heapq.merge(*streams, key=(lambda req: -req["id"]) if descending else (lambda req: req["id"]))
+
+    @staticmethod
+    def _shard_candidates(shard, flt, after_id, descending, chunk):
+        with shard.lock:
+            ids = shard.index.candidate_ids(flt)
+        if ids is not None:
+            if after_id is not None:
+                ids = [rid for rid in ids if (rid < after_id if descending else rid > after_id)]
+            ids = sorted(ids, reverse=descending)
+            for start in range(0, len(ids), chunk):
+                with shard.lock:
+                    found = [shard.index.get(rid) for rid in ids[start:start + chunk]]
+                yield from (req for req in found if req is not None)
+            return
+        while True:
+            with shard.lock:
+                found = shard.after(after_id, descending, chunk) if not shard.retired else []
+            yield from found
+            if len(found) < chunk:
+                return
+            after_id = found[-1]["id"]
+
+    def stays(self, arrendador=None, **criteria):
+        """RequestIndex.stays() over the shards, merged by ID (newest first)."""
+        lists = []
+        for shard in self.shards(arrendador):
+            with shard.lock:
+                lists.append(shard.index.stays(arrendador=arrendador, **criteria))
+        return list(heapq.merge(*lists, key=lambda match: (-match[0]["id"], -match[1])))
+
+    def oldest(self, limit):
+        """Up to limit of the oldest requests across shards, oldest first."""
+        lists = []
+        for shard in self.shards():
+            with shard.lock:
+                lists.append(shard.oldest(limit))
+        return list(heapq.merge(*lists, key=lambda req: req["id"]))[:limit]
+
+    def counts(self):
+        """[(arrendador, requests)] for every shard that holds any."""
+        return [(shard.arrendador, len(shard)) for shard in self.shards() if len(shard)]
+
+    def group_by_owner(self, request_ids):
+        """{shard: [request IDs]} for the IDs some shard holds."""
+        groups = {}
+        for request_id in request_ids:
+            shard = self._owners.get(request_id)
+            if shard is not None:
+                groups.setdefault(shard, []).append(request_id)
+        return groups
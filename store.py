@@ -0,0 +1,1078 @@
+import glob
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_entry(entry):
+    """Compact form of a stored request for fast startup.
+
+    Keeps what the listing, the filters and the secondary indexes read
+    (header, contract tipo/referencia/fechas, persona nombre/documento) and
+    drops every other persona field. The raw XML lives in the blob store,
+    so the summary keeps its hash as is. Marked with "_summary" so callers
+    know to fetch the full record before showing details.
+    """
+    def contract_summary(contract):
+        return {
+            "tipo": contract.get("tipo"),
+            "referencia": contract.get("referencia"),
+            "fechas": contract.get("fechas") or {},
+            "personas": [
+                {"nombre": p.get("nombre"), "documento": p.get("documento")}
+                for p in contract.get("personas", [])
+            ],
+        }
+
+    structured = entry.get("structured")
+    if isinstance(structured, list):
+        # Legacy format: structured is just the list of contracts
+        structured_summary = [contract_summary(c) for c in structured]
+    elif isinstance(structured, dict):
+        structured_summary = {
+            "tipo": structured.get("tipo"),
+            "contracts": [contract_summary(c) for c in structured.get("contracts") or []],
+        }
+        if "error" in structured:
+            structured_summary["error"] = structured["error"]
+    else:
+        structured_summary = structured
+    summary = {
+        "id": entry["id"],
+        "timestamp": entry.get("timestamp"),
+        "header": entry.get("header"),
+        "structured": structured_summary,
+        "_summary": True,
+    }
+    for key in ("xml_sha256", "lote"):
+        if key in entry:
+            summary[key] = entry[key]
+    return summary
+
+
+class IdSequence:
+    """Monotonic request IDs for single-process backends, seeded from the highest stored ID."""
+
+    def __init__(self):
+        self._next = 1
+        self._lock = threading.Lock()
+
+    def seed(self, entries):
+        with self._lock:
+            self._next = max(self._next, max((entry["id"] for entry in entries), default=0) + 1)
+
+    def assign(self, entry):
+        """Gives entry an ID unless it already has one; returns the ID."""
+        with self._lock:
+            if entry.get("id") is None:
+                entry["id"] = self._next
+            self._next = max(self._next, entry["id"] + 1)
+            return entry["id"]
+
+
+class JsonFileBackend:
+    """Legacy backend: rewrites the whole history as one JSON document on every change."""
+
+    def __init__(self, path, snapshot, bucket_getter=None, uploader=None, gcs_name=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.bucket_getter = bucket_getter
+        self.uploader = uploader
+        self.gcs_name = gcs_name or os.path.basename(path)
+        self.ids = IdSequence()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def load(self, lazy=False):
+        """Loads requests (newest first) and seeds the ID sequence.
+
+        A single JSON document cannot be read partially, so lazy is ignored
+        and full records are always returned.
+        """
+        entries = self._read()
+        self.ids.seed(entries)
+        return entries
+
+    def fetch(self, summary):
+        return None
+
+    def iter_full(self):
+        return iter(())
+
+    def mark_hydrated(self):
+        pass
+
+    def _read(self):
+        """Reads requests from GCS or the local JSON file (newest first)."""
+        bucket = self.bucket_getter() if self.bucket_getter else None
+        if bucket:
+            try:
+                blob = bucket.blob(self.gcs_name)
+                if blob.exists():
+                    entries = json.loads(blob.download_as_text())
+                    logger.info(f"Loaded {len(entries)} requests from GCS bucket {bucket.name}")
+                    return entries
+            except Exception as e:
+                logger.error(f"Error loading from GCS: {e}")
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    entries = json.load(f)
+                logger.info(f"Loaded {len(entries)} requests from local file {self.path}")
+                return entries
+            except Exception as e:
+                logger.error(f"Error loading local data: {e}")
+        return []
+
+    def save_all(self, entries):
+        """Saves the full history to the local JSON file and GCS."""
+        entries = list(entries)
+        try:
+            with open(self.path, "w") as f:
+                json.dump(entries, f, indent=4)
+            logger.info(f"Saved {len(entries)} requests to local file {self.path}")
+        except Exception as e:
+            logger.error(f"Error saving local data: {e}")
+
+        if self.uploader:
+            # Serialized when the upload runs, so a burst of saves becomes one upload (of the
+            # last one: with an insert the snapshot does not hold the new entry yet)
+            self.uploader.upload_string(
+                self.gcs_name,
+                lambda: json.dumps(entries, indent=4),
+                content_type='application/json',
+            )
+
+    def insert(self, entry):
+        """Assigns the entry's ID, persists it and returns the ID."""
+        request_id = self.ids.assign(entry)
+        self.save_all([entry] + list(self.snapshot()))
+        return request_id
+
+    def insert_many(self, entries):
+        """Assigns IDs to entries (oldest first) and persists them in one rewrite; returns the IDs."""
+        ids = [self.ids.assign(entry) for entry in entries]
+        self.save_all(list(reversed(entries)) + list(self.snapshot()))
+        return ids
+
+    def rewrite(self, entries):
+        """Persists new versions of already stored entries (the snapshot already holds them)."""
+        self.save_all(self.snapshot())
+
+    def delete(self, request_id):
+        self.save_all(self.snapshot())
+
+    def delete_many(self, request_ids):
+        self.save_all(self.snapshot())
+
+    def clear(self):
+        self.save_all([])
+
+    def changes(self):
+        """Changes made by other processes since the last call (none for this backend)."""
+        return []
+
+    def close(self):
+        pass
+
+
+class AppendLogBackend:
+    """Append-only, segmented JSONL log.
+
+    Every mutation is one line in the active segment:
+        {"op": "put", "entry": {...}}   stored request
+        {"op": "del", "id": 5}          tombstone
+        {"op": "clear"}                 truncate everything before this line
+    Segments roll over once they reach max_segment_bytes, so an ingest only
+    writes (and mirrors to GCS) a bounded amount of data. A background thread
+    periodically folds the sealed segments into a single snapshot segment.
+
+    Each segment has a summary-N.jsonl sidecar with the same operations, but
+    puts carry summarize_entry() plus the byte offset ("at") of the full
+    record. A lazy load replays only the sidecars; full records are read
+    with one seek each (fetch) or all at once in the background (iter_full).
+    """
+
+    SEGMENT_PATTERN = "segment-*.jsonl"
+    SUMMARY_PATTERN = "summary-*.jsonl"
+
+    def __init__(self, directory, bucket_getter=None, uploader=None, legacy_backend=None,
+                 max_segment_bytes=4 * 1024 * 1024, compaction_interval=300,
+                 compaction_min_segments=4, gcs_prefix="requests_log/"):
+        self.directory = directory
+        self.bucket_getter = bucket_getter
+        self.uploader = uploader
+        self.legacy_backend = legacy_backend
+        self.max_segment_bytes = max_segment_bytes
+        self.compaction_interval = compaction_interval
+        self.compaction_min_segments = compaction_min_segments
+        self.gcs_prefix = gcs_prefix
+
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._download_lock = threading.Lock()
+        self._active_file = None
+        self._summary_file = None
+        self._active_number = 0
+        self._dead_records = 0
+        self._remote_only = set()   # sealed segments restored lazily from GCS, not downloaded yet
+        self._hydrated = False      # compaction waits until full records were read once
+        self._stop = threading.Event()
+        self._compactor = None
+        self.ids = IdSequence()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    # -- segment helpers -------------------------------------------------
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:08d}.jsonl")
+
+    def _summary_path(self, number):
+        return os.path.join(self.directory, f"summary-{number:08d}.jsonl")
+
+    @staticmethod
+    def _file_number(path):
+        return int(os.path.basename(path).split("-", 1)[1][:-len(".jsonl")])
+
+    def _numbers(self, pattern):
+        paths = glob.glob(os.path.join(self.directory, pattern))
+        return sorted(self._file_number(p) for p in paths)
+
+    def _segment_numbers(self):
+        return self._numbers(self.SEGMENT_PATTERN)
+
+    def _bucket(self):
+        return self.bucket_getter() if self.bucket_getter else None
+
+    def _remote_name(self, path):
+        return self.gcs_prefix + os.path.basename(path)
+
+    def _upload_segment(self, number):
+        if self.uploader:
+            for path in (self._segment_path(number), self._summary_path(number)):
+                self.uploader.upload_file(self._remote_name(path), path, 'application/x-ndjson')
+
+    def _delete_remote_segment(self, number):
+        if self.uploader:
+            for path in (self._segment_path(number), self._summary_path(number)):
+                self.uploader.delete(self._remote_name(path))
+
+    def _restore_from_gcs(self, lazy):
+        """Restores the log from GCS when the local directory is empty (fresh container).
+
+        Lazily, only the summaries and the active (newest) segment are
+        downloaded up front; older segments are fetched on demand.
+        """
+        bucket = self._bucket()
+        if not bucket:
+            return
+        try:
+            blobs = {}
+            for blob in bucket.list_blobs(prefix=self.gcs_prefix):
+                name = os.path.basename(blob.name)
+                if name.endswith(".jsonl") and name.split("-", 1)[0] in ("segment", "summary"):
+                    blobs[name] = blob
+            segments = sorted(self._file_number(name) for name in blobs if name.startswith("segment-"))
+            for number in segments:
+                segment_name = os.path.basename(self._segment_path(number))
+                summary_name = os.path.basename(self._summary_path(number))
+                if summary_name in blobs:
+                    blobs[summary_name].download_to_filename(self._summary_path(number))
+                if lazy and summary_name in blobs and number != segments[-1]:
+                    self._remote_only.add(number)
+                else:
+                    blobs[segment_name].download_to_filename(self._segment_path(number))
+            if segments:
+                logger.info(f"Restored {len(segments)} log segments from GCS ({len(self._remote_only)} deferred)")
+        except Exception as e:
+            logger.error(f"Error downloading log segments from GCS: {e}")
+
+    def _ensure_local(self, number):
+        """Downloads a deferred segment before its full records are read."""
+        if number not in self._remote_only:
+            return
+        with self._download_lock:
+            if number not in self._remote_only:
+                return
+            path = self._segment_path(number)
+            tmp = path + ".download"
+            self._bucket().blob(self._remote_name(path)).download_to_filename(tmp)
+            os.replace(tmp, path)
+            self._remote_only.discard(number)
+
+    @staticmethod
+    def _replay_file(path, state, number=None):
+        """Applies every record of a segment (or, with number, of its summary) to state.
+
+        state is an OrderedDict id -> entry. Summary entries get "_loc":
+        (segment number, byte offset of the full record).
+        """
+        dead = 0
+        with open(path, "r") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write at the tail of the active segment; everything before it is valid.
+                    logger.warning(f"Skipping corrupt record at {path}:{line_no}")
+                    continue
+                op = record.get("op")
+                if op == "put":
+                    entry = record["entry"]
+                    if number is not None:
+                        entry["_loc"] = (number, record["at"])
+                    if entry["id"] in state:
+                        dead += 1
+                    state[entry["id"]] = entry
+                elif op == "del":
+                    if state.pop(record["id"], None) is not None:
+                        dead += 1
+                elif op == "clear":
+                    dead += len(state)
+                    state.clear()
+        return dead
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, separators=(",", ":")) + "\n"
+
+    def _append(self, segment_file, summary_file, record):
+        """Writes a record to a segment and its summary line to the sidecar."""
+        offset = segment_file.tell()
+        segment_file.write(self._encode(record))
+        if record["op"] == "put":
+            summary = {"op": "put", "entry": summarize_entry(record["entry"]), "at": offset}
+        else:
+            summary = record
+        summary_file.write(self._encode(summary))
+
+    def _ensure_summary(self, number):
+        """Builds the sidecar of a segment written before summaries existed."""
+        path = self._summary_path(number)
+        if os.path.exists(path):
+            return
+        tmp = path + ".tmp"
+        with open(self._segment_path(number), "rb") as segment, open(tmp, "w") as summary:
+            offset = 0
+            for raw in segment:
+                line = raw.strip()
+                if line:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None
+                    if record is not None:
+                        if record.get("op") == "put":
+                            record = {"op": "put", "entry": summarize_entry(record["entry"]), "at": offset}
+                        summary.write(self._encode(record))
+                offset += len(raw)
+        os.replace(tmp, path)
+
+    def _open_segment(self, number):
+        self._active_number = number
+        self._active_file = open(self._segment_path(number), "a")
+        self._summary_file = open(self._summary_path(number), "a")
+
+    def _write(self, record):
+        self._write_many([record])
+
+    def _write_many(self, records):
+        """Appends records with a single flush and upload (they may overshoot the segment size)."""
+        with self._lock:
+            for record in records:
+                self._append(self._active_file, self._summary_file, record)
+            self._active_file.flush()
+            self._summary_file.flush()
+            number = self._active_number
+            if self._active_file.tell() >= self.max_segment_bytes:
+                self._rotate()
+        self._upload_segment(number)
+
+    def _rotate(self):
+        """Seals the active segment and starts a new one. Caller holds self._lock."""
+        self._active_file.close()
+        self._summary_file.close()
+        self._open_segment(self._active_number + 1)
+
+    # -- backend interface -----------------------------------------------
+
+    def load(self, lazy=False):
+        """Rebuilds the request list (newest first) by replaying all segments.
+
+        With lazy, only the summary sidecars are replayed and the returned
+        entries are summaries (see fetch() and iter_full()).
+        """
+        numbers = self._segment_numbers()
+        if not numbers:
+            self._restore_from_gcs(lazy)
+            numbers = sorted(set(self._segment_numbers()) | self._remote_only)
+
+        state = OrderedDict()
+        if numbers:
+            for number in numbers:
+                if number not in self._remote_only:
+                    self._ensure_summary(number)
+            if lazy:
+                for number in numbers:
+                    self._dead_records += self._replay_file(self._summary_path(number), state, number)
+            else:
+                for number in numbers:
+                    self._ensure_local(number)
+                    self._dead_records += self._replay_file(self._segment_path(number), state)
+                self._hydrated = True
+            logger.info(f"Replayed {len(numbers)} log segments from {self.directory}: {len(state)} requests")
+            self._open_segment(numbers[-1])
+        else:
+            self._open_segment(1)
+            self._hydrated = True
+            if self.legacy_backend is not None:
+                # One-off migration from the single-document requests.json format
+                legacy = self.legacy_backend.load()
+                for entry in reversed(legacy):
+                    state[entry["id"]] = entry
+                if state:
+                    with self._lock:
+                        for entry in state.values():
+                            self._append(self._active_file, self._summary_file, {"op": "put", "entry": entry})
+                        self._active_file.flush()
+                        self._summary_file.flush()
+                    self._upload_segment(self._active_number)
+                    logger.info(f"Migrated {len(state)} requests from legacy storage into {self.directory}")
+
+        self._start_compactor()
+        entries = list(reversed(state.values()))
+        self.ids.seed(entries)
+        return entries
+
+    def fetch(self, summary):
+        """Reads the full record behind a summary entry returned by a lazy load."""
+        number, offset = summary["_loc"]
+        self._ensure_local(number)
+        with open(self._segment_path(number), "rb") as f:
+            f.seek(offset)
+            line = f.readline()
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = {}
+        if record.get("op") == "put" and record["entry"]["id"] == summary["id"]:
+            return record["entry"]
+        # The offset no longer points at the record; fall back to a full replay
+        logger.warning(f"Stale location for request {summary['id']}, replaying the log")
+        for entry in self.iter_full():
+            if entry["id"] == summary["id"]:
+                return entry
+        return None
+
+    def iter_full(self):
+        """Yields every live full record (newest first), downloading deferred segments first."""
+        state = OrderedDict()
+        for number in sorted(set(self._segment_numbers()) | self._remote_only):
+            self._ensure_local(number)
+            self._replay_file(self._segment_path(number), state)
+        for entry in reversed(state.values()):
+            yield entry
+
+    def mark_hydrated(self):
+        """Called once no summary from a lazy load is in use any more; unblocks compaction."""
+        self._hydrated = True
+
+    def insert(self, entry):
+        """Assigns the entry's ID, appends it to the log and returns the ID."""
+        request_id = self.ids.assign(entry)
+        self._write({"op": "put", "entry": entry})
+        return request_id
+
+    def insert_many(self, entries):
+        """Assigns IDs to entries (oldest first) and appends them with a single flush; returns the IDs."""
+        ids = [self.ids.assign(entry) for entry in entries]
+        self._write_many([{"op": "put", "entry": entry} for entry in entries])
+        return ids
+
+    def rewrite(self, entries):
+        """Appends new versions of already stored entries; the old ones become dead records."""
+        self._write_many([{"op": "put", "entry": entry} for entry in entries])
+        self._dead_records += len(entries)
+
+    def delete(self, request_id):
+        self._write({"op": "del", "id": request_id})
+        self._dead_records += 1
+
+    def delete_many(self, request_ids):
+        """Writes the tombstones of several requests with a single flush and upload."""
+        self._write_many([{"op": "del", "id": request_id} for request_id in request_ids])
+        self._dead_records += len(request_ids)
+
+    def clear(self):
+        self._write({"op": "clear"})
+        self._dead_records += 1
+
+    def save_all(self, entries):
+        """Writes a full snapshot (clear + puts) and compacts everything before it."""
+        with self._lock:
+            self._append(self._active_file, self._summary_file, {"op": "clear"})
+            for entry in reversed(entries):
+                self._append(self._active_file, self._summary_file, {"op": "put", "entry": entry})
+            self._active_file.flush()
+            self._summary_file.flush()
+            self._rotate()
+        self._dead_records += 1
+        self.compact()
+
+    def changes(self):
+        """Changes made by other processes since the last call (none: the log is single-process)."""
+        return []
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            for f in (self._active_file, self._summary_file):
+                if f and not f.closed:
+                    f.close()
+
+    # -- compaction ------------------------------------------------------
+
+    def _start_compactor(self):
+        if self.compaction_interval <= 0 or self._compactor is not None:
+            return
+        self._compactor = threading.Thread(target=self._compaction_loop, name="log-compactor", daemon=True)
+        self._compactor.start()
+
+    def _compaction_loop(self):
+        while not self._stop.wait(self.compaction_interval):
+            self.compact_if_due()
+
+    def compact_if_due(self):
+        """Compacts when there are dead records or compaction_min_segments sealed segments."""
+        sealed = [n for n in self._segment_numbers() if n != self._active_number]
+        if self._dead_records or len(sealed) >= self.compaction_min_segments:
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting request log {self.directory}: {e}")
+
+    def compact(self):
+        """Folds all sealed segments into one snapshot segment.
+
+        The snapshot starts with a "clear" record and atomically replaces the
+        newest sealed segment, so a crash before the older segments are removed
+        still replays to the same state. Skipped until every segment is local
+        and summaries handed out by a lazy load were hydrated (their offsets
+        would go stale).
+        """
+        if not self._hydrated or self._remote_only:
+            return
+        with self._compaction_lock:
+            with self._lock:
+                if self._active_file.tell() > 0:
+                    self._rotate()
+                active = self._active_number
+                dead = self._dead_records
+            sealed = [n for n in self._segment_numbers() if n < active]
+            if not sealed:
+                return
+
+            state = OrderedDict()
+            for number in sealed:
+                self._replay_file(self._segment_path(number), state)
+
+            target = sealed[-1]
+            segment_tmp = self._segment_path(target) + ".tmp"
+            summary_tmp = self._summary_path(target) + ".tmp"
+            with open(segment_tmp, "w") as segment, open(summary_tmp, "w") as summary:
+                self._append(segment, summary, {"op": "clear"})
+                for entry in state.values():
+                    self._append(segment, summary, {"op": "put", "entry": entry})
+            os.replace(segment_tmp, self._segment_path(target))
+            os.replace(summary_tmp, self._summary_path(target))
+            self._upload_segment(target)
+
+            for number in sealed[:-1]:
+                for path in (self._segment_path(number), self._summary_path(number)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._delete_remote_segment(number)
+
+            self._dead_records = max(0, self._dead_records - dead)
+            logger.info(f"Compacted {len(sealed)} log segments into segment {target}: {len(state)} live requests")
+
+
+def shard_names(directory, bucket=None, prefix="", suffix=""):
+    """Names of the shards stored as directory/<name><suffix> locally or as
+    prefix<name><suffix>[/...] in the bucket."""
+    names = set()
+    if os.path.isdir(directory):
+        for entry in os.listdir(directory):
+            if entry.endswith(suffix) and not entry.startswith("."):
+                names.add(entry[:len(entry) - len(suffix)] if suffix else entry)
+    if bucket is not None:
+        try:
+            for blob in bucket.list_blobs(prefix=prefix):
+                first = blob.name[len(prefix):].split("/", 1)[0]
+                if first.endswith(suffix):
+                    names.add(first[:len(first) - len(suffix)] if suffix else first)
+        except Exception as e:
+            logger.error(f"Error listing shards under {prefix} in GCS: {e}")
+    names.discard("")
+    return sorted(names)
+
+
+class ShardedBackend:
+    """Routes every request to the backend of its shard (one per arrendador).
+
+    factory(name) builds the backend of a shard, names() lists the shards
+    already stored and shard_of(entry) names the shard of a request. Shards
+    are written, loaded and compacted on their own, so a write costs what
+    one arrendador's data costs; they draw IDs from one IdSequence, so IDs
+    stay unique across shards. With no shard stored yet, the first load
+    splits the requests of legacy_backend (the unsharded store) into shards.
+    Callers serialize the writes to each shard (app.py holds its view lock).
+    """
+
+    def __init__(self, factory, names, shard_of, legacy_backend=None, compaction_interval=0):
+        self.factory = factory
+        self.names = names
+        self.shard_of = shard_of
+        self.legacy_backend = legacy_backend
+        self.compaction_interval = compaction_interval
+        self.ids = IdSequence()
+
+        self._backends = {}     # shard name -> backend
+        self._owners = {}       # request ID -> shard name
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._compactor = None
+
+    def _backend(self, name, load=True):
+        """The backend of a shard, created (and, with load, loaded empty) on first use."""
+        with self._lock:
+            backend = self._backends.get(name)
+            if backend is None:
+                backend = self._backends[name] = self.factory(name)
+                backend.ids = self.ids
+                if load:
+                    backend.load()
+            return backend
+
+    def _groups(self, entries):
+        groups = OrderedDict()
+        for entry in entries:
+            groups.setdefault(self.shard_of(entry), []).append(entry)
+        return groups
+
+    def _owner_groups(self, request_ids):
+        groups = OrderedDict()
+        for request_id in request_ids:
+            name = self._owners.pop(request_id, None)
+            if name is not None:
+                groups.setdefault(name, []).append(request_id)
+        return groups
+
+    def load(self, lazy=False):
+        """Loads every shard and returns their requests merged newest first."""
+        names = self.names()
+        if not names and self.legacy_backend is not None:
+            return self._migrate()
+        lists = []
+        for name in names:
+            entries = self._backend(name, load=False).load(lazy=lazy)
+            for entry in entries:
+                self._owners[entry["id"]] = name
+            lists.append(entries)
+        self._start_compactor()
+        logger.info(f"Loaded {len(names)} shards: {sum(len(entries) for entries in lists)} requests")
+        return list(heapq.merge(*lists, key=lambda entry: -entry["id"]))
+
+    def _migrate(self):
+        """One-off split of the unsharded store into shards (which is left as it was)."""
+        entries = self.legacy_backend.load()
+        self.legacy_backend.close()
+        self.ids.seed(entries)
+        groups = self._groups(entries)
+        for name, group in groups.items():
+            self._backend(name).save_all(group)
+            for entry in group:
+                self._owners[entry["id"]] = name
+        if entries:
+            logger.info(f"Migrated {len(entries)} requests from the unsharded store into {len(groups)} shards")
+        self._start_compactor()
+        return entries
+
+    def fetch(self, summary):
+        return self._backend(self.shard_of(summary)).fetch(summary)
+
+    def iter_full(self):
+        """Yields every live full record, newest first across shards."""
+        with self._lock:
+            backends = list(self._backends.values())
+        return heapq.merge(*(backend.iter_full() for backend in backends), key=lambda entry: -entry["id"])
+
+    def mark_hydrated(self):
+        with self._lock:
+            backends = list(self._backends.values())
+        for backend in backends:
+            backend.mark_hydrated()
+
+    def insert(self, entry):
+        name = self.shard_of(entry)
+        request_id = self._backend(name).insert(entry)
+        self._owners[request_id] = name
+        return request_id
+
+    def insert_many(self, entries):
+        """Inserts entries (oldest first) with one write per shard; returns the IDs in entries' order."""
+        for name, group in self._groups(entries).items():
+            for request_id in self._backend(name).insert_many(group):
+                self._owners[request_id] = name
+        return [entry["id"] for entry in entries]
+
+    def rewrite(self, entries):
+        for name, group in self._groups(entries).items():
+            self._backend(name).rewrite(group)
+
+    def delete(self, request_id):
+        self.delete_many([request_id])
+
+    def delete_many(self, request_ids):
+        for name, ids in self._owner_groups(request_ids).items():
+            self._backend(name).delete_many(ids)
+
+    def clear(self):
+        with self._lock:
+            backends = list(self._backends.values())
+            self._owners = {}
+        for backend in backends:
+            backend.clear()
+
+    def save_all(self, entries):
+        """Writes a full snapshot of every shard (empty for shards entries has nothing of)."""
+        groups = self._groups(entries)
+        with self._lock:
+            names = set(self._backends)
+        for name in sorted(names | set(groups)):
+            self._backend(name).save_all(groups.get(name, []))
+        self._owners = {entry["id"]: name for name, group in groups.items() for entry in group}
+
+    def changes(self):
+        """Changes made by other processes since the last call (none: shards are single-process)."""
+        return []
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            backends = list(self._backends.values())
+        for backend in backends:
+            backend.close()
+
+    def _start_compactor(self):
+        """One thread compacts every shard that needs it (rather than a thread per shard)."""
+        if self.compaction_interval <= 0 or self._compactor is not None:
+            return
+        self._compactor = threading.Thread(target=self._compaction_loop, name="shard-compactor", daemon=True)
+        self._compactor.start()
+
+    def _compaction_loop(self):
+        while not self._stop.wait(self.compaction_interval):
+            with self._lock:
+                backends = list(self._backends.values())
+            for backend in backends:
+                if hasattr(backend, "compact_if_due"):
+                    backend.compact_if_due()
+
+
+class SqliteBackend:
+    """SQLite (WAL mode) backend that several worker processes can share.
+
+    IDs come from an AUTOINCREMENT key, so they are monotonic across
+    processes and never reused after a delete. Every mutation also appends
+    to a changes table; each process polls it (changes()) to fold other
+    workers' writes into its in-memory view. Each row also stores its
+    summarize_entry() form so a lazy load does not read the full bodies.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            body TEXT NOT NULL,
+            summary TEXT
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            request_id INTEGER
+        );
+    """
+
+    def __init__(self, path, bucket_getter=None, uploader=None, legacy_backend=None,
+                 changes_retention=10000, gcs_name=None):
+        self.path = path
+        self.bucket_getter = bucket_getter
+        self.uploader = uploader
+        self.legacy_backend = legacy_backend
+        self.changes_retention = changes_retention
+        self.gcs_name = gcs_name or os.path.basename(path)
+        self._local = threading.local()
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+
+    def _connect(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            # Autocommit mode; write methods open explicit transactions
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA busy_timeout=30000")
+            self._local.con = con
+        return con
+
+    def _transaction(self):
+        """Context manager for a write transaction (BEGIN IMMEDIATE takes the write lock up front)."""
+        backend = self
+
+        class Transaction:
+            def __enter__(self):
+                self.con = backend._connect()
+                self.con.execute("BEGIN IMMEDIATE")
+                return self.con
+
+            def __exit__(self, exc_type, exc, tb):
+                self.con.execute("ROLLBACK" if exc_type else "COMMIT")
+                return False
+
+        return Transaction()
+
+    @staticmethod
+    def _decode(row):
+        entry = json.loads(row[1])
+        entry["id"] = row[0]
+        return entry
+
+    def _encode(self, entry):
+        return json.dumps({k: v for k, v in entry.items() if k != "id"}, separators=(",", ":"))
+
+    def _encode_summary(self, entry):
+        return self._encode(summarize_entry(entry))
+
+    def _migrate_schema(self, con):
+        """Adds the summary column to databases created before it existed."""
+        columns = [row[1] for row in con.execute("PRAGMA table_info(requests)")]
+        if "summary" not in columns:
+            con.execute("ALTER TABLE requests ADD COLUMN summary TEXT")
+
+    def _restore_from_gcs(self):
+        """Fetches the last uploaded database when the local file is missing (fresh container)."""
+        bucket = self.bucket_getter() if self.bucket_getter else None
+        if not bucket:
+            return
+        try:
+            blob = bucket.blob(self.gcs_name)
+            if not blob.exists():
+                return
+            tmp = f"{self.path}.{os.getpid()}.download"
+            blob.download_to_filename(tmp)
+            try:
+                # Several workers may race here; only the first download is kept
+                os.link(tmp, self.path)
+                logger.info(f"Restored {self.path} from GCS bucket {bucket.name}")
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        except Exception as e:
+            logger.error(f"Error restoring {self.path} from GCS: {e}")
+
+    def load(self, lazy=False):
+        """Returns all requests (newest first), creating/migrating the database if needed.
+
+        With lazy, the returned entries are summaries (see fetch() and iter_full()).
+        """
+        if not os.path.exists(self.path):
+            self._restore_from_gcs()
+        con = self._connect()
+        con.executescript(self.SCHEMA)
+        with self._transaction() as tx:
+            self._migrate_schema(tx)
+            missing = tx.execute("SELECT id, body FROM requests WHERE summary IS NULL").fetchall()
+            tx.executemany(
+                "UPDATE requests SET summary = ? WHERE id = ?",
+                [(self._encode_summary(self._decode(row)), row[0]) for row in missing],
+            )
+
+        with self._transaction() as tx:
+            empty = tx.execute("SELECT NOT EXISTS (SELECT 1 FROM requests) AND NOT EXISTS (SELECT 1 FROM changes)").fetchone()[0]
+            if empty and self.legacy_backend is not None:
+                # One-off migration, done inside the write lock so only one worker imports
+                legacy = self.legacy_backend.load()
+                for entry in reversed(legacy):
+                    tx.execute(
+                        "INSERT OR REPLACE INTO requests (id, body, summary) VALUES (?, ?, ?)",
+                        (entry["id"], self._encode(entry), self._encode_summary(entry)),
+                    )
+                if legacy:
+                    logger.info(f"Migrated {len(legacy)} requests from legacy storage into {self.path}")
+            with self._seq_lock:
+                self._seq = tx.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            column = "summary" if lazy else "body"
+            rows = tx.execute(f"SELECT id, {column} FROM requests ORDER BY id DESC").fetchall()
+
+        entries = [self._decode(row) for row in rows]
+        logger.info(f"Loaded {len(entries)} requests from SQLite database {self.path}")
+        return entries
+
+    def fetch(self, summary):
+        """Reads the full record behind a summary entry returned by a lazy load."""
+        row = self._connect().execute("SELECT id, body FROM requests WHERE id = ?", (summary["id"],)).fetchone()
+        return self._decode(row) if row else None
+
+    def iter_full(self, batch_size=500):
+        """Yields every full record, newest first."""
+        cursor = self._connect().execute("SELECT id, body FROM requests ORDER BY id DESC")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield self._decode(row)
+
+    def mark_hydrated(self):
+        pass
+
+    def insert(self, entry):
+        """Inserts the entry, assigning its ID from the database sequence; returns the ID."""
+        body = self._encode(entry)
+        summary = self._encode_summary(dict(entry, id=None))
+        with self._transaction() as tx:
+            request_id = tx.execute("INSERT INTO requests (body, summary) VALUES (?, ?)", (body, summary)).lastrowid
+            tx.execute("INSERT INTO changes (op, request_id) VALUES ('put', ?)", (request_id,))
+        entry["id"] = request_id
+        self._persist()
+        return request_id
+
+    def insert_many(self, entries):
+        """Inserts entries (oldest first) in one transaction; returns the assigned IDs."""
+        rows = [(self._encode(entry), self._encode_summary(dict(entry, id=None))) for entry in entries]
+        ids = []
+        with self._transaction() as tx:
+            for body, summary in rows:
+                request_id = tx.execute("INSERT INTO requests (body, summary) VALUES (?, ?)", (body, summary)).lastrowid
+                tx.execute("INSERT INTO changes (op, request_id) VALUES ('put', ?)", (request_id,))
+                ids.append(request_id)
+        for entry, request_id in zip(entries, ids):
+            entry["id"] = request_id
+        self._persist()
+        return ids
+
+    def rewrite(self, entries):
+        """Updates already stored entries in place; rows deleted meanwhile stay deleted."""
+        with self._transaction() as tx:
+            tx.executemany(
+                "UPDATE requests SET body = ?, summary = ? WHERE id = ?",
+                [(self._encode(entry), self._encode_summary(entry), entry["id"]) for entry in entries],
+            )
+        self._persist()
+
+    def delete(self, request_id):
+        with self._transaction() as tx:
+            tx.execute("DELETE FROM requests WHERE id = ?", (request_id,))
+            tx.execute("INSERT INTO changes (op, request_id) VALUES ('del', ?)", (request_id,))
+        self._persist()
+
+    def delete_many(self, request_ids):
+        rows = [(request_id,) for request_id in request_ids]
+        with self._transaction() as tx:
+            tx.executemany("DELETE FROM requests WHERE id = ?", rows)
+            tx.executemany("INSERT INTO changes (op, request_id) VALUES ('del', ?)", rows)
+        self._persist()
+
+    def clear(self):
+        with self._transaction() as tx:
+            tx.execute("DELETE FROM requests")
+            tx.execute("INSERT INTO changes (op) VALUES ('clear')")
+        self._persist()
+
+    def save_all(self, entries):
+        with self._transaction() as tx:
+            tx.execute("DELETE FROM requests")
+            tx.executemany(
+                "INSERT INTO requests (id, body, summary) VALUES (?, ?, ?)",
+                [(entry["id"], self._encode(entry), self._encode_summary(entry)) for entry in reversed(entries)],
+            )
+            tx.execute("INSERT INTO changes (op) VALUES ('reload')")
+        self._persist()
+
+    def changes(self):
+        """Changes committed by any process since the last call.
+
+        Returns a list of (op, payload) tuples: ("put", entry), ("del", id),
+        ("clear", None), or None if this process fell too far behind and must
+        reload everything.
+        """
+        con = self._connect()
+        with self._seq_lock:
+            since = self._seq
+            latest = con.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            if latest == since:
+                return []
+            oldest = con.execute("SELECT COALESCE(MIN(seq), 0) FROM changes").fetchone()[0]
+            self._seq = latest
+            if oldest > since + 1:
+                return None
+            rows = con.execute(
+                "SELECT c.op, c.request_id, r.body FROM changes c LEFT JOIN requests r ON r.id = c.request_id "
+                "WHERE c.seq > ? AND c.seq <= ? ORDER BY c.seq",
+                (since, latest),
+            ).fetchall()
+
+        result = []
+        for op, request_id, body in rows:
+            if op == "reload":
+                return None
+            if op == "put":
+                # The row may already be gone again; the later 'del' change handles that
+                if body is not None:
+                    result.append(("put", self._decode((request_id, body))))
+            elif op == "del":
+                result.append(("del", request_id))
+            elif op == "clear":
+                result.append(("clear", None))
+        return result
+
+    def _persist(self):
+        """Prunes the change feed and schedules a (coalesced) database upload."""
+        con = self._connect()
+        con.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (self.changes_retention,))
+        if self.uploader:
+            self.uploader.upload_string(self.gcs_name, self._snapshot_bytes, content_type='application/vnd.sqlite3')
+
+    def _snapshot_bytes(self):
+        """A consistent copy of the database (WAL included) made with the backup API."""
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.snapshot"
+        try:
+            source = sqlite3.connect(self.path)
+            dest = sqlite3.connect(tmp)
+            source.backup(dest)
+            dest.close()
+            source.close()
+            with open(tmp, "rb") as f:
+                return f.read()
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def close(self):
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None